@@ -2,11 +2,17 @@
 import os
 import logging
 import asyncio
-from azure.ai.projects import AIProjectClient
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import Any, Callable, Dict, Optional
+import aiohttp
+from azure.ai.projects.aio import AIProjectClient
 from azure.ai.projects.models import BingGroundingTool, ToolSet, FunctionTool, CodeInterpreterTool
-from azure.ai.inference import ChatCompletionsClient
-from azure.identity import DefaultAzureCredential
+from azure.ai.inference.aio import ChatCompletionsClient
+from azure.identity.aio import DefaultAzureCredential
 from azure.core.exceptions import ResourceNotFoundError
+from azure.core.pipeline.transport import AioHttpTransport
 from opentelemetry import trace
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
@@ -23,11 +29,117 @@ tracer = trace.get_tracer(__name__)
 project_client = None
 chat_client = None
 toolset = None
+credential = None
+
+# "probe" checks the project endpoint during startup; "lazy" skips the check so
+# workers come up immediately. Either way the token is pre-fetched in the background.
+CLIENT_STARTUP_MODE = os.getenv("CLIENT_STARTUP_MODE", "probe")
+READINESS_CACHE_SECONDS = float(os.getenv("READINESS_CACHE_SECONDS", "60"))
+TOKEN_SCOPE = "https://cognitiveservices.azure.com/.default"
+
+# Last readiness probe result, reused until it is READINESS_CACHE_SECONDS old
+_readiness = {"ready": None, "error": None, "checked_at": None}
+_readiness_lock = asyncio.Lock()
+
+# Background token pre-fetch started by init_clients
+_token_task: Optional[asyncio.Task] = None
+
+# The clients are the async (.aio) SDK variants. Anything that only has a
+# blocking API runs on this bounded pool instead of on the event loop, so a
+# slow call cannot stall other requests or spawn unbounded threads.
+SDK_EXECUTOR_WORKERS = int(os.getenv("SDK_EXECUTOR_WORKERS", "8"))
+_sdk_executor = ThreadPoolExecutor(max_workers=SDK_EXECUTOR_WORKERS, thread_name_prefix="azure-sdk")
+
+# One pooled aiohttp session is shared by every SDK client, so connections
+# and TLS sessions to the same endpoints are reused across clients
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "100"))
+HTTP_POOL_SIZE_PER_HOST = int(os.getenv("HTTP_POOL_SIZE_PER_HOST", "32"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "60"))
+_http_session: Optional[aiohttp.ClientSession] = None
+
+def get_transport() -> AioHttpTransport:
+    """
+    Return a transport over the shared HTTP session, creating the session on first use.
+
+    Must be called from the event loop. Closing a client closes only its
+    transport wrapper; the session is closed by close_clients().
+    """
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=HTTP_POOL_SIZE,
+                limit_per_host=HTTP_POOL_SIZE_PER_HOST,
+                keepalive_timeout=HTTP_KEEPALIVE_SECONDS,
+                ttl_dns_cache=300
+            ),
+            trust_env=True  # Honor HTTPS_PROXY like the SDK's default transport
+        )
+    return AioHttpTransport(session=_http_session, session_owner=False)
+
+async def run_blocking(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a blocking SDK call on the bounded SDK executor and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_sdk_executor, partial(func, *args, **kwargs))
+
+async def warm_credential(credential) -> None:
+    """Fetch a token ahead of the first request so it is cached by the credential."""
+    started = time.perf_counter()
+    try:
+        await credential.get_token(TOKEN_SCOPE)
+        logger.info(f"🔑 Token pre-fetched in {(time.perf_counter() - started) * 1000:.0f} ms")
+    except Exception as e:
+        # The first real request fetches the token again and reports the error
+        logger.warning(f"⚠️ Token pre-fetch failed: {str(e)}")
+
+@lru_cache(maxsize=None)
+def get_f1_evaluator():
+    """Create the F1 score evaluator on first use; importing azure.ai.evaluation is slow."""
+    from azure.ai.evaluation import F1ScoreEvaluator
+    return F1ScoreEvaluator()
+
+async def check_readiness(force: bool = False) -> dict:
+    """
+    Check that the AI Foundry project endpoint answers, caching the result.
+
+    Lists at most one agent, a single cheap read that creates nothing.
+
+    Args:
+        force (bool): Probe even if a recent result is cached
+
+    Returns:
+        dict: ready flag, error message if any, and when the check ran
+    """
+    async with _readiness_lock:
+        checked_at = _readiness["checked_at"]
+        if not force and checked_at is not None and time.monotonic() - checked_at < READINESS_CACHE_SECONDS:
+            return dict(_readiness)
+
+        if project_client is None:
+            _readiness.update(ready=False, error="Clients are not initialized")
+        else:
+            try:
+                await project_client.agents.list_agents(limit=1)
+                _readiness.update(ready=True, error=None)
+            except Exception as e:
+                logger.warning(f"⚠️ Azure AI Foundry readiness probe failed: {str(e)}")
+                _readiness.update(ready=False, error=str(e))
+        _readiness["checked_at"] = time.monotonic()
+        return dict(_readiness)
 
 async def init_clients():
     """Initialize Azure AI clients asynchronously."""
-    global project_client, chat_client, toolset
+    global project_client, chat_client, toolset, credential, _token_task
     
+    timings: Dict[str, float] = {}
+    started = phase = time.perf_counter()
+
+    def lap(name: str) -> None:
+        nonlocal phase
+        now = time.perf_counter()
+        timings[name] = (now - phase) * 1000
+        phase = now
+
     try:
         # Check required environment variables
         deployment_name = os.getenv('MODEL_DEPLOYMENT_NAME')
@@ -51,30 +163,36 @@ async def init_clients():
             raise ValueError("Azure project name (spn_4o_AZURE_PROJECT_NAME) not found")
 
         # Initialize Azure credentials
-        credential = DefaultAzureCredential()
+        credential = await run_blocking(DefaultAzureCredential, transport=get_transport())
+        lap("credential")
 
-        # Initialize project client
-        project_client = AIProjectClient(
+        # The token is fetched in the background while the clients are built
+        _token_task = asyncio.create_task(warm_credential(credential))
+
+        # Initialize project and chat clients concurrently
+        project_client, chat_client = await asyncio.gather(run_blocking(
+            AIProjectClient,
             endpoint=project_endpoint,
             credential=credential,
             subscription_id=subscription_id,
             resource_group_name=resource_group,
             project_name=project_name,
+            transport=get_transport(),
             headers={
                 "x-ms-enable-preview": "true",
                 "api-version": os.getenv("spn_4o_api_version", "2024-02-15-preview")
             }
-        )
-        
-        # Initialize chat client
-        chat_client = ChatCompletionsClient(
+        ), run_blocking(
+            ChatCompletionsClient,
             endpoint=project_endpoint,
             credential=credential,
+            transport=get_transport(),
             headers={
                 "x-ms-enable-preview": "true",
                 "api-version": os.getenv("spn_4o_api_version", "2024-02-15-preview")
             }
-        )
+        ))
+        lap("clients")
         
         # Initialize toolset with Bing grounding
         bing_api_key = os.getenv("spn_4o_BING_API_KEY")
@@ -86,21 +204,24 @@ async def init_clients():
             connection_id=bing_api_key
         )
         toolset.add(bing_tool)
+        lap("toolset")
         
-        # Test clients by creating a simple agent
-        test_agent = await project_client.agents.create_agent(
-            model=deployment_name,
-            instructions="Test agent for connection verification.",
-            toolset=toolset,
-            headers={"x-ms-enable-preview": "true"}
-        )
+        # The probe runs while the token pre-fetch is still in flight
+        readiness = {"ready": None}
+        if CLIENT_STARTUP_MODE == "probe":
+            readiness = await check_readiness(force=True)
+            lap("probe")
+
+        breakdown = ", ".join(f"{name} {ms:.0f} ms" for name, ms in timings.items())
+        logger.info(f"⏱️ Client startup took {(time.perf_counter() - started) * 1000:.0f} ms ({breakdown})")
         
         # Log successful initialization
         logger.info(f"""✨ Successfully initialized Azure AI clients:
         Endpoint: {project_endpoint}
         Model Deployment: {deployment_name}
         API Version: {os.getenv("spn_4o_api_version", "2024-02-15-preview")}
-        Test Agent ID: {test_agent.id}
+        Startup Mode: {CLIENT_STARTUP_MODE}
+        Ready: {readiness["ready"]}
         Tools: {[type(tool).__name__ for tool in toolset._tools]}""")
         
         return project_client, chat_client, toolset
@@ -109,10 +230,26 @@ async def init_clients():
         logger.error(f"❌ Error initializing Azure AI Foundry clients: {str(e)}")
         raise
 
+async def close_clients():
+    """Close the async clients, the credential and the shared HTTP session."""
+    global project_client, chat_client, credential, _http_session
+    if _token_task is not None:
+        _token_task.cancel()
+    for client in (project_client, chat_client, credential):
+        if client is not None:
+            await client.close()
+    project_client = chat_client = credential = None
+    if _http_session is not None:
+        await _http_session.close()
+        _http_session = None
+
 async def ensure_clients():
     """Ensure clients are initialized."""
     global project_client, chat_client, toolset
     if project_client is None or chat_client is None:
         project_client, chat_client, toolset = await init_clients()
 
-__all__ = ['project_client', 'chat_client', 'toolset', 'tracer', 'ensure_clients']
+__all__ = [
+    'project_client', 'chat_client', 'toolset', 'tracer', 'ensure_clients', 'close_clients',
+    'check_readiness', 'get_f1_evaluator', 'run_blocking', 'get_transport'
+]
@@ -0,0 +1,559 @@
+"""
+SQLite storage engine exposing the same operations as database_stub.
+
+Selected with STORAGE_BACKEND=sqlite. The database runs in WAL mode so several
+uvicorn worker processes can share one file: readers never block the single
+writer. Each collection is a table holding the item as JSON, plus one real,
+indexed column per field declared in database_stub.INDEXES.
+
+Every operation is blocking and a write may wait up to busy_timeout for
+another process to release the write lock, so async code runs them in a
+thread (asyncio.to_thread) and handlers that only touch storage are plain
+def functions, which FastAPI runs in its thread pool.
+"""
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+from datetime import datetime
+from enum import Enum
+import asyncio
+import json
+import logging
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import numpy as np
+
+import database_stub
+from database_stub import StorageException, INDEXES, CHANGE_FEED_SIZE, allocate_ids
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "memory")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "data/drug_discovery.db")
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "8"))
+
+# Rows fetched per keyset query while iterating over a collection
+ITER_PAGE_SIZE = 500
+
+# Seconds between change feed polls while watching; other processes writing
+# to the same file cannot wake in-process watchers directly
+CHANGE_POLL_INTERVAL = 0.5
+
+COLLECTIONS = list(database_stub.storage)
+
+def _indexed_fields(collection: str) -> List[str]:
+    declared = INDEXES.get(collection, {})
+    return declared.get("hash", []) + declared.get("sorted", [])
+
+def _column_fields(collection: str, kind: str, fields: Iterable[str]) -> None:
+    declared = INDEXES.get(collection, {}).get("columns", {}).get(kind, [])
+    for field in fields:
+        if field not in declared:
+            raise StorageException(f"No column for {collection}.{field}")
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists but belongs to another user, or cannot be checked here
+        return True
+    return True
+
+def _column_value(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (str, int, float)) or value is None:
+        return value
+    return json.dumps(value, default=str)
+
+class SQLiteStorage:
+    """Collections stored as SQLite tables, shared through a connection pool."""
+
+    def __init__(self, path: str, pool_size: int = 8):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(pool_size):
+            self._pool.put(self._connect())
+
+        # SQL is built once per collection so every call reuses the same
+        # statement text and hits sqlite3's per-connection statement cache
+        self._sql: Dict[str, Dict[str, str]] = {}
+        with self._connection() as conn:
+            for collection in COLLECTIONS:
+                self._create_table(conn, collection)
+                self._sql[collection] = self._build_statements(collection)
+            # Change feed shared by all collections; seq is the change sequence number
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS "changes" ('
+                'seq INTEGER PRIMARY KEY AUTOINCREMENT, collection TEXT NOT NULL, '
+                'op TEXT NOT NULL, id TEXT NOT NULL, data TEXT)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS "idx_changes_collection" ON "changes" (collection, seq)')
+            # Worker numbers in generated IDs, one per process sharing the file
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS "workers" ('
+                'worker_id INTEGER PRIMARY KEY, host TEXT NOT NULL, pid INTEGER NOT NULL, claimed_at TEXT NOT NULL)'
+            )
+
+        self.worker_id = self._claim_worker_id()
+        database_stub.set_worker_id(self.worker_id)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=30,
+            isolation_level=None,  # Transactions are managed explicitly
+            check_same_thread=False,
+            cached_statements=256
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def _claim_worker_id(self) -> int:
+        """
+        Reserve a worker number for the IDs this process generates.
+
+        Each number is recorded with the host and PID holding it, inside a
+        write transaction, so processes sharing the file never get the same
+        one. Numbers held by processes that have exited are reused.
+        STORAGE_WORKER_ID asks for a specific number, which fails while a
+        live process holds it.
+        """
+        host, pid = socket.gethostname(), os.getpid()
+        limit = 1 << database_stub.IdAllocator.WORKER_BITS
+        with self._transaction() as conn:
+            holders = {
+                worker_id: (holder_host, holder_pid)
+                for worker_id, holder_host, holder_pid in conn.execute('SELECT worker_id, host, pid FROM "workers"')
+            }
+
+            def available(worker_id: int) -> bool:
+                holder = holders.get(worker_id)
+                return (
+                    holder is None
+                    or holder == (host, pid)
+                    or (holder[0] == host and not _pid_alive(holder[1]))
+                )
+
+            if database_stub.WORKER_ID is not None:
+                worker_id = database_stub.WORKER_ID
+                if not available(worker_id):
+                    raise StorageException(
+                        f"Worker number {worker_id} is held by process {holders[worker_id][1]} on "
+                        f"{holders[worker_id][0]}; give each worker its own STORAGE_WORKER_ID or leave it unset"
+                    )
+            else:
+                # Engines opened again in the same process keep its number
+                own = [worker_id for worker_id, holder in holders.items() if holder == (host, pid)]
+                worker_id = next(iter(own), None)
+                if worker_id is None:
+                    worker_id = next((candidate for candidate in range(limit) if available(candidate)), None)
+                if worker_id is None:
+                    raise StorageException(f"All {limit} worker numbers are held by live processes")
+            conn.execute(
+                'INSERT OR REPLACE INTO "workers" (worker_id, host, pid, claimed_at) VALUES (?, ?, ?, ?)',
+                (worker_id, host, pid, datetime.now().isoformat())
+            )
+        return worker_id
+
+    @contextmanager
+    def _connection(self):
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so read-modify-write
+        # sequences cannot interleave with writers in other processes
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _create_table(self, conn: sqlite3.Connection, collection: str) -> None:
+        columns = "".join(f', "{field}"' for field in _indexed_fields(collection))
+        conn.execute(
+            f'CREATE TABLE IF NOT EXISTS "{collection}" ('
+            f'seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL UNIQUE, data TEXT NOT NULL{columns})'
+        )
+        for field in _indexed_fields(collection):
+            conn.execute(
+                f'CREATE INDEX IF NOT EXISTS "idx_{collection}_{field}" ON "{collection}" ("{field}")'
+            )
+
+    def _build_statements(self, collection: str) -> Dict[str, str]:
+        fields = _indexed_fields(collection)
+        columns = ", ".join(["id", "data"] + [f'"{field}"' for field in fields])
+        placeholders = ", ".join("?" * (len(fields) + 2))
+        assignments = ", ".join(["data = ?"] + [f'"{field}" = ?' for field in fields])
+        return {
+            "insert": f'INSERT INTO "{collection}" ({columns}) VALUES ({placeholders})',
+            "get": f'SELECT data FROM "{collection}" WHERE id = ?',
+            "list": f'SELECT data FROM "{collection}" ORDER BY seq',
+            "update": f'UPDATE "{collection}" SET {assignments} WHERE id = ?',
+            "delete": f'DELETE FROM "{collection}" WHERE id = ?'
+        }
+
+    def _statement(self, collection: str, name: str) -> str:
+        if collection not in self._sql:
+            raise StorageException(f"Collection {collection} does not exist")
+        return self._sql[collection][name]
+
+    def _row(self, collection: str, item: dict) -> tuple:
+        return (
+            item["id"],
+            json.dumps(item, default=str),
+            *(_column_value(item.get(field)) for field in _indexed_fields(collection))
+        )
+
+    def _prepare(self, item: dict, item_id: Optional[str], created_at: str) -> dict:
+        if "id" not in item:
+            item["id"] = item_id
+        if "created_at" not in item:
+            item["created_at"] = created_at
+        return item
+
+    def add_item(self, collection: str, item: dict) -> dict:
+        """Add an item to a collection."""
+        return self.add_items(collection, [item])[0]
+
+    def add_items(self, collection: str, items: Iterable[dict]) -> List[dict]:
+        """Add several items to a collection in one transaction."""
+        sql = self._statement(collection, "insert")
+        items = list(items)
+        # IDs are time-ordered and carry the worker number, so processes
+        # sharing the database file can allocate them without coordination
+        new_ids = iter(allocate_ids(collection, sum("id" not in item for item in items)))
+        created_at = datetime.utcnow().isoformat()
+        items = [
+            self._prepare(item, None if "id" in item else next(new_ids), created_at)
+            for item in items
+        ]
+        rows = [self._row(collection, item) for item in items]
+        try:
+            with self._transaction() as conn:
+                conn.executemany(sql, rows)
+                self._record_changes(conn, collection, "add", [row[:2] for row in rows])
+        except sqlite3.IntegrityError as e:
+            raise StorageException(f"Duplicate item ID in {collection}: {str(e)}")
+        return items
+
+    def get_item(self, collection: str, item_id: str) -> Optional[dict]:
+        """Get an item from a collection by ID."""
+        sql = self._statement(collection, "get")
+        with self._connection() as conn:
+            row = conn.execute(sql, (item_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, collection: str, item_ids: Iterable[str]) -> Dict[str, dict]:
+        """Get several items from a collection in one call, keyed by ID. Missing IDs are skipped."""
+        self._statement(collection, "get")
+        with self._connection() as conn:
+            return self._get_many(conn, collection, list(item_ids))
+
+    def _get_many(self, conn: sqlite3.Connection, collection: str, item_ids: List[str]) -> Dict[str, dict]:
+        found: Dict[str, dict] = {}
+        # Stay below SQLite's bound-parameter limit
+        for start in range(0, len(item_ids), 500):
+            chunk = item_ids[start:start + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            rows = conn.execute(
+                f'SELECT data FROM "{collection}" WHERE id IN ({placeholders})', chunk
+            )
+            for (data,) in rows:
+                item = json.loads(data)
+                found[item["id"]] = item
+        return found
+
+    def list_items(self, collection: str) -> List[dict]:
+        """List all items in a collection."""
+        sql = self._statement(collection, "list")
+        with self._connection() as conn:
+            return [json.loads(data) for (data,) in conn.execute(sql)]
+
+    def query_items(
+        self,
+        collection: str,
+        equals: Optional[Dict[str, Any]] = None,
+        min_values: Optional[Dict[str, float]] = None
+    ) -> List[dict]:
+        """List items matching all filters on indexed columns, oldest first."""
+        where, params = self._filters(collection, equals, min_values)
+        with self._connection() as conn:
+            rows = conn.execute(f'SELECT data FROM "{collection}"{where} ORDER BY seq', params)
+            return [json.loads(data) for (data,) in rows]
+
+    def iter_items(
+        self,
+        collection: str,
+        equals: Optional[Dict[str, Any]] = None,
+        min_values: Optional[Dict[str, float]] = None,
+        after: Optional[int] = None
+    ) -> Iterator[Tuple[int, dict]]:
+        """Iterate over items matching all filters as (cursor, item) pairs, oldest first."""
+        where, params = self._filters(collection, equals, min_values)
+        where += " AND seq > ?" if where else " WHERE seq > ?"
+        sql = f'SELECT seq, data FROM "{collection}"{where} ORDER BY seq LIMIT {ITER_PAGE_SIZE}'
+        return self._iter_pages(sql, params, after if after is not None else 0)
+
+    def _iter_pages(self, sql: str, params: List[Any], cursor: int) -> Iterator[Tuple[int, dict]]:
+        while True:
+            # Each page is a keyset query on its own pooled connection, so a
+            # slow consumer never holds a connection or a read transaction
+            with self._connection() as conn:
+                rows = conn.execute(sql, [*params, cursor]).fetchall()
+            for cursor, data in rows:
+                yield cursor, json.loads(data)
+            if len(rows) < ITER_PAGE_SIZE:
+                return
+
+    def _filters(
+        self,
+        collection: str,
+        equals: Optional[Dict[str, Any]],
+        min_values: Optional[Dict[str, float]]
+    ) -> Tuple[str, List[Any]]:
+        self._statement(collection, "list")
+        declared = INDEXES.get(collection, {})
+        clauses = []
+        params: List[Any] = []
+        for field, value in (equals or {}).items():
+            if field not in declared.get("hash", []):
+                raise StorageException(f"No HashIndex on {collection}.{field}")
+            clauses.append(f'"{field}" = ?')
+            params.append(_column_value(value))
+        for field, value in (min_values or {}).items():
+            if field not in declared.get("sorted", []):
+                raise StorageException(f"No SortedIndex on {collection}.{field}")
+            clauses.append(f'"{field}" >= ?')
+            params.append(value)
+
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    def rank_items(self, collection: str, field: str, limit: int = 10, descending: bool = True) -> List[dict]:
+        """List the items with the highest (or lowest) values of a numeric column."""
+        self._statement(collection, "list")
+        _column_fields(collection, "numeric", [field])
+        direction = "DESC" if descending else "ASC"
+        with self._connection() as conn:
+            rows = conn.execute(
+                f'SELECT data FROM "{collection}" WHERE json_extract(data, ?) IS NOT NULL '
+                f'ORDER BY json_extract(data, ?) {direction}, seq LIMIT ?',
+                (f"$.{field}", f"$.{field}", limit)
+            )
+            return [json.loads(data) for (data,) in rows]
+
+    def column_histogram(
+        self,
+        collection: str,
+        field: str,
+        bins: int = 10,
+        value_range: Optional[tuple] = None
+    ) -> dict:
+        """Return a histogram of a numeric column as bin edges and counts."""
+        self._statement(collection, "list")
+        _column_fields(collection, "numeric", [field])
+        with self._connection() as conn:
+            rows = conn.execute(
+                f'SELECT json_extract(data, ?) FROM "{collection}" WHERE json_extract(data, ?) IS NOT NULL',
+                (f"$.{field}", f"$.{field}")
+            )
+            values = np.fromiter((value for (value,) in rows), dtype=np.float64)
+        counts, edges = np.histogram(values, bins=bins, range=value_range)
+        return {"edges": edges.tolist(), "counts": counts.tolist()}
+
+    def summarize_items(self, collection: str, group_by: str, fields: Iterable[str]) -> Dict[Any, dict]:
+        """Return the item count and mean of each numeric column per category of group_by."""
+        self._statement(collection, "list")
+        fields = list(fields)
+        _column_fields(collection, "categorical", [group_by])
+        _column_fields(collection, "numeric", fields)
+        averages = "".join(", AVG(json_extract(data, ?))" for _ in fields)
+        with self._connection() as conn:
+            rows = conn.execute(
+                f'SELECT json_extract(data, ?) AS category, COUNT(*){averages} FROM "{collection}" '
+                f'WHERE category IS NOT NULL GROUP BY category ORDER BY MIN(seq)',
+                [f"$.{group_by}"] + [f"$.{field}" for field in fields]
+            )
+            return {
+                category: {
+                    "count": count,
+                    **{f"mean_{field}": mean for field, mean in zip(fields, means)}
+                }
+                for category, count, *means in rows
+            }
+
+    def list_by(self, collection: str, field: str, value: Any) -> List[dict]:
+        """List items whose indexed field equals value, oldest first."""
+        return self.query_items(collection, equals={field: value})
+
+    def update_item(self, collection: str, item_id: str, updates: dict) -> Optional[dict]:
+        """Update an item in a collection."""
+        return self.update_items(collection, {item_id: updates}).get(item_id)
+
+    def update_items(self, collection: str, updates: Dict[str, dict]) -> Dict[str, dict]:
+        """Apply a patch to each of several items in one transaction. Unknown IDs are skipped."""
+        update_sql = self._statement(collection, "update")
+        with self._transaction() as conn:
+            items = self._get_many(conn, collection, list(updates))
+            for item_id, item in items.items():
+                item.update({key: value for key, value in updates[item_id].items() if key != "id"})
+            rows = [self._row(collection, item) for item in items.values()]
+            conn.executemany(update_sql, [(*row[1:], row[0]) for row in rows])
+            self._record_changes(conn, collection, "update", [row[:2] for row in rows])
+        return items
+
+    def replace_item(self, collection: str, item_id: str, item: dict) -> Optional[dict]:
+        """Replace an item with a new version, keeping its ID and created_at. None if it is not stored."""
+        update_sql = self._statement(collection, "update")
+        with self._transaction() as conn:
+            previous = self._get_many(conn, collection, [item_id]).get(item_id)
+            if previous is None:
+                return None
+            replacement = {**item, "id": item_id, "created_at": previous["created_at"]}
+            row = self._row(collection, replacement)
+            conn.execute(update_sql, (*row[1:], row[0]))
+            self._record_changes(conn, collection, "update", [row[:2]])
+        return replacement
+
+    def delete_item(self, collection: str, item_id: str) -> bool:
+        """Delete an item from a collection."""
+        sql = self._statement(collection, "delete")
+        with self._transaction() as conn:
+            if conn.execute(sql, (item_id,)).rowcount == 0:
+                return False
+            self._record_changes(conn, collection, "delete", [(item_id, None)])
+            return True
+
+    def _record_changes(
+        self,
+        conn: sqlite3.Connection,
+        collection: str,
+        operation: str,
+        changes: List[Tuple[str, Optional[str]]]
+    ) -> None:
+        # Written in the writer's transaction, so the feed never disagrees with the data
+        conn.executemany(
+            'INSERT INTO "changes" (collection, op, id, data) VALUES (?, ?, ?, ?)',
+            [(collection, operation, item_id, data) for item_id, data in changes]
+        )
+        conn.execute(
+            'DELETE FROM "changes" WHERE seq <= last_insert_rowid() - ?',
+            (CHANGE_FEED_SIZE,)
+        )
+
+    def current_sequence(self) -> int:
+        """Return the sequence number of the latest change in any collection."""
+        with self._connection() as conn:
+            return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM "changes"').fetchone()[0]
+
+    def changes_since(self, collection: str, since: int) -> List[dict]:
+        """List the changes made to a collection after sequence number since, oldest first."""
+        self._statement(collection, "list")
+        with self._connection() as conn:
+            # One read transaction, so the retention check and the rows agree
+            conn.execute("BEGIN")
+            try:
+                oldest = conn.execute('SELECT MIN(seq) FROM "changes"').fetchone()[0]
+                rows = conn.execute(
+                    'SELECT seq, op, id, data FROM "changes" WHERE collection = ? AND seq > ? ORDER BY seq',
+                    (collection, since)
+                ).fetchall()
+            finally:
+                conn.execute("COMMIT")
+        if oldest is not None and since < oldest - 1:
+            raise StorageException(f"Changes to {collection} since {since} are no longer retained")
+        return [
+            {"seq": seq, "op": op, "id": item_id, "item": json.loads(data) if data else None}
+            for seq, op, item_id, data in rows
+        ]
+
+    async def watch(self, collection: str, since: Optional[int] = None) -> AsyncIterator[dict]:
+        """
+        Yield every change to a collection after sequence number since, polling for new ones.
+
+        Queries run in a thread: they may wait up to busy_timeout for another
+        process's write lock, which must not stall the event loop.
+        """
+        self._statement(collection, "list")
+        if since is None:
+            since = await asyncio.to_thread(self.current_sequence)
+        while True:
+            for change in await asyncio.to_thread(self.changes_since, collection, since):
+                since = change["seq"]
+                yield change
+            await asyncio.sleep(CHANGE_POLL_INTERVAL)
+
+    def close(self) -> None:
+        """Close every pooled connection."""
+        while not self._pool.empty():
+            self._pool.get_nowait().close()
+
+_sqlite_storage: Optional[SQLiteStorage] = None
+_sqlite_storage_lock = threading.Lock()
+
+def get_sqlite_storage() -> SQLiteStorage:
+    """Return the process-wide SQLite engine, opening it on first use."""
+    global _sqlite_storage
+    if _sqlite_storage is None:
+        # Worker threads may race to open the engine; only one pool is created
+        with _sqlite_storage_lock:
+            if _sqlite_storage is None:
+                _sqlite_storage = SQLiteStorage(SQLITE_PATH, SQLITE_POOL_SIZE)
+                logger.info(f"💾 Opened SQLite storage at {SQLITE_PATH} (pool size {SQLITE_POOL_SIZE})")
+    return _sqlite_storage
+
+def close_sqlite_storage() -> None:
+    """Close the SQLite engine if it was opened."""
+    global _sqlite_storage
+    if _sqlite_storage is not None:
+        _sqlite_storage.close()
+        _sqlite_storage = None
+
+# Dependency to get storage context
+def get_storage():
+    """Dependency that provides access to storage operations for the configured backend."""
+    if STORAGE_BACKEND != "sqlite":
+        return database_stub.get_storage()
+
+    engine = get_sqlite_storage()
+    return {
+        "add_item": engine.add_item,
+        "add_items": engine.add_items,
+        "allocate_ids": allocate_ids,
+        "get_item": engine.get_item,
+        "get_many": engine.get_many,
+        "list_items": engine.list_items,
+        "query_items": engine.query_items,
+        "iter_items": engine.iter_items,
+        "list_by": engine.list_by,
+        "rank_items": engine.rank_items,
+        "column_histogram": engine.column_histogram,
+        "summarize_items": engine.summarize_items,
+        "update_item": engine.update_item,
+        "update_items": engine.update_items,
+        "replace_item": engine.replace_item,
+        "delete_item": engine.delete_item,
+        "current_sequence": engine.current_sequence,
+        "changes_since": engine.changes_since,
+        "watch": engine.watch
+    }
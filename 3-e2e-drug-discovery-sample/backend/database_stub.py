@@ -2,78 +2,1287 @@
 Stub storage implementation using in-memory dictionaries.
 Replaces SQLAlchemy-based database.py with a simpler storage solution.
 """
-from typing import Dict, List, Optional
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from collections import OrderedDict, deque
+from contextlib import ExitStack, contextmanager
 from datetime import datetime
+from operator import itemgetter
+import asyncio
+import bisect
+import itertools
+import json
+import logging
+import numbers
+import os
+import pickle
+import shutil
+import threading
+import time
+import numpy as np
 
-# In-memory storage
-storage: Dict[str, List[dict]] = {
-    "drug_candidates": [],
-    "clinical_trials": [],
-    "automated_tests": [],
-    "patient_cohorts": []
+from records import json_default, to_record
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# In-memory storage, keyed by collection and then by item ID. The inner dicts
+# double as the primary-key index and keep insertion order, so listing a
+# collection still returns items oldest first. Items are stored as compact,
+# read-only records (see records.py) that behave like dicts.
+storage: Dict[str, Dict[str, dict]] = {
+    "drug_candidates": {},
+    "clinical_trials": {},
+    "automated_tests": {},
+    "patient_cohorts": {}
+}
+
+# Secondary indexes per collection: hash indexes for categorical fields used in
+# equality filters, sorted indexes for numeric fields used in range filters,
+# and a columnar copy of fields used in rankings and aggregates.
+INDEXES: Dict[str, Dict[str, Any]] = {
+    "drug_candidates": {
+        "hash": ["therapeutic_area", "development_stage"],
+        "sorted": ["predicted_efficacy", "predicted_safety"],
+        "columns": {
+            "numeric": {
+                "predicted_efficacy": "float32",
+                "predicted_safety": "float32",
+                "ai_confidence": "float32",
+                "molecular_weight": "float64"
+            },
+            "categorical": ["therapeutic_area", "development_stage"]
+        }
+    },
+    "clinical_trials": {
+        "hash": ["status"]
+    },
+    # Reverse foreign-key index from drug candidates to their test records
+    "automated_tests": {
+        "hash": ["drug_candidate_id"]
+    }
+}
+
+def _optional_number(name: str) -> Optional[float]:
+    value = os.getenv(name)
+    return float(value) if value else None
+
+# Retention limits for collections that would otherwise grow without bound.
+# Unset limits are not enforced. Evicted rows are appended to a spill file in
+# the persistence directory when spill is set.
+RETENTION: Dict[str, Dict[str, Any]] = {
+    "automated_tests": {
+        "max_rows": _optional_number("STORAGE_TESTS_MAX_ROWS"),
+        "max_bytes": _optional_number("STORAGE_TESTS_MAX_BYTES"),
+        "ttl_seconds": _optional_number("STORAGE_TESTS_TTL_SECONDS"),
+        "spill": os.getenv("STORAGE_SPILL_EVICTED", "false").lower() == "true"
+    }
 }
 
 class StorageException(Exception):
     """Base exception for storage operations."""
     pass
 
-def add_item(collection: str, item: dict) -> dict:
-    """Add an item to a collection."""
+class HashIndex:
+    """
+    Maps each value of a categorical field to the items holding it.
+
+    Each bucket is a list of (position, ID) pairs sorted by insertion
+    position, so a filtered page can bisect to its cursor instead of
+    collecting and sorting every match.
+    """
+
+    def __init__(self, field: str, positions: Dict[str, int]):
+        self.field = field
+        self.fields = {field}
+        self.positions = positions
+        self.buckets: Dict[Any, List[Tuple[int, str]]] = {}
+
+    def add_many(self, items: List[Tuple[str, dict]]) -> None:
+        for item_id, item in items:
+            value = item.get(self.field)
+            if value is not None:
+                # New items have the highest positions, so this is usually an append
+                bisect.insort(self.buckets.setdefault(value, []), (self.positions[item_id], item_id))
+
+    def remove_many(self, items: List[Tuple[str, dict]]) -> None:
+        for item_id, item in items:
+            bucket = self.buckets.get(item.get(self.field))
+            if bucket is None:
+                continue
+            pair = (self.positions[item_id], item_id)
+            index = bisect.bisect_left(bucket, pair)
+            if index < len(bucket) and bucket[index] == pair:
+                del bucket[index]
+            if not bucket:
+                del self.buckets[item.get(self.field)]
+
+    def entries(self, value: Any) -> List[Tuple[int, str]]:
+        """Return the (position, ID) pairs of items holding value, oldest first."""
+        return self.buckets.get(value, [])
+
+    def lookup(self, value: Any) -> Set[str]:
+        return {item_id for _, item_id in self.entries(value)}
+
+class SortedIndex:
+    """Keeps (value, ID) pairs of a numeric field sorted for bisect range scans."""
+
+    # Batches up to this size are applied entry by entry with bisect; larger
+    # ones in a single pass over the whole index
+    BISECT_BATCH_LIMIT = 16
+
+    def __init__(self, field: str):
+        self.field = field
+        self.fields = {field}
+        self.entries: List[Tuple[float, str]] = []
+
+    def _pairs(self, items: List[Tuple[str, dict]]) -> List[Tuple[float, str]]:
+        return [
+            (item[self.field], item_id)
+            for item_id, item in items
+            if item.get(self.field) is not None
+        ]
+
+    def add_many(self, items: List[Tuple[str, dict]]) -> None:
+        pairs = self._pairs(items)
+        if len(pairs) <= self.BISECT_BATCH_LIMIT:
+            for pair in pairs:
+                bisect.insort(self.entries, pair)
+        else:
+            # Two sorted runs: timsort merges them in linear time
+            self.entries.extend(sorted(pairs))
+            self.entries.sort()
+
+    def remove_many(self, items: List[Tuple[str, dict]]) -> None:
+        pairs = self._pairs(items)
+        if len(pairs) <= self.BISECT_BATCH_LIMIT:
+            for pair in pairs:
+                position = bisect.bisect_left(self.entries, pair)
+                if position < len(self.entries) and self.entries[position] == pair:
+                    del self.entries[position]
+        else:
+            removed = set(pairs)
+            self.entries = [entry for entry in self.entries if entry not in removed]
+
+    def _bounds(self, min_value: Optional[float], max_value: Optional[float]) -> Tuple[int, int]:
+        start = 0
+        end = len(self.entries)
+        if min_value is not None:
+            start = bisect.bisect_left(self.entries, (min_value,))
+        if max_value is not None:
+            # (max_value, chr(0x10FFFF)) sorts after every entry holding max_value
+            end = bisect.bisect_right(self.entries, (max_value, chr(0x10FFFF)))
+        return start, end
+
+    def count(self, min_value: Optional[float] = None, max_value: Optional[float] = None) -> int:
+        """Return how many items have a value within [min_value, max_value], without collecting them."""
+        start, end = self._bounds(min_value, max_value)
+        return max(end - start, 0)
+
+    def range(self, min_value: Optional[float] = None, max_value: Optional[float] = None) -> Set[str]:
+        """Return the IDs of items whose value lies within [min_value, max_value]."""
+        start, end = self._bounds(min_value, max_value)
+        return {item_id for _, item_id in self.entries[start:end]}
+
+class ColumnStore:
+    """
+    Columnar shadow copy of selected fields in growable NumPy arrays.
+
+    Numeric fields are stored as float arrays (NaN when missing) and
+    categorical fields as int32 codes into a per-field category list (-1 when
+    missing), so rankings, histograms and group summaries run vectorized
+    instead of looping over item dicts. Rows freed by deletes are reused.
+    """
+
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, numeric: Dict[str, str], categorical: List[str]):
+        self.fields = set(numeric) | set(categorical)
+        self.numeric = {
+            field: np.full(self.INITIAL_CAPACITY, np.nan, dtype=dtype)
+            for field, dtype in numeric.items()
+        }
+        self.categorical = {
+            field: np.full(self.INITIAL_CAPACITY, -1, dtype=np.int32)
+            for field in categorical
+        }
+        self.categories: Dict[str, List[Any]] = {field: [] for field in categorical}
+        self._codes: Dict[str, Dict[Any, int]] = {field: {} for field in categorical}
+        self.valid = np.zeros(self.INITIAL_CAPACITY, dtype=bool)
+        self.row_ids: List[Optional[str]] = [None] * self.INITIAL_CAPACITY
+        self.rows: Dict[str, int] = {}
+        self._free_rows: List[int] = []
+        self._size = 0
+
+    def _grow(self, needed: int) -> None:
+        capacity = len(self.valid)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        extra = capacity - len(self.valid)
+        for field, column in self.numeric.items():
+            self.numeric[field] = np.concatenate([column, np.full(extra, np.nan, dtype=column.dtype)])
+        for field, column in self.categorical.items():
+            self.categorical[field] = np.concatenate([column, np.full(extra, -1, dtype=np.int32)])
+        self.valid = np.concatenate([self.valid, np.zeros(extra, dtype=bool)])
+        self.row_ids.extend([None] * extra)
+
+    def _code(self, field: str, value: Any) -> int:
+        if value is None:
+            return -1
+        codes = self._codes[field]
+        if value not in codes:
+            codes[value] = len(self.categories[field])
+            self.categories[field].append(value)
+        return codes[value]
+
+    def add_many(self, items: List[Tuple[str, dict]]) -> None:
+        rows = []
+        for item_id, _ in items:
+            row = self.rows.get(item_id)
+            if row is None:
+                if self._free_rows:
+                    row = self._free_rows.pop()
+                else:
+                    self._grow(self._size + 1)
+                    row = self._size
+                    self._size += 1
+                self.rows[item_id] = row
+                self.row_ids[row] = item_id
+            rows.append(row)
+
+        for field, column in self.numeric.items():
+            column[rows] = [
+                np.nan if item.get(field) is None else float(item[field])
+                for _, item in items
+            ]
+        for field, column in self.categorical.items():
+            column[rows] = [self._code(field, item.get(field)) for _, item in items]
+        self.valid[rows] = True
+
+    def remove_many(self, items: List[Tuple[str, dict]]) -> None:
+        for item_id, _ in items:
+            row = self.rows.pop(item_id, None)
+            if row is None:
+                continue
+            self.valid[row] = False
+            self.row_ids[row] = None
+            self._free_rows.append(row)
+
+    def _column(self, columns: Dict[str, np.ndarray], field: str) -> np.ndarray:
+        if field not in columns:
+            raise StorageException(f"No column for {field}")
+        return columns[field][:self._size]
+
+    def _live(self, field: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the rows holding a value for a numeric field, and those values."""
+        values = self._column(self.numeric, field)
+        rows = np.flatnonzero(self.valid[:self._size] & ~np.isnan(values))
+        return rows, values[rows]
+
+    def rank(self, field: str, limit: int, descending: bool = True) -> List[str]:
+        """Return the IDs of the limit items with the highest (or lowest) values."""
+        rows, values = self._live(field)
+        if limit <= 0 or len(rows) == 0:
+            return []
+        keys = -values if descending else values
+        if limit < len(rows):
+            # Partial selection first, so only the top rows are fully sorted
+            top = np.argpartition(keys, limit - 1)[:limit]
+            rows, keys = rows[top], keys[top]
+        return [self.row_ids[row] for row in rows[np.argsort(keys, kind="stable")]]
+
+    def histogram(self, field: str, bins: int = 10, value_range: Optional[Tuple[float, float]] = None) -> dict:
+        """Return bin edges and counts for a numeric field."""
+        _, values = self._live(field)
+        counts, edges = np.histogram(values, bins=bins, range=value_range)
+        return {"edges": edges.tolist(), "counts": counts.tolist()}
+
+    def summarize(self, group_by: str, fields: Iterable[str]) -> Dict[Any, dict]:
+        """Return the item count and the mean of each numeric field per category."""
+        codes = self._column(self.categorical, group_by)
+        categories = self.categories[group_by]
+        in_group = self.valid[:self._size] & (codes >= 0)
+        counts = np.bincount(codes[in_group], minlength=len(categories))
+        summary = {category: {"count": int(counts[code])} for code, category in enumerate(categories)}
+
+        for field in fields:
+            values = self._column(self.numeric, field)
+            present = in_group & ~np.isnan(values)
+            sums = np.bincount(codes[present], weights=values[present], minlength=len(categories))
+            present_counts = np.bincount(codes[present], minlength=len(categories))
+            for code, category in enumerate(categories):
+                summary[category][f"mean_{field}"] = (
+                    float(sums[code] / present_counts[code]) if present_counts[code] else None
+                )
+        return {category: values for category, values in summary.items() if values["count"]}
+
+def _created_timestamp(item: dict) -> float:
+    try:
+        return datetime.fromisoformat(str(item["created_at"])).timestamp()
+    except (KeyError, ValueError):
+        return datetime.utcnow().timestamp()
+
+class RetentionPolicy:
+    """
+    Bounds a collection by row count, approximate serialized size and age.
+
+    Items are tracked oldest first in an OrderedDict, so the next item to
+    evict is always at the front and each item is evicted at most once.
+    Age is checked against created_at, which follows insertion order.
+    """
+
+    def __init__(
+        self,
+        max_rows: Optional[float] = None,
+        max_bytes: Optional[float] = None,
+        ttl_seconds: Optional[float] = None,
+        spill: bool = False
+    ):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.spill = spill
+        self.total_bytes = 0
+        # Item ID -> (created timestamp, size in bytes)
+        self._order: "OrderedDict[str, Tuple[float, int]]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return any(limit is not None for limit in (self.max_rows, self.max_bytes, self.ttl_seconds))
+
+    def _size(self, item: dict) -> int:
+        # Only paid for when a byte limit is set
+        return len(json.dumps(item, default=json_default)) if self.max_bytes is not None else 0
+
+    def track(self, items: List[Tuple[str, dict]]) -> None:
+        for item_id, item in items:
+            size = self._size(item)
+            self._order[item_id] = (_created_timestamp(item), size)
+            self.total_bytes += size
+
+    def resize(self, items: List[Tuple[str, dict]]) -> None:
+        """Account for updated items without changing their place in line."""
+        if self.max_bytes is None:
+            return
+        for item_id, item in items:
+            created, size = self._order[item_id]
+            new_size = self._size(item)
+            self._order[item_id] = (created, new_size)
+            self.total_bytes += new_size - size
+
+    def untrack(self, item_ids: Iterable[str]) -> None:
+        for item_id in item_ids:
+            entry = self._order.pop(item_id, None)
+            if entry is not None:
+                self.total_bytes -= entry[1]
+
+    def due(self, now: float) -> List[str]:
+        """Return the IDs to evict, oldest first, to bring the collection within its limits."""
+        rows = len(self._order)
+        total_bytes = self.total_bytes
+        evict = []
+        for item_id, (created, size) in self._order.items():
+            if not (
+                (self.max_rows is not None and rows > self.max_rows)
+                or (self.max_bytes is not None and total_bytes > self.max_bytes)
+                or (self.ttl_seconds is not None and created <= now - self.ttl_seconds)
+            ):
+                break
+            evict.append(item_id)
+            rows -= 1
+            total_bytes -= size
+        return evict
+
+class IdAllocator:
+    """
+    Hands out unique, time-ordered 64-bit IDs for one collection.
+
+    Each ID packs milliseconds since 2024-01-01, a 12-bit sequence within the
+    millisecond and a 10-bit worker number. IDs from separate processes
+    sharing a database only stay distinct if each process has its own
+    worker number; the SQLite backend claims one per process (see
+    set_worker_id). When more than 4096 IDs are needed in one millisecond
+    the allocator borrows from the next one, which keeps IDs increasing even
+    under bursts or a clock that steps backwards.
+    """
+
+    EPOCH_MS = 1704067200000
+    SEQUENCE_BITS = 12
+    WORKER_BITS = 10
+
+    def __init__(self, worker_id: int):
+        if not 0 <= worker_id < 1 << self.WORKER_BITS:
+            raise StorageException(f"Worker number {worker_id} is outside 0-{(1 << self.WORKER_BITS) - 1}")
+        self.worker_id = worker_id
+        self._last = -1
+        self._lock = threading.Lock()
+
+    def allocate(self, count: int = 1) -> List[str]:
+        """Reserve a block of count consecutive IDs."""
+        now = (int(time.time() * 1000) - self.EPOCH_MS) << self.SEQUENCE_BITS
+        with self._lock:
+            start = max(self._last + 1, now)
+            self._last = start + count - 1
+        return [
+            str((counter << self.WORKER_BITS) | self.worker_id)
+            for counter in range(start, start + count)
+        ]
+
+# Worker number requested with STORAGE_WORKER_ID. The in-memory store belongs
+# to a single process, so it uses 0 when unset; the SQLite backend claims a
+# number no other live process holds.
+WORKER_ID: Optional[int] = int(os.environ["STORAGE_WORKER_ID"]) if os.getenv("STORAGE_WORKER_ID") else None
+
+# Insertion sequence of every item, used to return query results oldest first.
+# _order keeps the same (position, ID) pairs as a list sorted by position for
+# cursor pagination; deleted items are dropped from it lazily (see _unorder).
+_positions: Dict[str, Dict[str, int]] = {collection: {} for collection in storage}
+_order: Dict[str, List[Tuple[int, str]]] = {collection: [] for collection in storage}
+_order_garbage: Dict[str, int] = {collection: 0 for collection in storage}
+_position_counter = itertools.count()
+
+def _build_indexes() -> Dict[str, Dict[str, Any]]:
+    indexes: Dict[str, Dict[str, Any]] = {collection: {} for collection in storage}
+    for collection, declared in INDEXES.items():
+        for field in declared.get("hash", []):
+            indexes[collection][field] = HashIndex(field, _positions[collection])
+        for field in declared.get("sorted", []):
+            indexes[collection][field] = SortedIndex(field)
+        if "columns" in declared:
+            indexes[collection]["columns"] = ColumnStore(**declared["columns"])
+    return indexes
+
+_indexes = _build_indexes()
+
+def _build_retention() -> Dict[str, RetentionPolicy]:
+    policies = {collection: RetentionPolicy(**limits) for collection, limits in RETENTION.items()}
+    return {collection: policy for collection, policy in policies.items() if policy.enabled}
+
+_retention = _build_retention()
+
+_id_allocators: Dict[str, IdAllocator] = {
+    collection: IdAllocator(0 if WORKER_ID is None else WORKER_ID) for collection in storage
+}
+
+# One lock per collection serializes its writers, since every write touches the
+# collection's shared secondary indexes. Items are never modified in place once
+# stored (updates replace them), so point reads and unfiltered listings work on
+# copies without taking the lock; only reads that walk the indexes hold it, and
+# just long enough to collect matching IDs.
+_locks: Dict[str, threading.Lock] = {collection: threading.Lock() for collection in storage}
+
+@contextmanager
+def _all_locks():
+    """Hold every collection lock, always acquired in the same order."""
+    with ExitStack() as stack:
+        for lock in _locks.values():
+            stack.enter_context(lock)
+        yield
+
+# Optional persistence: writes are appended to a log in the data directory,
+# which is periodically compacted into a pickled snapshot of all collections.
+# Compaction moves the log aside as a segment, so writers continue on a fresh
+# log while a background thread pickles the collections; the segment is
+# removed once the snapshot covering it is on disk.
+SNAPSHOT_FILE = "snapshot.pkl"
+LOG_FILE = "storage.log"
+SEGMENT_FILE = "storage.log.1"
+EVICTED_FILE = "evicted.log"
+_data_dir: Optional[str] = None
+_log = None
+_log_sequence = 0
+_snapshot_every = 10000
+_writes_since_snapshot = 0
+_log_lock = threading.Lock()
+_snapshot_thread: Optional[threading.Thread] = None
+# fsync every logged write, so acknowledged writes also survive an OS crash
+# or power loss rather than only a crash of this process
+STORAGE_FSYNC = os.getenv("STORAGE_FSYNC", "false").lower() == "true"
+
+# Change feed: every mutation gets a sequence number and the most recent ones
+# are kept per collection, so consumers can apply deltas instead of re-reading
+# whole collections. Watchers are (event loop, event) pairs woken on writes.
+CHANGE_FEED_SIZE = int(os.getenv("STORAGE_CHANGE_FEED_SIZE", "10000"))
+_change_sequence = 0
+# Writers to different collections hold different locks, so the shared
+# sequence number has its own
+_change_lock = threading.Lock()
+_changes: Dict[str, deque] = {collection: deque(maxlen=CHANGE_FEED_SIZE) for collection in storage}
+_trimmed_through: Dict[str, int] = {collection: 0 for collection in storage}
+_watchers: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {collection: set() for collection in storage}
+
+def _get_collection(collection: str) -> Dict[str, dict]:
+    """Return the ID index for a collection."""
     if collection not in storage:
         raise StorageException(f"Collection {collection} does not exist")
-    
+    return storage[collection]
+
+def _get_index(collection: str, field: str, index_type: type):
+    index = _indexes[collection].get(field)
+    if not isinstance(index, index_type):
+        raise StorageException(f"No {index_type.__name__} on {collection}.{field}")
+    return index
+
+def _check_indexed_values(collection: str, items: Iterable[dict]) -> None:
+    """
+    Raise StorageException if an item holds a value its indexes cannot store.
+
+    Called before a write changes anything, so a bad row cannot be left
+    stored but only partly indexed.
+    """
+    declared = INDEXES.get(collection, {})
+    columns = declared.get("columns", {})
+    numeric = set(declared.get("sorted", [])) | set(columns.get("numeric", {}))
+    categorical = set(declared.get("hash", [])) | set(columns.get("categorical", []))
+    for item in items:
+        for field in numeric:
+            value = item.get(field)
+            if value is not None and not isinstance(value, numbers.Real):
+                raise StorageException(f"{collection}.{field} must be a number, got {value!r} in item {item['id']}")
+        for field in categorical:
+            value = item.get(field)
+            try:
+                hash(value)
+            except TypeError:
+                raise StorageException(f"{collection}.{field} must be hashable, got {value!r} in item {item['id']}") from None
+
+def _index_items(collection: str, items: List[Tuple[str, dict]], fields: Optional[Set[str]] = None) -> None:
+    for index in _indexes[collection].values():
+        if fields is None or index.fields & fields:
+            index.add_many(items)
+
+def _unindex_items(collection: str, items: List[Tuple[str, dict]], fields: Optional[Set[str]] = None) -> None:
+    for index in _indexes[collection].values():
+        if fields is None or index.fields & fields:
+            index.remove_many(items)
+
+def _order_items(collection: str, item_ids: Iterable[str]) -> None:
+    """Give new items the next insertion positions. Called with the collection lock held."""
+    positions = _positions[collection]
+    order = _order[collection]
+    for item_id in item_ids:
+        position = next(_position_counter)
+        positions[item_id] = position
+        order.append((position, item_id))
+
+def _unorder(collection: str, item_ids: Iterable[str]) -> None:
+    """
+    Forget the positions of removed items. Called with the collection lock held.
+
+    Their _order entries are left for readers to skip and compacted away once
+    they make up half the list, so deletes stay O(1) amortized.
+    """
+    positions = _positions[collection]
+    for item_id in item_ids:
+        del positions[item_id]
+        _order_garbage[collection] += 1
+    order = _order[collection]
+    if _order_garbage[collection] * 2 > len(order):
+        # In place, so iterators holding the list see the compacted version
+        order[:] = [(position, item_id) for position, item_id in order if positions.get(item_id) == position]
+        _order_garbage[collection] = 0
+
+def _rebuild_indexes() -> None:
+    """Rebuild insertion positions and secondary indexes from storage."""
+    global _indexes, _retention
+    _indexes = _build_indexes()
+    _retention = _build_retention()
+    for collection, items in storage.items():
+        # Cleared in place: hash indexes hold a reference to the positions dict
+        _positions[collection].clear()
+        _order[collection].clear()
+        _order_garbage[collection] = 0
+        _order_items(collection, items)
+        if collection in _retention:
+            _retention[collection].track(list(items.items()))
+        _index_items(collection, list(items.items()))
+
+def _log_write(operation: str, collection: str, **fields) -> None:
+    """
+    Append a write to the storage log when persistence is enabled.
+
+    The entry is flushed to the OS before the write returns, which survives
+    a crash of this process. Only with STORAGE_FSYNC is it also forced to
+    disk, at the cost of one fsync per write.
+    """
+    global _log_sequence, _writes_since_snapshot
+    if _log is None:
+        return
+
+    with _log_lock:
+        _log_sequence += 1
+        entry = {"seq": _log_sequence, "op": operation, "collection": collection, **fields}
+        _log.write(json.dumps(entry, default=json_default) + "\n")
+        _log.flush()
+        if STORAGE_FSYNC:
+            os.fsync(_log.fileno())
+        _writes_since_snapshot += 1
+
+def _record_changes(collection: str, operation: str, changes: List[Tuple[str, Optional[dict]]]) -> None:
+    """Append (id, item) changes to the feed and wake watchers. Called with the collection lock held."""
+    global _change_sequence
+    with _change_lock:
+        first = _change_sequence + 1
+        _change_sequence += len(changes)
+    feed = _changes[collection]
+    for seq, (item_id, item) in enumerate(changes, start=first):
+        if len(feed) == feed.maxlen:
+            _trimmed_through[collection] = feed[0]["seq"]
+        feed.append({"seq": seq, "op": operation, "id": item_id, "item": item})
+
+    for loop, event in list(_watchers[collection]):
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            # The watcher's event loop has been closed
+            _watchers[collection].discard((loop, event))
+
+def _evict_due(collection: str) -> None:
+    """Evict items past the collection's retention limits. Called with the collection lock held."""
+    policy = _retention.get(collection)
+    if policy is None:
+        return
+    evicted_ids = policy.due(datetime.utcnow().timestamp())
+    if not evicted_ids:
+        return
+
+    items = storage[collection]
+    evicted = [(item_id, items.pop(item_id)) for item_id in evicted_ids]
+    policy.untrack(evicted_ids)
+    _unindex_items(collection, evicted)
+    _unorder(collection, evicted_ids)
+    if policy.spill and _data_dir is not None:
+        with open(os.path.join(_data_dir, EVICTED_FILE), "a") as f:
+            for _, item in evicted:
+                f.write(json.dumps({"collection": collection, "item": item}, default=json_default) + "\n")
+    _log_write("evict", collection, ids=evicted_ids)
+    _record_changes(collection, "delete", [(item_id, None) for item_id in evicted_ids])
+
+def enforce_retention() -> None:
+    """Evict expired items from every collection with a retention policy."""
+    for collection in list(_retention):
+        with _locks[collection]:
+            _evict_due(collection)
+    _snapshot_if_due()
+
+def set_retention(
+    collection: str,
+    max_rows: Optional[float] = None,
+    max_bytes: Optional[float] = None,
+    ttl_seconds: Optional[float] = None,
+    spill: bool = False
+) -> None:
+    """Replace a collection's retention policy and apply it right away. Passing no limits removes it."""
+    items = _get_collection(collection)
+    policy = RetentionPolicy(max_rows, max_bytes, ttl_seconds, spill)
+    with _locks[collection]:
+        RETENTION[collection] = {
+            "max_rows": max_rows, "max_bytes": max_bytes, "ttl_seconds": ttl_seconds, "spill": spill
+        }
+        if not policy.enabled:
+            _retention.pop(collection, None)
+            return
+        # Track existing items in insertion order
+        positions = _positions[collection]
+        policy.track([(item_id, items[item_id]) for item_id in positions])
+        _retention[collection] = policy
+        _evict_due(collection)
+    _snapshot_if_due()
+
+def _snapshot_due() -> bool:
+    return (
+        _log is not None
+        and _writes_since_snapshot >= _snapshot_every
+        and (_snapshot_thread is None or not _snapshot_thread.is_alive())
+    )
+
+def _snapshot_if_due() -> None:
+    """
+    Start compacting the log once enough writes have accumulated. Called with no lock held.
+
+    Writers are paused only while the collections are copied; pickling runs
+    in a background thread.
+    """
+    global _snapshot_thread
+    if not _snapshot_due():
+        return
+    with _all_locks():
+        if not _snapshot_due():
+            return
+        _snapshot_thread = threading.Thread(
+            target=_write_snapshot_in_background,
+            args=_begin_snapshot(),
+            name="storage-snapshot",
+            daemon=True
+        )
+        _snapshot_thread.start()
+
+def _wait_for_snapshot() -> None:
+    """Block until a background snapshot, if any, has been written."""
+    thread = _snapshot_thread
+    if thread is not None:
+        thread.join()
+
+def set_worker_id(worker_id: int) -> None:
+    """Use worker_id in IDs generated from now on, e.g. after claiming it in a shared database."""
+    for collection, allocator in _id_allocators.items():
+        if allocator.worker_id != worker_id:
+            _id_allocators[collection] = IdAllocator(worker_id)
+
+def allocate_ids(collection: str, count: int = 1) -> List[str]:
+    """Reserve count new item IDs for a collection."""
+    _get_collection(collection)
+    return _id_allocators[collection].allocate(count)
+
+def add_item(collection: str, item: dict) -> dict:
+    """Add an item to a collection."""
+    return add_items(collection, [item])[0]
+
+def add_items(collection: str, items: Iterable[dict]) -> List[dict]:
+    """
+    Add several items to a collection in one call.
+
+    The whole batch is validated before anything is written. Missing IDs are
+    allocated as one block, every item gets the same creation timestamp, and
+    each index is updated once for the batch.
+    """
+    existing = _get_collection(collection)
+    items = list(items)
+
     # Add creation timestamp and ID if not present
-    if "id" not in item:
-        item["id"] = str(len(storage[collection]) + 1)
-    if "created_at" not in item:
-        item["created_at"] = datetime.utcnow().isoformat()
-    
-    storage[collection].append(item)
-    return item
+    new_ids = iter(allocate_ids(collection, sum("id" not in item for item in items)))
+    created_at = datetime.utcnow().isoformat()
+    for item in items:
+        if "id" not in item:
+            item["id"] = next(new_ids)
+        if "created_at" not in item:
+            item["created_at"] = created_at
+    items = [to_record(collection, item) for item in items]
+    _check_indexed_values(collection, items)
+
+    with _locks[collection]:
+        batch_ids: Set[str] = set()
+        for item in items:
+            if item["id"] in existing or item["id"] in batch_ids:
+                raise StorageException(f"Item {item['id']} already exists in {collection}")
+            batch_ids.add(item["id"])
+
+        for item in items:
+            existing[item["id"]] = item
+        _order_items(collection, [item["id"] for item in items])
+        _index_items(collection, [(item["id"], item) for item in items])
+        _log_write("add", collection, items=items)
+        _record_changes(collection, "add", [(item["id"], item) for item in items])
+        if collection in _retention:
+            _retention[collection].track([(item["id"], item) for item in items])
+            _evict_due(collection)
+    _snapshot_if_due()
+    return items
 
 def get_item(collection: str, item_id: str) -> Optional[dict]:
     """Get an item from a collection by ID."""
-    if collection not in storage:
-        raise StorageException(f"Collection {collection} does not exist")
-    
-    for item in storage[collection]:
-        if item["id"] == item_id:
-            return item
-    return None
+    return _get_collection(collection).get(item_id)
+
+def get_many(collection: str, item_ids: Iterable[str]) -> Dict[str, dict]:
+    """Get several items from a collection in one call, keyed by ID. Missing IDs are skipped."""
+    items = _get_collection(collection)
+    found = {item_id: items.get(item_id) for item_id in item_ids}
+    return {item_id: item for item_id, item in found.items() if item is not None}
 
 def list_items(collection: str) -> List[dict]:
     """List all items in a collection."""
-    if collection not in storage:
-        raise StorageException(f"Collection {collection} does not exist")
-    return storage[collection]
+    # dict.copy() runs without releasing the GIL, so this is a consistent
+    # snapshot even while another thread writes to the collection
+    return list(_get_collection(collection).copy().values())
+
+def query_items(
+    collection: str,
+    equals: Optional[Dict[str, Any]] = None,
+    min_values: Optional[Dict[str, float]] = None
+) -> List[dict]:
+    """
+    List items matching all filters using the collection's secondary indexes.
+
+    Args:
+        collection (str): Collection to query
+        equals (dict): Field -> value pairs answered by hash indexes
+        min_values (dict): Field -> lower bound pairs answered by sorted indexes
+
+    Returns:
+        List[dict]: Matching items, oldest first
+    """
+    return [item for _, item in iter_items(collection, equals, min_values)]
+
+# Items read per lock acquisition while iterating
+ITER_CHUNK_SIZE = 256
+# A min_values range up to this size is sorted by position and walked
+# directly; a wider one is answered by walking insertion order and skipping
+# items below the bound
+RANGE_SORT_LIMIT = 1024
+
+def _matches(item: dict, equals: Dict[str, Any], min_values: Dict[str, float]) -> bool:
+    if any(item.get(field) != value for field, value in equals.items()):
+        return False
+    for field, min_value in min_values.items():
+        value = item.get(field)
+        if value is None or value < min_value:
+            return False
+    return True
+
+def _driving_entries(
+    collection: str,
+    equals: Dict[str, Any],
+    min_values: Dict[str, float]
+) -> List[Tuple[int, str]]:
+    """
+    Pick the (position, ID) list, sorted by position, that iteration walks.
+
+    Every matching item is in it; callers still check each entry against
+    all filters. Called with the collection lock held.
+    """
+    buckets = [_get_index(collection, field, HashIndex).entries(value) for field, value in equals.items()]
+    ranges = [(_get_index(collection, field, SortedIndex), min_value) for field, min_value in min_values.items()]
+    if buckets:
+        # The smallest hash bucket is the most selective driver
+        return min(buckets, key=len)
+    if ranges:
+        index, min_value = min(ranges, key=lambda pair: pair[0].count(min_value=pair[1]))
+        if index.count(min_value=min_value) <= RANGE_SORT_LIMIT:
+            positions = _positions[collection]
+            return sorted((positions[item_id], item_id) for item_id in index.range(min_value=min_value))
+    return _order[collection]
+
+def iter_items(
+    collection: str,
+    equals: Optional[Dict[str, Any]] = None,
+    min_values: Optional[Dict[str, float]] = None,
+    after: Optional[int] = None
+) -> Iterator[Tuple[int, dict]]:
+    """
+    Iterate over items matching all filters, oldest first, for keyset pagination.
+
+    Args:
+        collection (str): Collection to query
+        equals (dict): Field -> value pairs answered by hash indexes
+        min_values (dict): Field -> lower bound pairs answered by sorted indexes
+        after (int): Cursor returned with an earlier item; iteration resumes past it
+
+    Returns:
+        Iterator[Tuple[int, dict]]: Cursor and item pairs
+    """
+    # Filters are resolved up front so bad ones fail before streaming starts.
+    # Iteration then bisects to the cursor in a position-ordered list and
+    # reads ITER_CHUNK_SIZE entries at a time, so a page costs O(log n + limit)
+    # rather than a copy of every match. Writes made while a caller is still
+    # consuming the iterator cannot break it; items deleted in the meantime
+    # are skipped.
+    _get_collection(collection)
+    equals = equals or {}
+    min_values = min_values or {}
+    with _locks[collection]:
+        entries = _driving_entries(collection, equals, min_values)
+        # Items added after this call are left for the next page
+        last = entries[-1][0] if entries else -1
+    return _iter_entries(collection, entries, equals, min_values, after, last)
+
+def _iter_entries(
+    collection: str,
+    entries: List[Tuple[int, str]],
+    equals: Dict[str, Any],
+    min_values: Dict[str, float],
+    after: Optional[int],
+    last: int
+) -> Iterator[Tuple[int, dict]]:
+    items = storage[collection]
+    positions = _positions[collection]
+    cursor = -1 if after is None else after
+    while True:
+        with _locks[collection]:
+            start = bisect.bisect_right(entries, cursor, key=itemgetter(0))
+            chunk = entries[start:start + ITER_CHUNK_SIZE]
+        if not chunk:
+            return
+        for position, item_id in chunk:
+            if position > last:
+                return
+            cursor = position
+            item = items.get(item_id)
+            # A stale entry left by a delete, or an ID deleted and added again
+            if item is None or positions.get(item_id) != position:
+                continue
+            if _matches(item, equals, min_values):
+                yield position, item
+
+def _get_columns(collection: str) -> ColumnStore:
+    _get_collection(collection)
+    columns = _indexes[collection].get("columns")
+    if columns is None:
+        raise StorageException(f"No column store on {collection}")
+    return columns
+
+def rank_items(collection: str, field: str, limit: int = 10, descending: bool = True) -> List[dict]:
+    """List the items with the highest (or lowest) values of a numeric column."""
+    items = _get_collection(collection)
+    columns = _get_columns(collection)
+    with _locks[collection]:
+        return [items[item_id] for item_id in columns.rank(field, limit, descending)]
+
+def column_histogram(
+    collection: str,
+    field: str,
+    bins: int = 10,
+    value_range: Optional[Tuple[float, float]] = None
+) -> dict:
+    """Return a histogram of a numeric column as bin edges and counts."""
+    columns = _get_columns(collection)
+    with _locks[collection]:
+        return columns.histogram(field, bins, value_range)
+
+def summarize_items(collection: str, group_by: str, fields: Iterable[str]) -> Dict[Any, dict]:
+    """Return the item count and mean of each numeric column per category of group_by."""
+    columns = _get_columns(collection)
+    with _locks[collection]:
+        return columns.summarize(group_by, fields)
+
+def list_by(collection: str, field: str, value: Any) -> List[dict]:
+    """List items whose indexed field equals value, oldest first."""
+    return query_items(collection, equals={field: value})
 
 def update_item(collection: str, item_id: str, updates: dict) -> Optional[dict]:
     """Update an item in a collection."""
-    if collection not in storage:
-        raise StorageException(f"Collection {collection} does not exist")
-    
-    for item in storage[collection]:
-        if item["id"] == item_id:
-            item.update(updates)
-            return item
-    return None
+    return update_items(collection, {item_id: updates}).get(item_id)
+
+def update_items(collection: str, updates: Dict[str, dict]) -> Dict[str, dict]:
+    """
+    Apply a patch to each of several items in one call.
+
+    Args:
+        collection (str): Collection holding the items
+        updates (dict): Item ID -> fields to update. Unknown IDs are skipped.
+
+    Returns:
+        Dict[str, dict]: Updated items keyed by ID
+    """
+    items = _get_collection(collection)
+
+    with _locks[collection]:
+        # The ID is the index key, so it cannot be changed in place
+        patches = {
+            item_id: {key: value for key, value in patch.items() if key != "id"}
+            for item_id, patch in updates.items()
+            if item_id in items
+        }
+        if not patches:
+            return {}
+
+        # Updated items are new dicts, so readers holding the old version
+        # never see a half-applied patch
+        changed_fields = {field for patch in patches.values() for field in patch}
+        previous = [(item_id, items[item_id]) for item_id in patches]
+        updated = {item_id: to_record(collection, {**item, **patches[item_id]}) for item_id, item in previous}
+        _check_indexed_values(collection, updated.values())
+        _unindex_items(collection, previous, changed_fields)
+        items.update(updated)
+        _index_items(collection, list(updated.items()), changed_fields)
+        _log_write("update", collection, updates=patches)
+        _record_changes(collection, "update", list(updated.items()))
+        if collection in _retention:
+            _retention[collection].resize(list(updated.items()))
+            _evict_due(collection)
+    _snapshot_if_due()
+    return updated
+
+def replace_item(collection: str, item_id: str, item: dict) -> Optional[dict]:
+    """
+    Replace an item with a new version, dropping fields the new one lacks.
+
+    The ID and created_at of the stored item are kept, so the item keeps its
+    place in insertion order and retention.
+
+    Returns:
+        Optional[dict]: The new item, or None if item_id is not stored
+    """
+    items = _get_collection(collection)
+
+    with _locks[collection]:
+        previous = items.get(item_id)
+        if previous is None:
+            return None
+        replacement = to_record(collection, {**item, "id": item_id, "created_at": previous["created_at"]})
+        _check_indexed_values(collection, [replacement])
+        _unindex_items(collection, [(item_id, previous)])
+        items[item_id] = replacement
+        _index_items(collection, [(item_id, replacement)])
+        _log_write("replace", collection, item=replacement)
+        _record_changes(collection, "update", [(item_id, replacement)])
+        if collection in _retention:
+            _retention[collection].resize([(item_id, replacement)])
+            _evict_due(collection)
+    _snapshot_if_due()
+    return replacement
 
 def delete_item(collection: str, item_id: str) -> bool:
     """Delete an item from a collection."""
-    if collection not in storage:
-        raise StorageException(f"Collection {collection} does not exist")
-    
-    initial_length = len(storage[collection])
-    storage[collection] = [item for item in storage[collection] if item["id"] != item_id]
-    return len(storage[collection]) < initial_length
+    items = _get_collection(collection)
+    with _locks[collection]:
+        item = items.pop(item_id, None)
+        if item is None:
+            return False
+        _unindex_items(collection, [(item_id, item)])
+        _unorder(collection, [item_id])
+        _log_write("delete", collection, id=item_id)
+        _record_changes(collection, "delete", [(item_id, None)])
+        if collection in _retention:
+            _retention[collection].untrack([item_id])
+    _snapshot_if_due()
+    return True
+
+def current_sequence() -> int:
+    """Return the sequence number of the latest change in any collection."""
+    return _change_sequence
+
+def changes_since(collection: str, since: int) -> List[dict]:
+    """
+    List the changes made to a collection after sequence number since, oldest first.
+
+    Each change is a dict with seq, op ("add", "update" or "delete"), id and
+    item (the stored item, or None for deletes).
+
+    Raises:
+        StorageException: If changes after since are no longer retained and
+        the caller has to re-read the collection
+    """
+    _get_collection(collection)
+    with _locks[collection]:
+        if since < _trimmed_through[collection]:
+            raise StorageException(f"Changes to {collection} since {since} are no longer retained")
+        # Walk back from the newest change, so the cost depends only on how
+        # many changes are returned
+        changes = list(itertools.takewhile(lambda change: change["seq"] > since, reversed(_changes[collection])))
+    changes.reverse()
+    return changes
+
+async def watch(collection: str, since: Optional[int] = None) -> AsyncIterator[dict]:
+    """
+    Yield every change to a collection after sequence number since, waiting for new ones.
+
+    Args:
+        collection (str): Collection to watch
+        since (int): Sequence number to resume from; defaults to the latest change
+
+    Yields:
+        dict: Changes in the format returned by changes_since
+    """
+    _get_collection(collection)
+    if since is None:
+        since = current_sequence()
+    waiter = (asyncio.get_running_loop(), asyncio.Event())
+    with _locks[collection]:
+        _watchers[collection].add(waiter)
+    try:
+        while True:
+            # Cleared before reading, so a write made after the read still wakes us
+            waiter[1].clear()
+            for change in changes_since(collection, since):
+                since = change["seq"]
+                yield change
+            await waiter[1].wait()
+    finally:
+        with _locks[collection]:
+            _watchers[collection].discard(waiter)
+
+def reset_storage() -> None:
+    """Remove all items from every collection and rebuild empty indexes."""
+    global _indexes, _retention
+    with _all_locks():
+        for collection in storage:
+            storage[collection].clear()
+            _positions[collection].clear()
+            _order[collection].clear()
+            _order_garbage[collection] = 0
+            # Earlier changes no longer apply; watchers must re-read
+            _changes[collection].clear()
+            _trimmed_through[collection] = _change_sequence
+        _indexes = _build_indexes()
+        _retention = _build_retention()
+
+def _replay_log(log_path: str, after_sequence: int) -> Tuple[int, bool]:
+    """
+    Re-apply logged writes newer than the snapshot.
+
+    Returns:
+        Tuple[int, bool]: Last applied sequence number and whether a torn
+        final write was found
+    """
+    last_sequence = after_sequence
+    with open(log_path, "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Only the last write can be torn, by a crash mid-append
+                return last_sequence, True
+            if entry["seq"] <= after_sequence:
+                continue
+            if entry["op"] == "add":
+                add_items(entry["collection"], entry["items"])
+            elif entry["op"] == "update":
+                update_items(entry["collection"], entry["updates"])
+            elif entry["op"] == "replace":
+                replace_item(entry["collection"], entry["item"]["id"], entry["item"])
+            elif entry["op"] == "delete":
+                delete_item(entry["collection"], entry["id"])
+            elif entry["op"] == "evict":
+                for item_id in entry["ids"]:
+                    delete_item(entry["collection"], item_id)
+            last_sequence = entry["seq"]
+    return last_sequence, False
+
+def enable_persistence(data_dir: str, snapshot_every: int = 10000) -> None:
+    """
+    Restore storage from data_dir and persist all further writes there.
+
+    Loads the latest snapshot, replays the log written since, then appends
+    every add, update and delete to the log. The log is compacted into a
+    new snapshot after snapshot_every writes. Logged writes survive a crash
+    of the process; set STORAGE_FSYNC to also survive an OS crash or power
+    loss.
+
+    Args:
+        data_dir (str): Directory holding the snapshot and log files
+        snapshot_every (int): Number of logged writes between snapshots
+    """
+    global _data_dir, _log, _log_sequence, _snapshot_every, _writes_since_snapshot
+    if _log is not None:
+        raise StorageException(f"Persistence is already enabled in {_data_dir}")
+    _wait_for_snapshot()
+
+    os.makedirs(data_dir, exist_ok=True)
+    snapshot_path = os.path.join(data_dir, SNAPSHOT_FILE)
+    segment_path = os.path.join(data_dir, SEGMENT_FILE)
+    log_path = os.path.join(data_dir, LOG_FILE)
+
+    reset_storage()
+    sequence = 0
+    if os.path.exists(snapshot_path):
+        with open(snapshot_path, "rb") as f:
+            saved = pickle.load(f)
+        for collection, items in saved["storage"].items():
+            # Snapshots taken before records were introduced hold plain dicts
+            storage[collection].update(
+                (item_id, to_record(collection, item)) for item_id, item in items.items()
+            )
+        sequence = saved["sequence"]
+        _rebuild_indexes()
+
+    # A segment is left behind when the process stopped while compacting;
+    # its entries precede those in the current log
+    torn_write = False
+    for path in (segment_path, log_path):
+        if os.path.exists(path) and not torn_write:
+            sequence, torn_write = _replay_log(path, sequence)
+
+    _data_dir = data_dir
+    _log_sequence = sequence
+    _snapshot_every = snapshot_every
+    _writes_since_snapshot = 0
+    _log = open(log_path, "a")
+    if torn_write:
+        logger.warning("⚠️ Discarded torn write at the end of the storage log")
+    if torn_write or os.path.exists(segment_path):
+        # Compact now so new writes are not appended after a torn line and
+        # the next compaction starts without a leftover segment
+        snapshot()
+
+    logger.info(f"💾 Restored {sum(len(items) for items in storage.values())} items from {data_dir}")
+
+def snapshot() -> None:
+    """Write all collections to a snapshot file and truncate the storage log, waiting until done."""
+    if _log is None:
+        raise StorageException("Persistence is not enabled")
+    _wait_for_snapshot()
+    # Writers are paused so the copy matches the log sequence exactly
+    with _all_locks():
+        state = _begin_snapshot()
+    _write_snapshot(*state)
+
+def _begin_snapshot() -> Tuple[str, int, Dict[str, Dict[str, dict]]]:
+    """
+    Copy the collections and move the log aside as a segment. Called with every lock held.
+
+    Stored items are never mutated in place, so copying the collection
+    dicts is enough for a consistent view.
+    """
+    global _log, _writes_since_snapshot
+    log_path = os.path.join(_data_dir, LOG_FILE)
+    segment_path = os.path.join(_data_dir, SEGMENT_FILE)
+    _log.close()
+    if os.path.exists(segment_path):
+        # The previous snapshot failed; its segment is still needed
+        with open(segment_path, "a") as segment, open(log_path) as log:
+            shutil.copyfileobj(log, segment)
+    else:
+        os.replace(log_path, segment_path)
+    _log = open(log_path, "w")
+    _writes_since_snapshot = 0
+    return _data_dir, _log_sequence, {collection: dict(items) for collection, items in storage.items()}
+
+def _write_snapshot(data_dir: str, sequence: int, collections: Dict[str, Dict[str, dict]]) -> None:
+    """Pickle copied collections and drop the log segment they cover. Called with no lock held."""
+    snapshot_path = os.path.join(data_dir, SNAPSHOT_FILE)
+    temp_path = snapshot_path + ".tmp"
+    with open(temp_path, "wb") as f:
+        pickle.dump(
+            {"sequence": sequence, "storage": collections},
+            f,
+            protocol=pickle.HIGHEST_PROTOCOL
+        )
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, snapshot_path)
+    # Entries up to sequence are in the snapshot; replay skips them even
+    # if a crash happens before the segment is removed
+    os.remove(os.path.join(data_dir, SEGMENT_FILE))
+
+def _write_snapshot_in_background(*state) -> None:
+    try:
+        _write_snapshot(*state)
+    except OSError as e:
+        # The segment stays and is replayed on restart or folded into the next snapshot
+        logger.error(f"❌ Failed to write storage snapshot: {str(e)}")
+
+def disable_persistence() -> None:
+    """Take a final snapshot and stop logging writes."""
+    global _data_dir, _log
+    if _log is None:
+        return
+    snapshot()
+    _log.close()
+    _log = None
+    _data_dir = None
 
 # Dependency to get storage context (mimics FastAPI dependency injection)
 def get_storage():
     """Dependency that provides access to storage operations."""
     return {
         "add_item": add_item,
+        "add_items": add_items,
+        "allocate_ids": allocate_ids,
         "get_item": get_item,
+        "get_many": get_many,
         "list_items": list_items,
+        "query_items": query_items,
+        "iter_items": iter_items,
+        "list_by": list_by,
+        "rank_items": rank_items,
+        "column_histogram": column_histogram,
+        "summarize_items": summarize_items,
         "update_item": update_item,
-        "delete_item": delete_item
+        "update_items": update_items,
+        "replace_item": replace_item,
+        "delete_item": delete_item,
+        "current_sequence": current_sequence,
+        "changes_since": changes_since,
+        "watch": watch
     }
@@ -3,8 +3,8 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
 from fastapi.openapi.docs import get_redoc_html
-from clients import project_client, chat_client, toolset, ensure_clients
-from azure.ai.evaluation import F1ScoreEvaluator
+import clients
+from clients import ensure_clients, close_clients, check_readiness, get_f1_evaluator
 from azure.identity import DefaultAzureCredential
 from opentelemetry import trace
 from opentelemetry.sdk.trace import TracerProvider
@@ -13,7 +13,9 @@ from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExport
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 from azure.core.tracing.ext.opentelemetry_span import OpenTelemetrySpan
 from datetime import datetime
+import asyncio
 import logging
+import time
 import os
 from dotenv import load_dotenv
 from typing import Dict, Optional
@@ -36,6 +38,12 @@ OTEL_EXPORTER_OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://l
 OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "drug-development-platform")
 OTEL_RESOURCE_ATTRIBUTES = os.getenv("OTEL_RESOURCE_ATTRIBUTES", "deployment.environment=development")
 
+# Storage persistence (disabled when STORAGE_DATA_DIR is unset)
+STORAGE_DATA_DIR = os.getenv("STORAGE_DATA_DIR")
+STORAGE_SNAPSHOT_INTERVAL = int(os.getenv("STORAGE_SNAPSHOT_INTERVAL", "10000"))
+# Seconds between sweeps that expire rows past their TTL (see database_stub.RETENTION)
+STORAGE_RETENTION_INTERVAL = float(os.getenv("STORAGE_RETENTION_INTERVAL", "60"))
+
 # Audit Logging
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 AUDIT_LOG_PATH = os.getenv("AUDIT_LOG_PATH", "/var/log/drugdev/data_access.log")
@@ -74,11 +82,12 @@ if not os.getenv("TEST_MODE"):
 else:
     logger.info("Running in test mode - OpenTelemetry exporter disabled")
 
-# Initialize evaluators
-f1_evaluator = F1ScoreEvaluator()
+import database
+import database_stub
 
 # Import routers
 from routers import molecular_design, clinical_trials, automated_testing, supply_chain, agents, evaluation
+from utils.agent_registry import AGENT_REGISTRY_TOUCH_SECONDS
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -115,6 +124,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # Pagination cursor for list endpoints
 )
 
 @app.get("/api/drugs")
@@ -162,23 +172,82 @@ async def health_check():
     """
     with tracer.start_as_current_span("health_check") as span:
         span.set_attribute("service.name", OTEL_SERVICE_NAME)
+        # Probe results are cached, so frequent health checks stay cheap
+        readiness = await check_readiness()
         return {
             "status": "ok",
             "service": "drug-discovery-platform",
             "ai_foundry": {
-                "project_client": project_client is not None,
-                "chat_client": chat_client is not None,
+                "project_client": clients.project_client is not None,
+                "chat_client": clients.chat_client is not None,
+                "ready": readiness["ready"],
+                "readiness_error": readiness["error"],
                 "evaluators": {
-                    "f1_score": f1_evaluator is not None
+                    # Evaluators are created on first use
+                    "f1_score": get_f1_evaluator.cache_info().currsize > 0
                 }
             }
         }
 
+async def enforce_storage_retention():
+    """Expire rows past their TTL even when their collection is not being written to."""
+    while True:
+        await asyncio.sleep(STORAGE_RETENTION_INTERVAL)
+        try:
+            # Eviction can spill rows to disk and compact the log; keep it off the event loop
+            await asyncio.to_thread(database_stub.enforce_retention)
+        except Exception as e:
+            logger.error(f"❌ Error enforcing storage retention: {str(e)}")
+
+async def refresh_saved_agents():
+    """Keep the saved agents this worker holds marked as in use, so other workers never delete them as idle."""
+    while True:
+        await asyncio.sleep(AGENT_REGISTRY_TOUCH_SECONDS)
+        try:
+            await agents.agent_registry.heartbeat()
+        except Exception as e:
+            logger.error(f"❌ Error refreshing saved agents: {str(e)}")
+
 # Initialize clients on startup
 @app.on_event("startup")
 async def startup_event():
     """Initialize clients on startup."""
+    started = time.perf_counter()
+    if database.STORAGE_BACKEND != "sqlite":
+        if STORAGE_DATA_DIR:
+            database_stub.enable_persistence(STORAGE_DATA_DIR, STORAGE_SNAPSHOT_INTERVAL)
+        if any(limits.get("ttl_seconds") for limits in database_stub.RETENTION.values()):
+            app.state.retention_task = asyncio.create_task(enforce_storage_retention())
+    storage_ms = (time.perf_counter() - started) * 1000
+
     await ensure_clients()
+    clients_ms = (time.perf_counter() - started) * 1000 - storage_ms
+
+    # Reuse agents created by earlier runs instead of creating them on first request
+    try:
+        restored = await agents.restore_agents(clients.project_client)
+        if restored:
+            logger.info(f"🤖 Reusing {restored} saved agents")
+    except Exception as e:
+        logger.error(f"❌ Error restoring saved agents: {str(e)}")
+    if agents.agent_registry.path:
+        app.state.agent_heartbeat_task = asyncio.create_task(refresh_saved_agents())
+    total_ms = (time.perf_counter() - started) * 1000
+    logger.info(
+        f"⏱️ Startup took {total_ms:.0f} ms (storage {storage_ms:.0f} ms, clients {clients_ms:.0f} ms, "
+        f"agents {total_ms - storage_ms - clients_ms:.0f} ms)"
+    )
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush storage to a final snapshot and close clients on shutdown."""
+    for task_name in ("retention_task", "agent_heartbeat_task"):
+        task = getattr(app.state, task_name, None)
+        if task is not None:
+            task.cancel()
+    database_stub.disable_persistence()
+    database.close_sqlite_storage()
+    await close_clients()
 
 # Register routers
 app.include_router(molecular_design.router, prefix="/molecular-design", tags=["molecular-design"])
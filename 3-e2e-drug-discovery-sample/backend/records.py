@@ -0,0 +1,127 @@
+"""
+Compact record types for items held by the in-memory storage.
+
+A plain dict per row repeats every key and carries a hash table sized for
+growth. Records store the usual fields of their collection in __slots__,
+intern categorical strings so equal values share one object, and keep any
+other fields in a small overflow dict. They implement the read-only Mapping
+interface, so code written against dict items (indexing, .get(), ** and
+dict()) keeps working unchanged.
+"""
+from typing import Any, Dict, Iterator, Mapping, Optional, Tuple
+from collections.abc import Mapping as MappingABC
+import sys
+
+class Record(MappingABC):
+    """Read-only mapping view over a slotted row. Updates replace the whole record."""
+    __slots__ = ("_extra",)
+
+    FIELDS: Tuple[str, ...] = ()
+    INTERNED: frozenset = frozenset()
+    _FIELD_SET: frozenset = frozenset()
+
+    def __init__(self, data: Mapping[str, Any]):
+        extra = None
+        for key, value in data.items():
+            if key in self._FIELD_SET:
+                # Only exact str instances can be interned (not str Enums)
+                if key in self.INTERNED and type(value) is str:
+                    value = sys.intern(value)
+                object.__setattr__(self, key, value)
+            else:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+        object.__setattr__(self, "_extra", extra)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise TypeError(f"{type(self).__name__} is read-only")
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __iter__(self) -> Iterator[str]:
+        for field in self.FIELDS:
+            if hasattr(self, field):
+                yield field
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self)!r})"
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+def _record_type(name: str, fields: Tuple[str, ...], interned: Tuple[str, ...] = ()) -> type:
+    return type(name, (Record,), {
+        "__slots__": fields,
+        "__module__": __name__,
+        "FIELDS": fields,
+        "INTERNED": frozenset(interned),
+        "_FIELD_SET": frozenset(fields)
+    })
+
+# Module-level names keep the generated classes picklable in storage snapshots
+DrugCandidateRecord = _record_type(
+    "DrugCandidateRecord",
+    (
+        "id", "molecule_type", "molecular_weight", "therapeutic_area",
+        "predicted_efficacy", "predicted_safety", "ai_confidence", "development_stage",
+        "target_proteins", "side_effects", "properties", "creation_date", "created_at"
+    ),
+    interned=("molecule_type", "therapeutic_area", "development_stage")
+)
+
+ClinicalTrialRecord = _record_type(
+    "ClinicalTrialRecord",
+    (
+        "id", "trial_id", "drug_candidate_id", "phase", "status",
+        "participant_count", "target_participant_count", "start_date", "end_date", "created_at"
+    ),
+    interned=("drug_candidate_id", "phase", "status")
+)
+
+AutomatedTestRecord = _record_type(
+    "AutomatedTestRecord",
+    (
+        "id", "test_id", "drug_candidate_id", "test_type", "result", "start_time", "end_time",
+        "parameters", "measurements", "safety_flags", "ai_analysis", "created_at"
+    ),
+    interned=("drug_candidate_id", "test_type", "result")
+)
+
+PatientCohortRecord = _record_type(
+    "PatientCohortRecord",
+    ("id", "demographics", "biomarkers", "genetic_markers", "created_at")
+)
+
+RECORD_TYPES: Dict[str, type] = {
+    "drug_candidates": DrugCandidateRecord,
+    "clinical_trials": ClinicalTrialRecord,
+    "automated_tests": AutomatedTestRecord,
+    "patient_cohorts": PatientCohortRecord
+}
+
+def to_record(collection: str, item: Mapping[str, Any]) -> Mapping[str, Any]:
+    """Convert an item to its collection's record type. Collections without one keep plain dicts."""
+    record_type: Optional[type] = RECORD_TYPES.get(collection)
+    if record_type is None or type(item) is record_type:
+        return item
+    return record_type(item)
+
+def json_default(value: Any) -> Any:
+    """json.dumps default that writes records as objects and anything else as a string."""
+    if isinstance(value, Record):
+        return dict(value)
+    return str(value)
@@ -1,16 +1,25 @@
-from fastapi import APIRouter, HTTPException, File, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, File, UploadFile
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
 import logging
 import os
 import json
-import uuid
+import math
+import tempfile
 import pandas as pd
 import numpy as np
-from clients import project_client, chat_client, tracer, ensure_clients
+import clients
+from clients import tracer
 from azure.ai.projects.models import BingGroundingTool, FunctionTool, CodeInterpreterTool, FilePurpose, ToolSet
 from azure.core.exceptions import ResourceNotFoundError
+from utils.rate_limit import RateLimitExceeded, estimate_tokens, get_limiter
+from utils.resilience import AgentUnavailable, call_with_resilience
+from utils.deployments import deployment_pool, select_deployment
+from utils.agent_registry import AgentKey, AgentRegistry, fingerprint
+from utils.streaming import JsonFieldStream, sse_response
+from starlette.background import BackgroundTask
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -25,7 +34,7 @@ def serialize_tool_config(toolset: ToolSet) -> tuple[List[Dict[str, Any]], Dict[
     Returns:
         tuple[List[Dict[str, Any]], Dict[str, Any]]: Serialized tools and resources
     """
-    logger.info(f"Serializing tool configuration for {len(toolset._tools)} tools")
+    logger.debug(f"Serializing tool configuration for {len(toolset._tools)} tools")
     
     # Initialize lists and dicts for serialization
     tools = []
@@ -107,8 +116,288 @@ def serialize_tool_config(toolset: ToolSet) -> tuple[List[Dict[str, Any]], Dict[
     
     return tools, resources
 
-# Cache for agents to avoid recreation
-agent_cache: Dict[str, object] = {}
+# Agents by type, deployment and definition, created once per key. Their ids
+# are saved under AGENT_REGISTRY_PATH so restarts reuse them (unset: memory only)
+agent_registry = AgentRegistry(os.getenv("AGENT_REGISTRY_PATH", "./data/agents.json") or None)
+
+async def restore_agents(client) -> int:
+    """Reuse agents saved by earlier runs that still exist, and delete stale ones."""
+    return await agent_registry.restore(fetch=client.agents.get_agent, delete=client.agents.delete_agent)
+
+async def get_agent(agent_type: str, deployment: str, instructions: str, toolset: ToolSet):
+    """
+    Return the agent of a type on a deployment, creating it on first use.
+
+    Concurrent first requests share one create_agent call. The key includes a
+    fingerprint of the instructions and tool definitions, so editing either
+    creates a new agent instead of reusing the old one.
+    """
+    tools, _ = serialize_tool_config(toolset)
+    key = AgentKey(agent_type, deployment, fingerprint(instructions, tools))
+
+    async def create():
+        return await call_with_resilience(
+            deployment,
+            lambda: clients.project_client.agents.create_agent(
+                model=deployment,
+                instructions=instructions,
+                toolset=toolset,
+                headers={"x-ms-enable-preview": "true"}
+            ),
+            operation="create-agent",
+            idempotent=False
+        )
+
+    try:
+        return await agent_registry.get_or_create(
+            key,
+            create,
+            # Reuse or clean up against agents other workers saved meanwhile
+            fetch=lambda agent_id: clients.project_client.agents.get_agent(agent_id),
+            delete=lambda agent_id: clients.project_client.agents.delete_agent(agent_id)
+        )
+    except (RateLimitExceeded, AgentUnavailable):
+        raise
+    except Exception as e:
+        logger.error(f"❌ Error creating {agent_type} agent: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error creating {agent_type} agent: {str(e)}"
+        )
+
+class AgentDefinition(NamedTuple):
+    """Instructions and tools of one agent type; tools() builds fresh tool objects."""
+    instructions: str
+    tools: Callable[[], List[Any]]
+
+# Agent types served by this router, registered next to their tool functions
+AGENT_DEFINITIONS: Dict[str, AgentDefinition] = {}
+
+def bing_tool() -> BingGroundingTool:
+    return BingGroundingTool(connection_id=os.getenv("spn_4o_BING_API_KEY"))
+
+async def provision_agent(agent_type: str) -> Tuple[Any, str]:
+    """
+    Pick a deployment for an agent type and return its shared agent with that deployment.
+
+    Every endpoint and helper gets agents here, usually through
+    consult_agent, so each (type, deployment, definition) maps to one remote
+    agent. Per-request data belongs in the conversation's tool resources
+    (see ask_agent), not in a new agent.
+    """
+    definition = AGENT_DEFINITIONS[agent_type]
+    deployment = select_deployment(agent_type)
+    toolset = ToolSet()
+    for tool in definition.tools():
+        toolset.add(tool)
+    agent = await get_agent(agent_type, deployment, definition.instructions, toolset)
+    return agent, deployment
+
+async def delete_uploaded_file(file_id: str) -> None:
+    """Delete a per-request upload once its conversation is done; failures are only logged."""
+    try:
+        await clients.project_client.agents.delete_file(file_id)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not delete uploaded file {file_id}: {str(e)}")
+
+async def send_message_limited(conversation, deployment: str, message: str):
+    """Send a message to an agent within the deployment's request, token and concurrency limits."""
+    async with get_limiter(deployment).reserve(estimate_tokens(message)) as reservation:
+        response = await conversation.send_message(message)
+        used = getattr(getattr(response, "usage", None), "total_tokens", None)
+        reservation.settle(used if isinstance(used, int) else None)
+    return response
+
+async def ask_agent(agent, deployment: str, operation: str, message: str, tool_resources=None):
+    """
+    Send one message to an agent on a new conversation, with retries, hedging and the circuit breaker.
+
+    Each attempt opens its own conversation, so repeating or hedging the
+    pair cannot post the message twice to the same thread. The agent must
+    have been created on `deployment`. tool_resources, such as uploaded
+    files for the code interpreter, are attached to the conversation only.
+    """
+    extra = {"tool_resources": tool_resources} if tool_resources is not None else {}
+
+    async def attempt():
+        conversation = await clients.chat_client.create_conversation(agent_id=agent.id, **extra)
+        return await send_message_limited(conversation, deployment, message)
+    async with deployment_pool.track(deployment):
+        return await call_with_resilience(deployment, attempt, operation=operation)
+
+def is_not_found(e: BaseException) -> bool:
+    return isinstance(e, ResourceNotFoundError) or getattr(e, "status_code", None) == 404
+
+async def forget_agent(agent) -> None:
+    """Drop an agent the service no longer has, so the next provision_agent creates it again."""
+    key = agent_registry.key_of(agent.id)
+    if key is not None:
+        logger.warning(f"⚠️ {key.agent_type} agent {agent.id} no longer exists; recreating it")
+        await agent_registry.invalidate(key, agent_id=agent.id)
+
+async def consult_agent(agent_type: str, message: str, tool_resources=None) -> Tuple[Any, Any]:
+    """
+    Ask the shared agent of a type one message and return the agent with its response.
+
+    If the service no longer has the agent, e.g. it was deleted in the portal
+    after this process cached or restored its id, the agent is dropped from
+    the registry, recreated and asked again, once.
+    """
+    for attempt in range(2):
+        agent, deployment = await provision_agent(agent_type)
+        try:
+            return agent, await ask_agent(agent, deployment, agent_type, message, tool_resources)
+        except Exception as e:
+            if attempt or not is_not_found(e):
+                raise
+            await forget_agent(agent)
+
+# The /stream endpoints rely on conversation.send_message(..., stream=True),
+# which the agents SDK does not provide yet. They answer 501 unless enabled
+# for a chat client that streams replies.
+AGENT_STREAMING = os.getenv("AGENT_STREAMING", "false").lower() == "true"
+
+def require_agent_streaming() -> None:
+    """Reject /stream requests while AGENT_STREAMING is off, before any upload or agent call."""
+    if not AGENT_STREAMING:
+        raise HTTPException(
+            status_code=501,
+            detail="Streaming agent answers is disabled; use the endpoint without /stream"
+        )
+
+async def stream_agent(agent, deployment: str, operation: str, message: str,
+                       tool_resources=None) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Relay one agent answer as (event, data) pairs while it is generated.
+
+    Events are "start" once the service accepts the message, "token" for each
+    text delta, "tool_call" for each tool call delta, "field" for each
+    top-level field of the JSON answer as soon as its value is complete,
+    and "done" with the full text. Only opening the stream is retried:
+    after the first token the client has already seen part of the answer.
+    """
+    extra = {"tool_resources": tool_resources} if tool_resources is not None else {}
+    async with deployment_pool.track(deployment), \
+            get_limiter(deployment).reserve(estimate_tokens(message)) as reservation:
+        async def attempt():
+            conversation = await clients.chat_client.create_conversation(agent_id=agent.id, **extra)
+            return await conversation.send_message(message, stream=True)
+        # A hedged duplicate would generate a second, discarded answer, so streams are never hedged
+        updates = await call_with_resilience(deployment, attempt, operation=f"{operation}-stream", hedge=False)
+        yield "start", {"agent_id": agent.id, "deployment": deployment}
+
+        fields = JsonFieldStream()
+        content = []
+        async for update in updates:
+            delta = getattr(update, "delta", None)
+            text = getattr(delta, "content", None)
+            if text:
+                content.append(text)
+                yield "token", {"text": text}
+                for name, value in fields.feed(text):
+                    yield "field", {"name": name, "value": value}
+            for call in getattr(delta, "tool_calls", None) or []:
+                function = getattr(call, "function", None)
+                yield "tool_call", {
+                    "id": getattr(call, "id", None),
+                    "name": getattr(function, "name", None),
+                    "arguments": getattr(function, "arguments", None)
+                }
+            used = getattr(getattr(update, "usage", None), "total_tokens", None)
+            if isinstance(used, int):
+                reservation.settle(used)
+        yield "done", {"agent_id": agent.id, "content": "".join(content)}
+
+async def stream_agent_response(agent_type: str, message: str, tool_resources=None,
+                                cleanup: Optional[Callable[[], Awaitable[None]]] = None) -> StreamingResponse:
+    """
+    Answer with an agent's response streamed as Server-Sent Events.
+
+    The stream is opened before the response starts, so throttling and
+    outages are still reported as 429 and 503. Errors after that arrive as
+    an "error" event. cleanup, e.g. deleting an upload, runs exactly once
+    when the stream ends either way, including when the client disconnects
+    before the first event is sent.
+    """
+    try:
+        for attempt in range(2):
+            agent, deployment = await provision_agent(agent_type)
+            events = stream_agent(agent, deployment, agent_type, message, tool_resources)
+            try:
+                first = await events.__anext__()
+                break
+            except Exception as e:
+                if attempt or not is_not_found(e):
+                    raise
+                await forget_agent(agent)
+    except BaseException:
+        if cleanup is not None:
+            await cleanup()
+        raise
+
+    finished = False
+
+    async def finish():
+        # Called when relay() ends and again as the response's background
+        # task, which also covers a relay() that never started
+        nonlocal finished
+        if finished:
+            return
+        finished = True
+        try:
+            # Releases the rate limiter reservation held by the open stream
+            await events.aclose()
+        finally:
+            if cleanup is not None:
+                await cleanup()
+
+    async def relay():
+        try:
+            yield first
+            async for event in events:
+                yield event
+        except Exception as e:
+            logger.error(f"❌ Error streaming {agent_type} response: {str(e)}")
+            yield "error", {"detail": str(e)}
+        finally:
+            await finish()
+    return sse_response(relay(), background=BackgroundTask(finish))
+
+async def stream_endpoint(agent_type: str, message: str, tool_resources=None,
+                          cleanup: Optional[Callable[[], Awaitable[None]]] = None) -> StreamingResponse:
+    """Shared error handling of the /stream endpoints, which have no local fallback."""
+    try:
+        return await stream_agent_response(agent_type, message, tool_resources, cleanup)
+    except RateLimitExceeded as e:
+        raise rate_limited(e)
+    except AgentUnavailable as e:
+        raise unavailable(e)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Error starting {agent_type} stream: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error starting {agent_type} stream: {str(e)}"
+        )
+
+def rate_limited(e: RateLimitExceeded) -> HTTPException:
+    """Report a throttled call as 429 with the wait the client should observe."""
+    logger.warning(f"⚠️ {str(e)}")
+    return HTTPException(
+        status_code=429,
+        detail=str(e),
+        headers={"Retry-After": str(math.ceil(e.retry_after))}
+    )
+
+def unavailable(e: AgentUnavailable) -> HTTPException:
+    """Report a deployment outage as 503 for endpoints without a local fallback."""
+    logger.error(f"❌ {str(e)}")
+    return HTTPException(
+        status_code=503,
+        detail=str(e),
+        headers={"Retry-After": str(math.ceil(e.retry_after))}
+    )
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -144,12 +433,49 @@ def analyze_molecule_properties(smiles: str, target_proteins: List[str]) -> dict
         }
     }
 
+AGENT_DEFINITIONS["literature-search"] = AgentDefinition(
+    instructions="""You are a scientific literature analysis agent specialized in drug discovery.
+    Analyze search results to extract key findings about drug candidates, mechanisms of action,
+    and clinical outcomes. Focus on recent peer-reviewed publications.""",
+    tools=lambda: [bing_tool()]
+)
+
+AGENT_DEFINITIONS["molecule-analysis"] = AgentDefinition(
+    instructions="""You are a molecular analysis agent specialized in drug discovery.
+    Analyze molecular properties and protein interactions to assess drug candidate potential.
+    Provide detailed scientific explanations of your findings.""",
+    tools=lambda: [bing_tool(), FunctionTool(functions=[analyze_molecule_properties])]
+)
+
+AGENT_DEFINITIONS["data-analysis"] = AgentDefinition(
+    instructions="""You are a clinical trial data analysis agent.
+    Analyze trial data to extract insights about drug efficacy, safety profiles,
+    and patient outcomes. Create visualizations to support your findings.""",
+    tools=lambda: [CodeInterpreterTool()]
+)
+
 class LiteratureSearchRequest(BaseModel):
     """Request model for literature search."""
     query: str
     max_results: Optional[int] = 5
     include_clinical_trials: Optional[bool] = True
 
+def literature_search_prompt(request: LiteratureSearchRequest) -> str:
+    """Prompt for the literature-search agent, shared by the plain and streaming endpoints."""
+    return f"""Search for recent scientific literature about: {request.query}
+        Max Results: {request.max_results}
+        Include Clinical Trials: {request.include_clinical_trials}
+
+        Focus on drug development implications and summarize key findings.
+        Provide references to support your analysis.
+
+        Format your response as a JSON object with these fields:
+        {{
+            "query": "the search query",
+            "summary": "your analysis and findings",
+            "references": ["list of DOIs or citations"]
+        }}"""
+
 @router.post("/literature-search", tags=["agents"], summary="Search scientific literature using Bing grounding")
 async def literature_search(request: LiteratureSearchRequest):
     """
@@ -201,52 +527,10 @@ async def literature_search(request: LiteratureSearchRequest):
             span.set_attribute("operation", "literature_search")
             logger.info(f"🔍 Starting literature search for: {request.query}")
 
-            # Get or create agent from cache
-            agent_type = "literature-search"
-            if agent_type not in agent_cache:
-                # Create tools configuration
-                toolset = ToolSet()
-                bing_tool = BingGroundingTool(
-                    connection_id=os.getenv("spn_4o_BING_API_KEY")
-                )
-                toolset.add(bing_tool)
-
-                try:
-                    # Create agent with preview features enabled
-                    agent = await project_client.agents.create_agent(
-                        model=os.getenv('MODEL_DEPLOYMENT_NAME', os.getenv('spn_4o_model', 'gpt-4')),
-                        instructions="""You are a scientific literature analysis agent specialized in drug discovery.
-                        Analyze search results to extract key findings about drug candidates, mechanisms of action,
-                        and clinical outcomes. Focus on recent peer-reviewed publications.""",
-                        toolset=toolset,
-                        headers={"x-ms-enable-preview": "true"}
-                    )
-                    agent_cache[agent_type] = agent
-                except Exception as e:
-                    logger.error(f"❌ Error creating {agent_type} agent: {str(e)}")
-                    raise HTTPException(
-                        status_code=500,
-                        detail=f"Error creating {agent_type} agent: {str(e)}"
-                    )
-            
-            agent = agent_cache[agent_type]
-            
-            # Start a conversation with the agent
-            conversation = await chat_client.create_conversation(agent_id=agent.id)
-            response = await conversation.send_message(
-                f"""Search for recent scientific literature about: {request.query}
-                Max Results: {request.max_results}
-                Include Clinical Trials: {request.include_clinical_trials}
-                
-                Focus on drug development implications and summarize key findings.
-                Provide references to support your analysis.
-                
-                Format your response as a JSON object with these fields:
-                {
-                    "query": "the search query",
-                    "summary": "your analysis and findings",
-                    "references": ["list of DOIs or citations"]
-                }"""
+            # Ask the shared agent on a fresh conversation
+            agent, response = await consult_agent(
+                "literature-search",
+                literature_search_prompt(request)
             )
             
             logger.info("✅ Literature search complete")
@@ -256,6 +540,10 @@ async def literature_search(request: LiteratureSearchRequest):
                 "agent_id": agent.id
             }
             
+        except RateLimitExceeded as e:
+            raise rate_limited(e)
+        except AgentUnavailable as e:
+            raise unavailable(e)
         except Exception as e:
             logger.error(f"❌ Error in literature search: {str(e)}")
             raise HTTPException(
@@ -263,6 +551,35 @@ async def literature_search(request: LiteratureSearchRequest):
                 detail=f"Error in literature search: {str(e)}"
             )
 
+@router.post("/literature-search/stream", tags=["agents"], dependencies=[Depends(require_agent_streaming)], summary="Stream a literature search as Server-Sent Events")
+async def literature_search_stream(request: LiteratureSearchRequest):
+    """
+    Same as /literature-search, streamed as Server-Sent Events.
+
+    Emits start, token, tool_call, field (each completed top-level JSON
+    field of the answer), done and error events; see stream_agent().
+    """
+    return await stream_endpoint("literature-search", literature_search_prompt(request))
+
+def molecule_analysis_prompt(request: MoleculeAnalysisRequest) -> str:
+    """Prompt for the molecule-analysis agent, shared by the plain and streaming endpoints."""
+    return f"""Analyze this molecule:
+        SMILES: {request.smiles}
+        Target Proteins: {', '.join(request.target_proteins)}
+        Therapeutic Area: {request.therapeutic_area}
+
+        Provide a detailed analysis of its drug-like properties and potential interactions.
+
+        Format your response as a JSON object with these fields:
+        {{
+            "molecule": "SMILES string",
+            "analysis": {{
+                "binding_predictions": {{"protein": score}},
+                "drug_likeness": score,
+                "safety_assessment": "description"
+            }}
+        }}"""
+
 @router.post("/molecule-analysis", tags=["agents"], summary="Analyze molecular properties using function calling")
 async def analyze_molecule(request: MoleculeAnalysisRequest):
     """
@@ -323,58 +640,10 @@ async def analyze_molecule(request: MoleculeAnalysisRequest):
             span.set_attribute("operation", "molecule_analysis")
             logger.info(f"🧪 Analyzing molecule: {request.smiles}")
 
-            # Get or create agent from cache
-            agent_type = "molecule-analysis"
-            if agent_type not in agent_cache:
-                # Create tools configuration
-                toolset = ToolSet()
-                bing_tool = BingGroundingTool(
-                    connection_id=os.getenv("spn_4o_BING_API_KEY")
-                )
-                function_tool = FunctionTool(
-                    functions=[analyze_molecule_properties]
-                )
-                toolset.add(bing_tool)
-                toolset.add(function_tool)
-
-                try:
-                    agent = await project_client.agents.create_agent(
-                        model=os.getenv('MODEL_DEPLOYMENT_NAME', os.getenv('spn_4o_model', 'gpt-4')),
-                        instructions="""You are a molecular analysis agent specialized in drug discovery.
-                        Analyze molecular properties and protein interactions to assess drug candidate potential.
-                        Provide detailed scientific explanations of your findings.""",
-                        toolset=toolset,
-                        headers={"x-ms-enable-preview": "true"}
-                    )
-                    agent_cache[agent_type] = agent
-                except Exception as e:
-                    logger.error(f"❌ Error creating {agent_type} agent: {str(e)}")
-                    raise HTTPException(
-                        status_code=500,
-                        detail=f"Error creating {agent_type} agent: {str(e)}"
-                    )
-            
-            agent = agent_cache[agent_type]
-            
-            # Start a conversation with the agent
-            conversation = await chat_client.create_conversation(agent_id=agent.id)
-            response = await conversation.send_message(
-                f"""Analyze this molecule:
-                SMILES: {request.smiles}
-                Target Proteins: {', '.join(request.target_proteins)}
-                Therapeutic Area: {request.therapeutic_area}
-                
-                Provide a detailed analysis of its drug-like properties and potential interactions.
-                
-                Format your response as a JSON object with these fields:
-                {
-                    "molecule": "SMILES string",
-                    "analysis": {
-                        "binding_predictions": {"protein": score},
-                        "drug_likeness": score,
-                        "safety_assessment": "description"
-                    }
-                }"""
+            # Ask the shared agent on a fresh conversation
+            agent, response = await consult_agent(
+                "molecule-analysis",
+                molecule_analysis_prompt(request)
             )
             
             logger.info("✅ Molecule analysis complete")
@@ -384,6 +653,16 @@ async def analyze_molecule(request: MoleculeAnalysisRequest):
                 "agent_id": agent.id
             }
             
+        except RateLimitExceeded as e:
+            raise rate_limited(e)
+        except AgentUnavailable as e:
+            logger.warning(f"⚠️ {str(e)}; using local molecule analysis")
+            return {
+                "molecule": request.smiles,
+                "analysis": json.dumps(analyze_molecule_properties(request.smiles, request.target_proteins)),
+                "agent_id": None,
+                "fallback": True
+            }
         except Exception as e:
             logger.error(f"❌ Error in molecule analysis: {str(e)}")
             raise HTTPException(
@@ -391,6 +670,54 @@ async def analyze_molecule(request: MoleculeAnalysisRequest):
                 detail=f"Error in molecule analysis: {str(e)}"
             )
 
+@router.post("/molecule-analysis/stream", tags=["agents"], dependencies=[Depends(require_agent_streaming)], summary="Stream a molecule analysis as Server-Sent Events")
+async def analyze_molecule_stream(request: MoleculeAnalysisRequest):
+    """
+    Same as /molecule-analysis, streamed as Server-Sent Events.
+
+    Emits start, token, tool_call, field (each completed top-level JSON
+    field of the answer), done and error events; see stream_agent().
+    """
+    return await stream_endpoint("molecule-analysis", molecule_analysis_prompt(request))
+
+async def upload_trial_data(file: UploadFile):
+    """Upload a trial data file for the code interpreter, keeping its original name."""
+    file_content = await file.read()
+    try:
+        # The upload keeps the original file name, in a directory of its own
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_file_path = os.path.join(temp_dir, os.path.basename(file.filename))
+            with open(temp_file_path, "wb") as f:
+                f.write(file_content)
+            return await clients.project_client.agents.upload_file_and_poll(
+                file_path=temp_file_path,
+                purpose=FilePurpose.AGENTS
+            )
+    except Exception as e:
+        logger.error(f"❌ Error uploading file: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error uploading file: {str(e)}"
+        )
+
+def trial_data_prompt(filename: str) -> str:
+    """Prompt for the data-analysis agent, shared by the plain and streaming endpoints."""
+    return f"""Analyze the clinical trial data in {filename}.
+        1. Create summary statistics of key metrics
+        2. Generate visualizations of important trends
+        3. Identify any significant patterns or concerns
+        4. Provide recommendations based on the analysis
+
+        Format your response as a JSON object with these fields:
+        {{
+            "filename": "name of analyzed file",
+            "analysis": {{
+                "correlations": {{"metric": value}},
+                "summary": "key findings",
+                "recommendations": ["list of recommendations"]
+            }}
+        }}"""
+
 @router.post("/data-analysis", tags=["agents"], summary="Analyze clinical trial data using code interpreter")
 async def analyze_trial_data(file: UploadFile = File(...)):
     """
@@ -445,72 +772,17 @@ async def analyze_trial_data(file: UploadFile = File(...)):
             logger.info("📈 Starting trial data analysis")
 
             # Upload file for code interpreter
-            file_content = await file.read()
+            uploaded_file = await upload_trial_data(file)
+
             try:
-                # Create a temporary file
-                temp_file_path = f"/tmp/{file.filename}"
-                with open(temp_file_path, "wb") as f:
-                    f.write(file_content)
-                
-                # Create tools configuration
-                toolset = ToolSet()
-                code_tool = CodeInterpreterTool()
-                toolset.add(code_tool)
-                
-                # Store file content in memory for code interpreter
-                with open(temp_file_path, "rb") as f:
-                    file_content = f.read()
-                    file_id = f"file_{uuid.uuid4()}"
-                    
-                # Create agent with proper tool configuration
-                toolset = ToolSet()
-                code_tool = CodeInterpreterTool(
-                    file_ids=[{
-                        "id": file_id,
-                        "name": file.filename,
-                        "content": file_content.decode('utf-8') if isinstance(file_content, bytes) else file_content
-                    }]
+                # The shared agent reads the file through this conversation's tool resources
+                agent, response = await consult_agent(
+                    "data-analysis",
+                    trial_data_prompt(file.filename),
+                    tool_resources=CodeInterpreterTool(file_ids=[uploaded_file.id]).resources
                 )
-                toolset.add(code_tool)
-                
-                # Clean up
-                os.remove(temp_file_path)
-            except Exception as e:
-                logger.error(f"❌ Error uploading file: {str(e)}")
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"Error uploading file: {str(e)}"
-                )
-
-            # Create agent with proper tool configuration
-            agent = await project_client.agents.create_agent(
-                model=os.getenv('MODEL_DEPLOYMENT_NAME', os.getenv('spn_4o_model', 'gpt-4')),
-                instructions="""You are a clinical trial data analysis agent.
-                Analyze trial data to extract insights about drug efficacy, safety profiles,
-                and patient outcomes. Create visualizations to support your findings.""",
-                toolset=toolset,
-                headers={"x-ms-enable-preview": "true"}
-            )
-            
-            # Start a conversation with the agent
-            conversation = await chat_client.create_conversation(agent_id=agent.id)
-            response = await conversation.send_message(
-                f"""Analyze the clinical trial data in {file.filename}.
-                1. Create summary statistics of key metrics
-                2. Generate visualizations of important trends
-                3. Identify any significant patterns or concerns
-                4. Provide recommendations based on the analysis
-                
-                Format your response as a JSON object with these fields:
-                {
-                    "filename": "name of analyzed file",
-                    "analysis": {
-                        "correlations": {"metric": value},
-                        "summary": "key findings",
-                        "recommendations": ["list of recommendations"]
-                    }
-                }"""
-            )
+            finally:
+                await delete_uploaded_file(uploaded_file.id)
             
             logger.info("✅ Trial data analysis complete")
             return {
@@ -519,6 +791,10 @@ async def analyze_trial_data(file: UploadFile = File(...)):
                 "agent_id": agent.id
             }
             
+        except RateLimitExceeded as e:
+            raise rate_limited(e)
+        except AgentUnavailable as e:
+            raise unavailable(e)
         except Exception as e:
             logger.error(f"❌ Error in trial data analysis: {str(e)}")
             raise HTTPException(
@@ -526,6 +802,23 @@ async def analyze_trial_data(file: UploadFile = File(...)):
                 detail=f"Error in trial data analysis: {str(e)}"
             )
 
+@router.post("/data-analysis/stream", tags=["agents"], dependencies=[Depends(require_agent_streaming)], summary="Stream a trial data analysis as Server-Sent Events")
+async def analyze_trial_data_stream(file: UploadFile = File(...)):
+    """
+    Same as /data-analysis, streamed as Server-Sent Events.
+
+    Emits start, token, tool_call, field (each completed top-level JSON
+    field of the answer), done and error events; see stream_agent(). The
+    upload is deleted once the stream ends.
+    """
+    uploaded_file = await upload_trial_data(file)
+    return await stream_endpoint(
+        "data-analysis",
+        trial_data_prompt(file.filename),
+        tool_resources=CodeInterpreterTool(file_ids=[uploaded_file.id]).resources,
+        cleanup=lambda: delete_uploaded_file(uploaded_file.id)
+    )
+
 
 class ManufacturingOptRequest(BaseModel):
     """Request model for manufacturing optimization."""
@@ -564,31 +857,19 @@ def optimize_manufacturing(
         }
     }
 
+AGENT_DEFINITIONS["manufacturing-opt"] = AgentDefinition(
+    instructions="""You are a manufacturing optimization agent.
+    Use simulation and optimization techniques to determine the most
+    efficient production parameters while considering costs, capacity,
+    and material constraints.""",
+    tools=lambda: [CodeInterpreterTool(), FunctionTool(functions=[optimize_manufacturing])]
+)
+
 async def process_manufacturing_opt_request(request: ManufacturingOptRequest) -> dict:
     """Process a manufacturing optimization request using Azure AI agents."""
-    # Create tools configuration
-    toolset = ToolSet()
-    code_tool = CodeInterpreterTool()
-    function_tool = FunctionTool(
-        functions=[optimize_manufacturing]
-    )
-    toolset.add(code_tool)
-    toolset.add(function_tool)
-
-    # Create agent
-    agent = await project_client.agents.create_agent(
-        model=os.getenv('MODEL_DEPLOYMENT_NAME', os.getenv('spn_4o_model', 'gpt-4')),
-        instructions="""You are a manufacturing optimization expert.
-        Use the code interpreter to solve linear programming problems
-        and optimize production schedules. Consider constraints and
-        validate solutions using the provided functions.""",
-        toolset=toolset,
-        headers={"x-ms-enable-preview": "true"}
-    )
-
-    # Start conversation
-    conversation = await chat_client.create_conversation(agent_id=agent.id)
-    response = await conversation.send_message(
+    # Ask the shared agent on a fresh conversation
+    agent, response = await consult_agent(
+        "manufacturing-opt",
         f"""Optimize manufacturing schedule:
         Drug: {request.drug_candidate}
         Batch Sizes: {request.batch_size_range}
@@ -614,6 +895,28 @@ async def process_manufacturing_opt_request(request: ManufacturingOptRequest) ->
         "agent_id": agent.id
     }
 
+def manufacturing_opt_prompt(request: ManufacturingOptRequest) -> str:
+    """Prompt for the manufacturing-opt agent, shared by the plain and streaming endpoints."""
+    return f"""Optimize manufacturing process:
+        Drug Candidate: {request.drug_candidate}
+        Batch Size Options: {request.batch_size_range}
+        Available Materials: {request.raw_materials}
+        Production Constraints: {request.production_constraints}
+
+        1. Run production simulation
+        2. Optimize batch sizes and line allocation
+        3. Calculate costs and efficiency metrics
+        4. Provide detailed recommendations
+
+        Format your response as a JSON object with these fields:
+        {{
+            "optimized_schedule": {{
+                "batch_size": integer,
+                "line_allocation": "factory name",
+                "estimated_unit_cost": float
+            }}
+        }}"""
+
 @router.post("/manufacturing-opt", tags=["agents"], summary="Optimize manufacturing process")
 async def optimize_production(request: ManufacturingOptRequest):
     """
@@ -675,60 +978,10 @@ async def optimize_production(request: ManufacturingOptRequest):
             span.set_attribute("operation", "manufacturing_optimization")
             logger.info(f"🏭 Optimizing production for: {request.drug_candidate}")
 
-            # Get or create agent from cache
-            agent_type = "manufacturing-opt"
-            if agent_type not in agent_cache:
-                # Create tools configuration
-                toolset = ToolSet()
-                code_tool = CodeInterpreterTool()
-                function_tool = FunctionTool(
-                    functions=[optimize_manufacturing]
-                )
-                toolset.add(code_tool)
-                toolset.add(function_tool)
-
-                try:
-                    agent = await project_client.agents.create_agent(
-                        model=os.getenv('MODEL_DEPLOYMENT_NAME', os.getenv('spn_4o_model', 'gpt-4')),
-                        instructions="""You are a manufacturing optimization agent.
-                        Use simulation and optimization techniques to determine the most
-                        efficient production parameters while considering costs, capacity,
-                        and material constraints.""",
-                        toolset=toolset,
-                        headers={"x-ms-enable-preview": "true"}
-                    )
-                    agent_cache[agent_type] = agent
-                except Exception as e:
-                    logger.error(f"❌ Error creating {agent_type} agent: {str(e)}")
-                    raise HTTPException(
-                        status_code=500,
-                        detail=f"Error creating {agent_type} agent: {str(e)}"
-                    )
-            
-            agent = agent_cache[agent_type]
-            
-            # Start a conversation with the agent
-            conversation = await chat_client.create_conversation(agent_id=agent.id)
-            response = await conversation.send_message(
-                f"""Optimize manufacturing process:
-                Drug Candidate: {request.drug_candidate}
-                Batch Size Options: {request.batch_size_range}
-                Available Materials: {request.raw_materials}
-                Production Constraints: {request.production_constraints}
-                
-                1. Run production simulation
-                2. Optimize batch sizes and line allocation
-                3. Calculate costs and efficiency metrics
-                4. Provide detailed recommendations
-                
-                Format your response as a JSON object with these fields:
-                {{
-                    "optimized_schedule": {{
-                        "batch_size": integer,
-                        "line_allocation": "factory name",
-                        "estimated_unit_cost": float
-                    }}
-                }}"""
+            # Ask the shared agent on a fresh conversation
+            agent, response = await consult_agent(
+                "manufacturing-opt",
+                manufacturing_opt_prompt(request)
             )
             
             logger.info("✅ Manufacturing optimization complete")
@@ -761,6 +1014,25 @@ async def optimize_production(request: ManufacturingOptRequest):
                 "agent_id": agent.id
             }
             
+        except RateLimitExceeded as e:
+            raise rate_limited(e)
+        except AgentUnavailable as e:
+            logger.warning(f"⚠️ {str(e)}; using local manufacturing optimization")
+            optimization_results = optimize_manufacturing(
+                request.drug_candidate,
+                request.batch_size_range,
+                request.raw_materials,
+                request.production_constraints
+            )
+            return {
+                "optimized_schedule": {
+                    "batch_size": optimization_results["batch_size"],
+                    "line_allocation": optimization_results["line_allocation"],
+                    "estimated_unit_cost": optimization_results["estimated_unit_cost"]
+                },
+                "agent_id": None,
+                "fallback": True
+            }
         except Exception as e:
             logger.error(f"❌ Error in manufacturing optimization: {str(e)}")
             raise HTTPException(
@@ -768,6 +1040,16 @@ async def optimize_production(request: ManufacturingOptRequest):
                 detail=f"Error in manufacturing optimization: {str(e)}"
             )
 
+@router.post("/manufacturing-opt/stream", tags=["agents"], dependencies=[Depends(require_agent_streaming)], summary="Stream a manufacturing optimization as Server-Sent Events")
+async def optimize_production_stream(request: ManufacturingOptRequest):
+    """
+    Same as /manufacturing-opt, streamed as Server-Sent Events.
+
+    Emits start, token, tool_call, field (each completed top-level JSON
+    field of the answer), done and error events; see stream_agent().
+    """
+    return await stream_endpoint("manufacturing-opt", manufacturing_opt_prompt(request))
+
 
 class PrecisionMedRequest(BaseModel):
     """Request model for precision medicine analysis."""
@@ -776,6 +1058,16 @@ class PrecisionMedRequest(BaseModel):
     medical_history: dict
     current_medications: Optional[List[str]] = []
 
+# Dose multipliers by metabolizer status, applied to the base dose
+BASE_DOSE_MG = 120
+DOSE_ADJUSTMENT = {
+    "Poor": 0.5,        # 50% reduction
+    "Intermediate": 0.75,  # 25% reduction
+    "Normal": 1.0,      # Standard dose
+    "Rapid": 1.25,      # 25% increase
+    "Ultra-rapid": 1.5  # 50% increase
+}
+
 def analyze_genomic_compatibility(
     genetic_markers: dict,
     medical_history: dict,
@@ -804,33 +1096,19 @@ def analyze_genomic_compatibility(
         ])
     }
 
+AGENT_DEFINITIONS["precision-med"] = AgentDefinition(
+    instructions="""You are a precision medicine analysis agent.
+    Evaluate patient genomic data and medical history to provide
+    personalized treatment recommendations. Consider genetic markers,
+    drug interactions, and potential adverse effects.""",
+    tools=lambda: [bing_tool(), FunctionTool(functions=[analyze_genomic_compatibility])]
+)
+
 async def process_precision_med_request(request: PrecisionMedRequest) -> dict:
     """Process a precision medicine request using Azure AI agents."""
-    # Create tools configuration
-    toolset = ToolSet()
-    bing_tool = BingGroundingTool(
-        connection_id=os.getenv("spn_4o_BING_API_KEY")
-    )
-    function_tool = FunctionTool(
-        functions=[analyze_genomic_compatibility]
-    )
-    toolset.add(bing_tool)
-    toolset.add(function_tool)
-
-    # Create agent
-    agent = await project_client.agents.create_agent(
-        model=os.getenv('MODEL_DEPLOYMENT_NAME', os.getenv('spn_4o_model', 'gpt-4')),
-        instructions="""You are a precision medicine expert.
-        Analyze genetic markers and medical history to provide
-        personalized treatment recommendations. Use Bing to
-        ground recommendations in recent research.""",
-        toolset=toolset,
-        headers={"x-ms-enable-preview": "true"}
-    )
-
-    # Start conversation
-    conversation = await chat_client.create_conversation(agent_id=agent.id)
-    response = await conversation.send_message(
+    # Ask the shared agent on a fresh conversation
+    agent, response = await consult_agent(
+        "precision-med",
         f"""Analyze patient data for personalized treatment:
         Patient ID: {request.patient_id}
         Genetic Markers: {json.dumps(request.genetic_markers)}
@@ -852,6 +1130,27 @@ async def process_precision_med_request(request: PrecisionMedRequest) -> dict:
 
     return json.loads(response.message.content) | {"agent_id": agent.id}
 
+def precision_med_prompt(request: PrecisionMedRequest) -> str:
+    """Prompt for the precision-med agent, shared by the plain and streaming endpoints."""
+    return f"""Analyze patient data for precision medicine:
+        Patient ID: {request.patient_id}
+        Genetic Markers: {request.genetic_markers}
+        Medical History: {request.medical_history}
+        Current Medications: {request.current_medications}
+
+        1. Research genetic variants and their implications
+        2. Analyze drug-gene interactions
+        3. Calculate compatibility scores
+        4. Provide personalized recommendations
+
+        Format your response as a JSON object with these fields:
+        {{
+            "patient_id": "patient identifier",
+            "custom_dosage": "dosage recommendation",
+            "predicted_outcome": float between 0 and 1,
+            "recommended_followups": ["list of followup actions"]
+        }}"""
+
 @router.post("/precision-med", tags=["agents"], summary="Generate personalized treatment recommendations")
 async def precision_medicine(request: PrecisionMedRequest):
     """
@@ -915,61 +1214,10 @@ async def precision_medicine(request: PrecisionMedRequest):
             span.set_attribute("operation", "precision_medicine")
             logger.info(f"🧬 Analyzing precision medicine for patient: {request.patient_id}")
 
-            # Get or create agent from cache
-            agent_type = "precision-med"
-            if agent_type not in agent_cache:
-                # Create tools configuration
-                toolset = ToolSet()
-                bing_tool = BingGroundingTool(
-                    connection_id=os.getenv("spn_4o_BING_API_KEY")
-                )
-                function_tool = FunctionTool(
-                    functions=[analyze_genomic_compatibility]
-                )
-                toolset.add(bing_tool)
-                toolset.add(function_tool)
-
-                try:
-                    agent = await project_client.agents.create_agent(
-                        model=os.getenv('MODEL_DEPLOYMENT_NAME', os.getenv('spn_4o_model', 'gpt-4')),
-                        instructions="""You are a precision medicine analysis agent.
-                        Evaluate patient genomic data and medical history to provide
-                        personalized treatment recommendations. Consider genetic markers,
-                        drug interactions, and potential adverse effects.""",
-                        toolset=toolset,
-                        headers={"x-ms-enable-preview": "true"}
-                    )
-                    agent_cache[agent_type] = agent
-                except Exception as e:
-                    logger.error(f"❌ Error creating {agent_type} agent: {str(e)}")
-                    raise HTTPException(
-                        status_code=500,
-                        detail=f"Error creating {agent_type} agent: {str(e)}"
-                    )
-            
-            agent = agent_cache[agent_type]
-            
-            # Start a conversation with the agent
-            conversation = await chat_client.create_conversation(agent_id=agent.id)
-            response = await conversation.send_message(
-                f"""Analyze patient data for precision medicine:
-                Patient ID: {request.patient_id}
-                Genetic Markers: {request.genetic_markers}
-                Medical History: {request.medical_history}
-                Current Medications: {request.current_medications}
-                
-                1. Research genetic variants and their implications
-                2. Analyze drug-gene interactions
-                3. Calculate compatibility scores
-                4. Provide personalized recommendations
-                
-                Format your response as a JSON object with these fields:
-                {{
-                    "patient_id": "patient identifier",
-                    "custom_dosage": "dosage recommendation",
-                    "predicted_outcome": float between 0 and 1,
-                    "recommended_followups": ["list of followup actions"]
-                }}"""
+            # Ask the shared agent on a fresh conversation
+            agent, response = await consult_agent(
+                "precision-med",
+                precision_med_prompt(request)
             )
             
             logger.info("✅ Precision medicine analysis complete")
@@ -980,15 +1228,7 @@ async def precision_medicine(request: PrecisionMedRequest):
             )
             
             # Calculate custom dosage based on metabolizer status
-            base_dose = 120  # mg
-            dose_adjustment = {
-                "Poor": 0.5,        # 50% reduction
-                "Intermediate": 0.75,  # 25% reduction
-                "Normal": 1.0,      # Standard dose
-                "Rapid": 1.25,      # 25% increase
-                "Ultra-rapid": 1.5  # 50% increase
-            }
-            adjusted_dose = base_dose * dose_adjustment[analysis_results["metabolizer_status"]]
+            adjusted_dose = BASE_DOSE_MG * DOSE_ADJUSTMENT[analysis_results["metabolizer_status"]]
             
             # Parse the agent's response
             try:
@@ -1021,6 +1261,28 @@ async def precision_medicine(request: PrecisionMedRequest):
             
             return result
             
+        except RateLimitExceeded as e:
+            raise rate_limited(e)
+        except AgentUnavailable as e:
+            logger.warning(f"⚠️ {str(e)}; using local genomic analysis")
+            analysis_results = analyze_genomic_compatibility(
+                request.genetic_markers,
+                request.medical_history,
+                request.current_medications
+            )
+            adjusted_dose = BASE_DOSE_MG * DOSE_ADJUSTMENT[analysis_results["metabolizer_status"]]
+            return {
+                "patient_id": request.patient_id,
+                "custom_dosage": f"{int(adjusted_dose)} mg daily",
+                "predicted_outcome": analysis_results["predicted_response"],
+                "recommended_followups": [
+                    "Monthly biomarker profiling",
+                    f"Monitor {', '.join(analysis_results['genetic_risk_factors'])}",
+                    f"Adjust dose based on {analysis_results['metabolizer_status']} metabolizer status"
+                ],
+                "agent_id": None,
+                "fallback": True
+            }
         except Exception as e:
             logger.error(f"❌ Error in precision medicine analysis: {str(e)}")
             raise HTTPException(
@@ -1028,6 +1290,16 @@ async def precision_medicine(request: PrecisionMedRequest):
                 detail=f"Error in precision medicine analysis: {str(e)}"
             )
 
+@router.post("/precision-med/stream", tags=["agents"], dependencies=[Depends(require_agent_streaming)], summary="Stream treatment recommendations as Server-Sent Events")
+async def precision_medicine_stream(request: PrecisionMedRequest):
+    """
+    Same as /precision-med, streamed as Server-Sent Events.
+
+    Emits start, token, tool_call, field (each completed top-level JSON
+    field of the answer), done and error events; see stream_agent().
+    """
+    return await stream_endpoint("precision-med", precision_med_prompt(request))
+
 
 class DigitalTwinRequest(BaseModel):
     """Request model for digital twin clinical simulation."""
@@ -1070,31 +1342,19 @@ def run_clinical_simulation(
         }
     }
 
+AGENT_DEFINITIONS["digital-twin-sim"] = AgentDefinition(
+    instructions="""You are a clinical trial simulation expert.
+    Use PK/PD modeling and statistical analysis to simulate
+    patient populations and predict trial outcomes. Consider
+    patient characteristics, drug properties, and trial design.""",
+    tools=lambda: [CodeInterpreterTool(), FunctionTool(functions=[run_clinical_simulation])]
+)
+
 async def process_digital_twin_request(request: DigitalTwinRequest) -> dict:
     """Process a digital twin simulation request using Azure AI agents."""
-    # Create tools configuration
-    toolset = ToolSet()
-    code_tool = CodeInterpreterTool()
-    function_tool = FunctionTool(
-        functions=[run_clinical_simulation]
-    )
-    toolset.add(code_tool)
-    toolset.add(function_tool)
-
-    # Create agent
-    agent = await project_client.agents.create_agent(
-        model=os.getenv('MODEL_DEPLOYMENT_NAME', os.getenv('spn_4o_model', 'gpt-4')),
-        instructions="""You are a clinical simulation expert.
-        Use the code interpreter to run population-level simulations
-        and analyze outcomes. Process results using provided functions
-        to generate meaningful insights.""",
-        toolset=toolset,
-        headers={"x-ms-enable-preview": "true"}
-    )
-
-    # Start conversation
-    conversation = await chat_client.create_conversation(agent_id=agent.id)
-    response = await conversation.send_message(
+    # Ask the shared agent on a fresh conversation
+    agent, response = await consult_agent(
+        "digital-twin-sim",
         f"""Run digital twin simulation:
         Molecule Parameters: {json.dumps(request.molecule_parameters)}
         Target Population: {json.dumps(request.target_population)}
@@ -1114,6 +1374,33 @@ async def process_digital_twin_request(request: DigitalTwinRequest) -> dict:
 
     return json.loads(response.message.content) | {"agent_id": agent.id}
 
+def digital_twin_prompt(request: DigitalTwinRequest) -> str:
+    """Prompt for the digital-twin-sim agent, shared by the plain and streaming endpoints."""
+    return f"""Simulate clinical trial outcomes:
+        Molecule Parameters: {request.molecule_parameters}
+        Target Population: {request.target_population}
+        Simulation Config: {request.simulation_config}
+
+        1. Run PK/PD simulations
+        2. Generate virtual patient cohorts
+        3. Calculate outcome metrics
+        4. Analyze safety and efficacy
+
+        Format your response as a JSON object with these fields:
+        {{
+            "simulated_population_size": integer,
+            "mean_toxicity_score": float between 0 and 1,
+            "average_survival_gain": "duration in months",
+            "detailed_metrics": {{
+                "efficacy_by_subgroup": {{
+                    "subgroup_name": float (efficacy score)
+                }},
+                "adverse_events": {{
+                    "event_type": float (frequency)
+                }}
+            }}
+        }}"""
+
 @router.post("/digital-twin-sim", tags=["agents"], summary="Simulate clinical trial outcomes")
 async def digital_twin_simulation(request: DigitalTwinRequest):
     """
@@ -1180,65 +1467,10 @@ async def digital_twin_simulation(request: DigitalTwinRequest):
             span.set_attribute("operation", "digital_twin_simulation")
             logger.info("🔬 Running digital twin simulation")
 
-            # Get or create agent from cache
-            agent_type = "digital-twin-sim"
-            if agent_type not in agent_cache:
-                # Create tools configuration
-                toolset = ToolSet()
-                code_tool = CodeInterpreterTool()
-                function_tool = FunctionTool(
-                    functions=[run_clinical_simulation]
-                )
-                toolset.add(code_tool)
-                toolset.add(function_tool)
-
-                try:
-                    agent = await project_client.agents.create_agent(
-                        model=os.getenv('MODEL_DEPLOYMENT_NAME', os.getenv('spn_4o_model', 'gpt-4')),
-                        instructions="""You are a clinical trial simulation expert.
-                        Use PK/PD modeling and statistical analysis to simulate
-                        patient populations and predict trial outcomes. Consider
-                        patient characteristics, drug properties, and trial design.""",
-                        toolset=toolset,
-                        headers={"x-ms-enable-preview": "true"}
-                    )
-                    agent_cache[agent_type] = agent
-                except Exception as e:
-                    logger.error(f"❌ Error creating {agent_type} agent: {str(e)}")
-                    raise HTTPException(
-                        status_code=500,
-                        detail=f"Error creating {agent_type} agent: {str(e)}"
-                    )
-            
-            agent = agent_cache[agent_type]
-            
-            # Start a conversation with the agent
-            conversation = await chat_client.create_conversation(agent_id=agent.id)
-            response = await conversation.send_message(
-                f"""Simulate clinical trial outcomes:
-                Molecule Parameters: {request.molecule_parameters}
-                Target Population: {request.target_population}
-                Simulation Config: {request.simulation_config}
-                
-                1. Run PK/PD simulations
-                2. Generate virtual patient cohorts
-                3. Calculate outcome metrics
-                4. Analyze safety and efficacy
-                
-                Format your response as a JSON object with these fields:
-                {{
-                    "simulated_population_size": integer,
-                    "mean_toxicity_score": float between 0 and 1,
-                    "average_survival_gain": "duration in months",
-                    "detailed_metrics": {{
-                        "efficacy_by_subgroup": {{
-                            "subgroup_name": float (efficacy score)
-                        }},
-                        "adverse_events": {{
-                            "event_type": float (frequency)
-                        }}
-                    }}
-                }}"""
+            # Ask the shared agent on a fresh conversation
+            agent, response = await consult_agent(
+                "digital-twin-sim",
+                digital_twin_prompt(request)
             )
             
             logger.info("✅ Digital twin simulation complete")
@@ -1269,6 +1501,22 @@ async def digital_twin_simulation(request: DigitalTwinRequest):
             
             return result
             
+        except RateLimitExceeded as e:
+            raise rate_limited(e)
+        except AgentUnavailable as e:
+            logger.warning(f"⚠️ {str(e)}; using local clinical simulation")
+            simulation_results = run_clinical_simulation(
+                request.molecule_parameters,
+                request.target_population,
+                request.simulation_config
+            )
+            return {
+                "simulated_population_size": simulation_results["population_size"],
+                "mean_toxicity_score": simulation_results["toxicity_scores"]["mean"],
+                "average_survival_gain": simulation_results["efficacy_metrics"]["survival_gain"],
+                "agent_id": None,
+                "fallback": True
+            }
         except Exception as e:
             logger.error(f"❌ Error in digital twin simulation: {str(e)}")
             raise HTTPException(
@@ -1276,6 +1524,16 @@ async def digital_twin_simulation(request: DigitalTwinRequest):
                 detail=f"Error in digital twin simulation: {str(e)}"
             )
 
+@router.post("/digital-twin-sim/stream", tags=["agents"], dependencies=[Depends(require_agent_streaming)], summary="Stream a clinical trial simulation as Server-Sent Events")
+async def digital_twin_simulation_stream(request: DigitalTwinRequest):
+    """
+    Same as /digital-twin-sim, streamed as Server-Sent Events.
+
+    Emits start, token, tool_call, field (each completed top-level JSON
+    field of the answer), done and error events; see stream_agent().
+    """
+    return await stream_endpoint("digital-twin-sim", digital_twin_prompt(request))
+
 
 class DrugRepurposeRequest(BaseModel):
     """Request model for drug repurposing analysis."""
@@ -1305,33 +1563,19 @@ def calculate_repurposing_score(molecule_id: str, target_disease: str) -> dict:
         ]
     }
 
+AGENT_DEFINITIONS["drug-repurpose"] = AgentDefinition(
+    instructions="""You are a drug repurposing analysis agent.
+    Evaluate the potential of existing drugs for new therapeutic indications
+    by analyzing scientific literature and calculating similarity scores.
+    Consider mechanism of action, safety profiles, and development feasibility.""",
+    tools=lambda: [bing_tool(), FunctionTool(functions=[calculate_repurposing_score])]
+)
+
 async def process_drug_repurpose_request(request: DrugRepurposeRequest) -> dict:
     """Process a drug repurposing request using Azure AI agents."""
-    # Create tools configuration
-    toolset = ToolSet()
-    bing_tool = BingGroundingTool(
-        connection_id=os.getenv("spn_4o_BING_API_KEY")
-    )
-    function_tool = FunctionTool(
-        functions=[calculate_repurposing_score]
-    )
-    toolset.add(bing_tool)
-    toolset.add(function_tool)
-
-    # Create agent
-    agent = await project_client.agents.create_agent(
-        model=os.getenv('MODEL_DEPLOYMENT_NAME', os.getenv('spn_4o_model', 'gpt-4')),
-        instructions="""You are a drug repurposing expert.
-        Leverage the Bing grounding tool to find recent research
-        about reusing a known compound for a new indication.
-        Then run any local function(s) to estimate feasibility.""",
-        toolset=toolset,
-        headers={"x-ms-enable-preview": "true"}
-    )
-
-    # Start conversation
-    conversation = await chat_client.create_conversation(agent_id=agent.id)
-    response = await conversation.send_message(
+    # Ask the shared agent on a fresh conversation
+    agent, response = await consult_agent(
+        "drug-repurpose",
         f"""Analyze repurposing potential:
         Molecule ID: {request.molecule_id}
         Current Indications: {', '.join(request.current_indications)}
@@ -1358,6 +1602,28 @@ async def process_drug_repurpose_request(request: DrugRepurposeRequest) -> dict:
         "agent_id": agent.id
     }
 
+def drug_repurpose_prompt(request: DrugRepurposeRequest) -> str:
+    """Prompt for the drug-repurpose agent, shared by the plain and streaming endpoints."""
+    return f"""Analyze repurposing potential:
+        Molecule ID: {request.molecule_id}
+        Current Indications: {', '.join(request.current_indications)}
+        Proposed New Indication: {request.new_indication}
+
+        1. Search for relevant literature about similar repurposing cases
+        2. Calculate repurposing feasibility scores
+        3. Provide detailed recommendations with supporting evidence
+
+        Format your response as a JSON object with these fields:
+        {{
+            "repurposing_opportunities": [
+                {{
+                    "disease": "disease name",
+                    "confidence": 0.0 to 1.0,
+                    "supporting_sources": ["DOI or citation"]
+                }}
+            ]
+        }}"""
+
 @router.post("/drug-repurpose", tags=["agents"], summary="Analyze drug repurposing opportunities")
 async def drug_repurpose(request: DrugRepurposeRequest):
     """
@@ -1417,66 +1683,10 @@ async def drug_repurpose(request: DrugRepurposeRequest):
             span.set_attribute("operation", "drug_repurpose")
             logger.info(f"🔄 Analyzing repurposing potential for molecule: {request.molecule_id}")
 
-            # Get or create agent from cache
-            agent_type = "drug-repurpose"
-            if agent_type not in agent_cache:
-                # Create tools configuration
-                toolset = ToolSet()
-                
-                # Add Bing grounding tool with connection ID
-                bing_tool = BingGroundingTool(
-                    connection_id=os.getenv("spn_4o_BING_API_KEY")
-                )
-                toolset.add(bing_tool)
-                
-                # Add function tool with proper configuration
-                function_tool = FunctionTool(
-                    functions=[calculate_repurposing_score]
-                )
-                toolset.add(function_tool)
-
-                try:
-                    agent = await project_client.agents.create_agent(
-                        model=os.getenv('MODEL_DEPLOYMENT_NAME', os.getenv('spn_4o_model', 'gpt-4')),
-                        instructions="""You are a drug repurposing analysis agent.
-                        Evaluate the potential of existing drugs for new therapeutic indications
-                        by analyzing scientific literature and calculating similarity scores.
-                        Consider mechanism of action, safety profiles, and development feasibility.""",
-                        toolset=toolset,
-                        headers={"x-ms-enable-preview": "true"}
-                    )
-                    agent_cache[agent_type] = agent
-                except Exception as e:
-                    logger.error(f"❌ Error creating {agent_type} agent: {str(e)}")
-                    raise HTTPException(
-                        status_code=500,
-                        detail=f"Error creating {agent_type} agent: {str(e)}"
-                    )
-            
-            agent = agent_cache[agent_type]
-            
-            # Start a conversation with the agent
-            conversation = await chat_client.create_conversation(agent_id=agent.id)
-            response = await conversation.send_message(
-                f"""Analyze repurposing potential:
-                Molecule ID: {request.molecule_id}
-                Current Indications: {', '.join(request.current_indications)}
-                Proposed New Indication: {request.new_indication}
-                
-                1. Search for relevant literature about similar repurposing cases
-                2. Calculate repurposing feasibility scores
-                3. Provide detailed recommendations with supporting evidence
-                
-                Format your response as a JSON object with these fields:
-                {{
-                    "repurposing_opportunities": [
-                        {{
-                            "disease": "disease name",
-                            "confidence": 0.0 to 1.0,
-                            "supporting_sources": ["DOI or citation"]
-                        }}
-                    ]
-                }}"""
+            # Ask the shared agent on a fresh conversation
+            agent, response = await consult_agent(
+                "drug-repurpose",
+                drug_repurpose_prompt(request)
             )
             
             logger.info("✅ Drug repurposing analysis complete")
@@ -1510,9 +1720,30 @@ async def drug_repurpose(request: DrugRepurposeRequest):
             
             return result
             
+        except RateLimitExceeded as e:
+            raise rate_limited(e)
+        except AgentUnavailable as e:
+            logger.warning(f"⚠️ {str(e)}; using local repurposing score")
+            return {
+                "repurposing_opportunities": [
+                    calculate_repurposing_score(request.molecule_id, request.new_indication)
+                ],
+                "agent_id": None,
+                "fallback": True
+            }
         except Exception as e:
             logger.error(f"❌ Error in drug repurposing analysis: {str(e)}")
             raise HTTPException(
                 status_code=500,
                 detail=f"Error in drug repurposing analysis: {str(e)}"
             )
+
+@router.post("/drug-repurpose/stream", tags=["agents"], dependencies=[Depends(require_agent_streaming)], summary="Stream a drug repurposing analysis as Server-Sent Events")
+async def drug_repurpose_stream(request: DrugRepurposeRequest):
+    """
+    Same as /drug-repurpose, streamed as Server-Sent Events.
+
+    Emits start, token, tool_call, field (each completed top-level JSON
+    field of the answer), done and error events; see stream_agent().
+    """
+    return await stream_endpoint("drug-repurpose", drug_repurpose_prompt(request))
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
 from typing import List, Optional
-from database_stub import get_storage
+from database import get_storage
 from models import AutomatedTest, TestResult, DrugCandidate
 from datetime import datetime
 import json
@@ -15,11 +15,9 @@ from opentelemetry import trace
 from opentelemetry.trace import Status, StatusCode
 from azure.core.tracing.ext.opentelemetry_span import OpenTelemetrySpan
 from azure.ai.projects.models import Evaluation, Dataset, EvaluatorConfiguration
-from azure.ai.evaluation import F1ScoreEvaluator
 
-# Import Azure AI Foundry clients from main
-from clients import project_client, chat_client, tracer
-from main import f1_evaluator
+# Import Azure AI Foundry clients
+from clients import tracer, get_f1_evaluator, run_blocking
 
 router = APIRouter(tags=["automated-testing"])
 
@@ -63,10 +61,11 @@ async def run_evaluation_demo(
                 evaluation_data = [json.loads(line) for line in f if line.strip()]
             
             # Run F1 score evaluation
-            evaluation_results = f1_evaluator.evaluate(evaluation_data)
+            # The evaluator is synchronous (and slow to import on first use);
+            # keep both off the event loop
+            evaluation_results = await run_blocking(lambda: get_f1_evaluator().evaluate(evaluation_data))
             
             # Store results in storage
-            storage = db()
             test_dict = {
                 "test_id": f"EVAL-{datetime.now().strftime('%Y%m%d-%H%M%S')}",
                 "test_type": "AI_EVALUATION",
@@ -76,7 +75,7 @@ async def run_evaluation_demo(
                 "measurements": {"f1_score": evaluation_results},
                 "ai_analysis": {"metrics": evaluation_results}
             }
-            storage["add_item"]("automated_tests", test_dict)
+            await asyncio.to_thread(storage["add_item"], "automated_tests", test_dict)
             
             return {
                 "message": "Evaluation complete",
@@ -98,7 +97,7 @@ async def run_evaluation_demo(
             )
 
 @router.post("/high-throughput-screen")
-async def run_high_throughput_screening(
+def run_high_throughput_screening(
     test_type: str,
     drug_candidates: List[str],
     storage = Depends(get_storage)
@@ -113,26 +112,31 @@ async def run_high_throughput_screening(
     - Automated analysis
     - Safety monitoring
     """
-    results = []
-    for candidate_id in drug_candidates:
-        # Create test record
-        test = AutomatedTestTable(
-            test_id=f"TEST-{datetime.now().strftime('%Y%m%d-%H%M%S')}",
-            drug_candidate_id=candidate_id,
-            test_type=test_type,
-            start_time=datetime.now(),
-            parameters={"concentration": "10uM", "duration": "48h"},
-            result=TestResult.IN_PROGRESS
-        )
-        db.add(test)
-        db.commit()
-        
-        results.append({
-            "test_id": test.test_id,
+    # Persist the whole plate in one bulk write
+    test_ids = [f"TEST-{item_id}" for item_id in storage["allocate_ids"]("automated_tests", len(drug_candidates))]
+    start_time = datetime.now().isoformat()
+    tests = storage["add_items"]("automated_tests", [
+        {
+            "id": test_id,
+            "test_id": test_id,
             "drug_candidate_id": candidate_id,
+            "test_type": test_type,
+            "start_time": start_time,
+            "parameters": {"concentration": "10uM", "duration": "48h"},
+            "result": TestResult.IN_PROGRESS
+        }
+        for test_id, candidate_id in zip(test_ids, drug_candidates)
+    ])
+    
+    results = [
+        {
+            "test_id": test["test_id"],
+            "drug_candidate_id": test["drug_candidate_id"],
             "status": "initiated",
             "estimated_completion": "48 hours"
-        })
+        }
+        for test in tests
+    ]
     
     return {
         "message": f"Initiated high-throughput screening for {len(drug_candidates)} candidates",
@@ -140,7 +144,7 @@ async def run_high_throughput_screening(
     }
 
 @router.get("/results/{test_id}")
-async def get_test_results(
+def get_test_results(
     test_id: str,
     storage = Depends(get_storage)
 ):
@@ -148,7 +152,6 @@ async def get_test_results(
     # with tracer.start_as_current_span("automated_testing.get_results") as span:
     #     span.set_attribute("test_id", test_id)
     """Get automated test results and AI analysis"""
-    storage = db()
     test = storage["get_item"]("automated_tests", test_id)
     if not test:
         raise HTTPException(status_code=404, detail="Test not found")
@@ -1,8 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from typing import List, Optional
-from database_stub import get_storage
+from database import get_storage
+from database_stub import StorageException
+from utils.streaming import wants_ndjson, ndjson_response, paginate
 from models import ClinicalTrial, TrialPhase, TrialStatus, PatientData
 from datetime import datetime
+import asyncio
 import logging
 
 from opentelemetry import trace
@@ -10,16 +13,38 @@ from opentelemetry.trace import Status, StatusCode
 from azure.core.tracing.ext.opentelemetry_span import OpenTelemetrySpan
 
 # Import Azure AI Foundry clients from main
-from clients import project_client, chat_client, tracer
+from clients import tracer
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["clinical-trials"])
 
+def _trial_status(trial: dict) -> dict:
+    # Calculate metrics
+    enrollment_rate = trial["participant_count"] / trial["target_participant_count"] if trial["target_participant_count"] > 0 else 0
+
+    # Format trial data
+    return {
+        "trial_id": trial["trial_id"],
+        "phase": trial["phase"],
+        "status": trial["status"],
+        "participant_count": trial["participant_count"],
+        "target_participant_count": trial["target_participant_count"],
+        "real_time_metrics": {
+            "enrollment_rate": enrollment_rate,
+            "retention_rate": 0.92,  # Example fixed value
+            "safety_signals": []
+        }
+    }
+
 @router.get("/monitor")
-async def monitor_trials(
+def monitor_trials(
+    request: Request,
+    response: Response,
     trial_id: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    after: Optional[int] = None,
     storage = Depends(get_storage)
 ):
     """
@@ -45,44 +70,32 @@ async def monitor_trials(
         Analytics-->>Monitor: Performance Data
         Monitor-->>Client: Trial Status Report
     ```
+
+    Pass `limit` to page through all trials; the X-Next-Cursor response header
+    holds the `after` value for the next page. Send `Accept: application/x-ndjson`
+    to stream every trial as newline-delimited JSON instead.
     """
     with tracer.start_as_current_span("monitor_trials") as span:
         try:
             span.set_attribute("trial_id", trial_id if trial_id else "all")
             logger.info(f"Monitoring trial: {trial_id if trial_id else 'all'}")
             
-            storage = db()
-            trials = storage["list_items"]("clinical_trials")
-            
             if trial_id:
                 trial = storage["get_item"]("clinical_trials", trial_id)
                 if not trial:
                     span.set_status(Status(StatusCode.ERROR))
                     raise HTTPException(status_code=404, detail="Trial not found")
-                trials = [trial]
-
-            result = []
-            for trial in trials:
-                # Calculate metrics
-                enrollment_rate = trial.participant_count / trial.target_participant_count if trial.target_participant_count > 0 else 0
-                
-                # Format trial data
-                trial_data = {
-                    "trial_id": trial.trial_id,
-                    "phase": trial.phase,
-                    "status": trial.status,
-                    "participant_count": trial.participant_count,
-                    "target_participant_count": trial.target_participant_count,
-                    "real_time_metrics": {
-                        "enrollment_rate": enrollment_rate,
-                        "retention_rate": 0.92,  # Example fixed value
-                        "safety_signals": []
-                    }
-                }
-                result.append(trial_data)
-            
-            logger.info(f"✅ Successfully monitored {len(trials)} trials")
-            return result if not trial_id else result[0]
+                logger.info(f"✅ Successfully monitored trial {trial_id}")
+                return _trial_status(trial)
+
+            trials = storage["iter_items"]("clinical_trials", after=after)
+            if wants_ndjson(request):
+                logger.info("✅ Streaming trial monitoring")
+                return ndjson_response(_trial_status(trial) for _, trial in trials)
+
+            result = [_trial_status(trial) for trial in paginate(trials, limit, response)]
+            logger.info(f"✅ Successfully monitored {len(result)} trials")
+            return result
             
         except HTTPException as e:
             span.set_status(Status(StatusCode.ERROR))
@@ -96,39 +109,64 @@ async def monitor_trials(
                 status_code=500,
                 detail=f"Error monitoring trials: {str(e)}"
             )
-    
-    # Get all trials if no specific trial_id is provided
-    if trial_id:
-        trials = [db.query(ClinicalTrialTable).filter(ClinicalTrialTable.trial_id == trial_id).first()]
-        if not trials[0]:
-            raise HTTPException(status_code=404, detail="Trial not found")
-    else:
-        trials = db.query(ClinicalTrialTable).all()
-
-    result = []
-    for trial in trials:
-        # Calculate metrics
-        enrollment_rate = trial.participant_count / trial.target_participant_count if trial.target_participant_count > 0 else 0
-        
-        # Format trial data
-        trial_data = {
-            "trial_id": trial.trial_id,
-            "phase": trial.phase,
-            "status": trial.status,
-            "participant_count": trial.participant_count,
-            "target_participant_count": trial.target_participant_count,
-            "real_time_metrics": {
-                "enrollment_rate": enrollment_rate,
-                "retention_rate": 0.92,  # Example fixed value
-                "safety_signals": []
-            }
+
+def _trial_change(change: dict) -> dict:
+    return {
+        "seq": change["seq"],
+        "op": change["op"],
+        "trial_id": change["id"],
+        "trial": _trial_status(change["item"]) if change["item"] else None
+    }
+
+@router.get("/monitor/changes")
+async def monitor_trial_changes(
+    request: Request,
+    since: Optional[int] = None,
+    timeout: float = Query(30.0, ge=0, le=300),
+    storage = Depends(get_storage)
+):
+    """
+    Stream or long-poll changes to clinical trials.
+
+    Returns the trial changes made after sequence number `since`, waiting up to
+    `timeout` seconds for the first one. Pass the returned `sequence` as `since`
+    on the next call. Without `since`, only changes made from now on are
+    returned. Send `Accept: application/x-ndjson` to keep the connection open
+    and receive each change as a line as it happens.
+    """
+    try:
+        if wants_ndjson(request):
+            changes = storage["watch"]("clinical_trials", since)
+            return ndjson_response(_trial_change(change) async for change in changes)
+
+        if since is None:
+            since = await asyncio.to_thread(storage["current_sequence"])
+        changes = await asyncio.to_thread(storage["changes_since"], "clinical_trials", since)
+        if not changes and timeout:
+            watcher = storage["watch"]("clinical_trials", since)
+            try:
+                first = await asyncio.wait_for(watcher.__anext__(), timeout)
+                changes = [first] + await asyncio.to_thread(storage["changes_since"], "clinical_trials", first["seq"])
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                await watcher.aclose()
+
+        return {
+            "sequence": changes[-1]["seq"] if changes else since,
+            "changes": [_trial_change(change) for change in changes]
         }
-        result.append(trial_data)
-    
-    return result if not trial_id else result[0]
+
+    except StorageException as e:
+        # The requested changes were trimmed from the feed; re-read /monitor
+        logger.error(f"❌ Trial change feed error: {str(e)}")
+        raise HTTPException(status_code=410, detail=str(e))
+    except Exception as e:
+        logger.error(f"❌ Error watching trial changes: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error watching trial changes: {str(e)}")
 
 @router.post("/predict-response")
-async def predict_patient_response(
+def predict_patient_response(
     trial_id: str,
     patient_id: str,
     storage = Depends(get_storage)
@@ -163,7 +201,6 @@ async def predict_patient_response(
             span.set_attribute("patient_id", patient_id)
             logger.info(f"🔍 Predicting response for patient {patient_id} in trial {trial_id}")
             
-            storage = db()
             patient = storage["get_item"]("patient_cohorts", patient_id)
             if not patient:
                 span.set_status(Status(StatusCode.ERROR))
@@ -3,7 +3,6 @@ from datetime import datetime
 import logging
 import json
 from clients import tracer
-from main import f1_evaluator
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -1,10 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Security
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Security, Query, Request, Response
 from typing import List, Optional, Dict
-from database_stub import get_storage
+from database import get_storage
+from database_stub import StorageException
 from models import DrugCandidate, MoleculeType, TestResult
 from models import PatientData, AutomatedTest
 from datetime import datetime
 import asyncio
+import math
 import os
 import logging
 from concurrent.futures import ThreadPoolExecutor
@@ -17,9 +19,12 @@ from azure.core.tracing.ext.opentelemetry_span import OpenTelemetrySpan
 logger = logging.getLogger(__name__)
 
 # Import Azure AI Foundry clients
-from clients import project_client, chat_client
+import clients
 from opentelemetry import trace
 tracer = trace.get_tracer(__name__)
+from utils.streaming import wants_ndjson, ndjson_response, paginate
+from utils.rate_limit import RateLimitExceeded, estimate_tokens, get_limiter
+from utils.deployments import deployment_pool, select_deployment
 from utils.molecular_analysis import (
     analyze_genetic_compatibility,
     analyze_biomarker_interaction,
@@ -46,6 +51,17 @@ MOLECULE_SCOPES = {
 
 router = APIRouter(tags=["molecular-design"])
 
+def save_candidate(storage, molecule: dict) -> dict:
+    """Store an analyzed candidate, replacing the earlier analysis when its ID was analyzed before."""
+    try:
+        return storage["add_item"]("drug_candidates", molecule)
+    except StorageException:
+        replaced = storage["replace_item"]("drug_candidates", molecule["id"], molecule)
+        if replaced is None:
+            # Not a duplicate ID, e.g. a field of the wrong type
+            raise
+        return replaced
+
 @router.post("/agents/demo-agent")
 async def demo_agent_interaction(
     molecule_data: DrugCandidate,
@@ -82,38 +98,45 @@ async def demo_agent_interaction(
         try:
             span.set_attribute("molecule_id", molecule_data.id)
             
-            # Create a chat completion request for analysis
-            response = chat_client.get_chat_completion(
-                model=os.getenv('MODEL_DEPLOYMENT_NAME'), 
-                messages=[
-                    {
-                        "role": "system",
-                        "content": """You are a pharmaceutical research assistant specializing in drug candidate analysis.
-                        Analyze the provided molecule data and provide insights on:
-                        - Molecular properties and potential interactions
-                        - Safety considerations
-                        - Development recommendations"""
-                    },
-                    {
-                        "role": "user",
-                        "content": f"""Please analyze this drug candidate:
-                        ID: {molecule_data.id}
-                        Type: {molecule_data.molecule_type}
-                        Therapeutic Area: {molecule_data.therapeutic_area}
-                        Target Proteins: {', '.join(molecule_data.target_proteins)}
-                        Development Stage: {molecule_data.development_stage}
-                        """
-                    }
-                ],
-                temperature=0.7,
-                max_tokens=800
-            )
+            # Create a chat completion request for analysis. The client is set
+            # up at startup, so it is looked up on the module, not imported
+            deployment = select_deployment("agent-demo")
+            messages = [
+                {
+                    "role": "system",
+                    "content": """You are a pharmaceutical research assistant specializing in drug candidate analysis.
+                    Analyze the provided molecule data and provide insights on:
+                    - Molecular properties and potential interactions
+                    - Safety considerations
+                    - Development recommendations"""
+                },
+                {
+                    "role": "user",
+                    "content": f"""Please analyze this drug candidate:
+                    ID: {molecule_data.id}
+                    Type: {molecule_data.molecule_type}
+                    Therapeutic Area: {molecule_data.therapeutic_area}
+                    Target Proteins: {', '.join(molecule_data.target_proteins)}
+                    Development Stage: {molecule_data.development_stage}
+                    """
+                }
+            ]
+            prompt = "".join(message["content"] for message in messages)
+            async with deployment_pool.track(deployment), \
+                    get_limiter(deployment).reserve(estimate_tokens(prompt, response_tokens=800)) as reservation:
+                response = await clients.chat_client.complete(
+                    model=deployment,
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=800
+                )
+                used = getattr(getattr(response, "usage", None), "total_tokens", None)
+                reservation.settle(used if isinstance(used, int) else None)
             
             # Get the analysis response
             analysis_response = response.choices[0].message.content
             
             # Store the analysis in the storage
-            storage = db()
             molecule_dict = {
                 "id": molecule_data.id,
                 "molecule_type": molecule_data.molecule_type,
@@ -127,7 +150,7 @@ async def demo_agent_interaction(
                 "ai_confidence": 0.88,  # Example value
                 "properties": {"ai_analysis": analysis_response}
             }
-            storage["add_item"]("drug_candidates", molecule_dict)
+            await asyncio.to_thread(save_candidate, storage, molecule_dict)
             
             return {
                 "message": "Agent analysis complete",
@@ -140,6 +163,13 @@ async def demo_agent_interaction(
                 ]
             }
             
+        except RateLimitExceeded as e:
+            logger.warning(f"⚠️ {str(e)}")
+            raise HTTPException(
+                status_code=429,
+                detail=str(e),
+                headers={"Retry-After": str(math.ceil(e.retry_after))}
+            )
         except Exception as e:
             span.set_status(Status(StatusCode.ERROR))
             span.record_exception(e)
@@ -150,7 +180,7 @@ async def demo_agent_interaction(
             )
 
 @router.post("/batch-analysis", dependencies=[Security(access_control.get_current_user, scopes=["write:molecules"])])
-async def analyze_molecules_batch(
+def analyze_molecules_batch(
     molecules: List[DrugCandidate],
     background_tasks: BackgroundTasks,
     storage = Depends(get_storage)
@@ -168,7 +198,6 @@ async def analyze_molecules_batch(
     with ThreadPoolExecutor() as executor:
         # Process molecules in parallel
         futures = []
-        storage = db()
         for molecule in molecules:
             future = executor.submit(
                 analyze_single_molecule,
@@ -203,7 +232,7 @@ async def analyze_molecules_batch(
     }
 
 @router.post("/analyze")
-async def analyze_molecule(
+def analyze_molecule(
     molecule_data: DrugCandidate,
     storage = Depends(get_storage)
 ):
@@ -251,7 +280,6 @@ async def analyze_molecule(
         })
         
         # Store the analyzed molecule with encrypted data
-        storage = db()
         molecule_dict = {
             "id": molecule_data.id,
             "molecule_type": molecule_data.molecule_type,
@@ -266,7 +294,7 @@ async def analyze_molecule(
             "ai_confidence": molecule_data.ai_confidence,
             "properties": encrypted_data["properties"]
         }
-        storage["add_item"]("drug_candidates", molecule_dict)
+        save_candidate(storage, molecule_dict)
         
         return {
             "message": "Molecular analysis complete",
@@ -290,7 +318,7 @@ async def analyze_molecule(
         )
 
 @router.post("/regulatory-submission/{molecule_id}", dependencies=[Security(access_control.get_current_user, scopes=["write:regulatory"])])
-async def prepare_regulatory_submission(
+def prepare_regulatory_submission(
     molecule_id: str,
     storage = Depends(get_storage)
 ):
@@ -301,14 +329,12 @@ async def prepare_regulatory_submission(
     - Prepare clinical trial summaries
     - Format for regulatory requirements
     """
-    storage = db()
     molecule = storage["get_item"]("drug_candidates", molecule_id)
     if not molecule:
         raise HTTPException(status_code=404, detail="Molecule not found")
     
-    # Get all test results
-    all_tests = storage["list_items"]("automated_tests")
-    tests = [test for test in all_tests if test["drug_candidate_id"] == molecule_id]
+    # Get this molecule's test results through the drug_candidate_id index
+    tests = storage["list_by"]("automated_tests", "drug_candidate_id", molecule_id)
     
     # Compile submission package
     submission_package = {
@@ -354,7 +380,7 @@ async def prepare_regulatory_submission(
     }
 
 @router.post("/patient-specific-analysis", dependencies=[Security(access_control.get_current_user, scopes=["read:molecules", "read:patients"])])
-async def analyze_patient_specific_response(
+def analyze_patient_specific_response(
     molecule_id: str,
     patient_id: str,
     storage = Depends(get_storage)
@@ -366,7 +392,6 @@ async def analyze_patient_specific_response(
     - Assess potential interactions
     - Predict efficacy
     """
-    storage = db()
     molecule = storage["get_item"]("drug_candidates", molecule_id)
     if not molecule:
         raise HTTPException(status_code=404, detail="Molecule not found")
@@ -431,24 +456,61 @@ async def analyze_patient_specific_response(
     }
 
 @router.get("/candidates", response_model=List[DrugCandidate])  # TODO: Re-enable auth after testing
-async def list_candidates(
+def list_candidates(
+    request: Request,
+    response: Response,
     therapeutic_area: Optional[str] = None,
     min_efficacy: Optional[float] = None,
     development_stage: Optional[str] = None,
     safety_threshold: Optional[float] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    after: Optional[int] = None,
     storage = Depends(get_storage)
 ):
-    """List drug candidates with advanced filtering"""
-    candidates = storage["list_items"]("drug_candidates")
-    
-    # Apply filters
+    """
+    List drug candidates with advanced filtering.
+
+    Pass `limit` to page through results; the X-Next-Cursor response header
+    holds the `after` value for the next page. Send `Accept: application/x-ndjson`
+    to stream every match as newline-delimited JSON instead.
+    """
+    # Filters are answered by the storage layer's secondary indexes
+    equals = {}
+    min_values = {}
     if therapeutic_area:
-        candidates = [c for c in candidates if c["therapeutic_area"] == therapeutic_area]
+        equals["therapeutic_area"] = therapeutic_area
     if min_efficacy:
-        candidates = [c for c in candidates if c["predicted_efficacy"] >= min_efficacy]
+        min_values["predicted_efficacy"] = min_efficacy
     if development_stage:
-        candidates = [c for c in candidates if c["development_stage"] == development_stage]
+        equals["development_stage"] = development_stage
     if safety_threshold:
-        candidates = [c for c in candidates if c["predicted_safety"] >= safety_threshold]
+        min_values["predicted_safety"] = safety_threshold
     
-    return candidates
+    candidates = storage["iter_items"]("drug_candidates", equals=equals, min_values=min_values, after=after)
+    if wants_ndjson(request):
+        return ndjson_response(candidate for _, candidate in candidates)
+    return paginate(candidates, limit, response)
+
+@router.get("/candidates/portfolio-summary")
+def portfolio_summary(
+    top: int = 10,
+    bins: int = 10,
+    storage = Depends(get_storage)
+):
+    """Summarize the candidate portfolio per therapeutic area"""
+    try:
+        # Aggregates run over the storage layer's numeric columns
+        return {
+            "by_therapeutic_area": storage["summarize_items"](
+                "drug_candidates",
+                "therapeutic_area",
+                ["predicted_efficacy", "predicted_safety", "ai_confidence"]
+            ),
+            "top_candidates": storage["rank_items"]("drug_candidates", "predicted_efficacy", limit=top),
+            "efficacy_distribution": storage["column_histogram"](
+                "drug_candidates", "predicted_efficacy", bins=bins, value_range=(0.0, 1.0)
+            )
+        }
+    except Exception as e:
+        logger.error(f"❌ Error summarizing portfolio: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
 from typing import List, Optional
-from database_stub import get_storage
+from database import get_storage
 from models import DrugCandidate, ClinicalTrial
 from datetime import datetime, timedelta
 import logging
@@ -10,7 +10,7 @@ from opentelemetry.trace import Status, StatusCode
 from azure.core.tracing.ext.opentelemetry_span import OpenTelemetrySpan
 
 # Import Azure AI Foundry clients from main
-from clients import project_client, chat_client, tracer
+from clients import tracer
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -18,11 +18,35 @@ logger = logging.getLogger(__name__)
 router = APIRouter(tags=["supply-chain"])
 
 @router.get("/predict-demand")
-async def predict_demand(
+def predict_demand(
     therapeutic_area: Optional[str] = None,
     timeframe_days: int = 90,
     storage = Depends(get_storage)
 ):
+    """
+    ### 📈 Drug Demand Prediction
+    
+    Predict pharmaceutical demand based on:
+    - 🌍 Global health trends
+    - 🦠 Epidemic patterns
+    - 👥 Patient population needs
+    - 📊 Historical usage data
+    
+    ```mermaid
+    sequenceDiagram
+        participant Client
+        participant Predictor
+        participant Trials
+        participant Market
+        
+        Client->>Predictor: Request Forecast
+        Predictor->>Trials: Get Trial Data
+        Predictor->>Market: Get Trends
+        Trials-->>Predictor: Active Trials
+        Market-->>Predictor: Market Data
+        Predictor-->>Client: Demand Forecast
+    ```
+    """
     with tracer.start_as_current_span("supply_chain.predict_demand") as span:
         try:
             span.set_attribute("therapeutic_area", therapeutic_area or "all")
@@ -30,17 +54,21 @@ async def predict_demand(
             logger.info(f"📊 Predicting demand for {therapeutic_area or 'all'} over {timeframe_days} days")
             
             # Get active trials and their participant counts
-            storage = db()
-            all_trials = storage["list_items"]("clinical_trials")
-            active_trials = [
-                trial for trial in all_trials 
-                if trial["status"] == "active" and
-                (not therapeutic_area or 
-                 storage["get_item"]("drug_candidates", trial["drug_candidate_id"])["therapeutic_area"] == therapeutic_area)
-            ]
+            active_trials = storage["list_by"]("clinical_trials", "status", "active")
+            if therapeutic_area:
+                # Fetch all referenced candidates in one batch instead of one lookup per trial
+                candidates = storage["get_many"](
+                    "drug_candidates",
+                    {trial["drug_candidate_id"] for trial in active_trials}
+                )
+                active_trials = [
+                    trial for trial in active_trials
+                    if trial["drug_candidate_id"] in candidates and
+                    candidates[trial["drug_candidate_id"]]["therapeutic_area"] == therapeutic_area
+                ]
             
             # Calculate demand metrics
-            total_participants = sum(trial.participant_count for trial in active_trials)
+            total_participants = sum(trial["participant_count"] for trial in active_trials)
             growth_rate = 0.15  # Example growth rate
             
             future_date = datetime.now() + timedelta(days=timeframe_days)
@@ -71,66 +99,9 @@ async def predict_demand(
                 status_code=500,
                 detail=f"Error predicting demand: {str(e)}"
             )
-    """
-    ### 📈 Drug Demand Prediction
-    
-    Predict pharmaceutical demand based on:
-    - 🌍 Global health trends
-    - 🦠 Epidemic patterns
-    - 👥 Patient population needs
-    - 📊 Historical usage data
-    
-    ```mermaid
-    sequenceDiagram
-        participant Client
-        participant Predictor
-        participant Trials
-        participant Market
-        
-        Client->>Predictor: Request Forecast
-        Predictor->>Trials: Get Trial Data
-        Predictor->>Market: Get Trends
-        Trials-->>Predictor: Active Trials
-        Market-->>Predictor: Market Data
-        Predictor-->>Client: Demand Forecast
-    ```
-    """
-    # Get active trials and their participant counts
-    query = db.query(ClinicalTrialTable).filter(
-        ClinicalTrialTable.status == "active"
-    )
-    if therapeutic_area:
-        query = query.join(DrugCandidateTable).filter(
-            DrugCandidateTable.therapeutic_area == therapeutic_area
-        )
-    
-    active_trials = query.all()
-    
-    # Calculate demand metrics
-    total_participants = sum(trial.participant_count for trial in active_trials)
-    growth_rate = 0.15  # Example growth rate
-    
-    future_date = datetime.now() + timedelta(days=timeframe_days)
-    predicted_demand = total_participants * (1 + growth_rate)
-    
-    return {
-        "current_demand": total_participants,
-        "predicted_demand": predicted_demand,
-        "prediction_date": future_date.isoformat(),
-        "confidence_score": 0.85,
-        "factors": {
-            "active_trials": len(active_trials),
-            "growth_rate": growth_rate,
-            "market_trends": [
-                "Increasing demand in oncology",
-                "Stable demand in cardiovascular",
-                "Growing need in rare diseases"
-            ]
-        }
-    }
 
 @router.get("/inventory-optimization")
-async def optimize_inventory(
+def optimize_inventory(
     storage = Depends(get_storage)
 ):
     """
@@ -38,11 +38,21 @@ class MockMessage:
         self.content = content
         self.message = self
 
+class MockStreamUpdate:
+    def __init__(self, content):
+        self.delta = MagicMock(content=content, tool_calls=None)
+        self.usage = None
+
+async def mock_stream(text, chunk_size=8):
+    """Yield a response as streamed text deltas."""
+    for i in range(0, len(text), chunk_size):
+        yield MockStreamUpdate(text[i:i + chunk_size])
+
 class MockConversation:
     def __init__(self, agent_id):
         self.agent_id = agent_id
     
-    async def send_message(self, content):
+    async def send_message(self, content, stream=False):
         # Return different responses based on the content
         if "drug repurpose" in content.lower():
             response = {
@@ -77,6 +87,8 @@ class MockConversation:
                 "average_survival_gain": "6 months",
                 "agent_id": self.agent_id
             }
+        if stream:
+            return mock_stream(json.dumps(response))
         return MockMessage(json.dumps(response))
 
 class MockToolSet:
@@ -103,12 +115,19 @@ class MockAgentsOperations:
             toolset=toolset
         )
 
+    async def upload_file_and_poll(self, file_path=None, purpose=None):
+        """Mock file upload returning an object with an id."""
+        return MagicMock(id=f"file-{uuid.uuid4().hex[:8]}")
+
+    async def delete_file(self, file_id):
+        return None
+
 class MockProjectClient:
     def __init__(self):
         self.agents = MockAgentsOperations()
 
 class MockChatClient:
-    async def create_conversation(self, agent_id):
+    async def create_conversation(self, agent_id, tool_resources=None):
         return MockConversation(agent_id)
 
     async def get_conversation(self, conversation_id):
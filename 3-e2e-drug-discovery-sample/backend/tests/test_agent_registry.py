@@ -0,0 +1,197 @@
+import asyncio
+import threading
+import pytest
+from utils.agent_registry import AgentKey, AgentRegistry, fingerprint
+
+class Agent:
+    def __init__(self, agent_id):
+        self.id = agent_id
+
+def counting_create(delay=0.01, error=None):
+    calls = []
+
+    async def create():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        return Agent(f"agent-{len(calls)}")
+    return create, calls
+
+KEY = AgentKey("literature-search", "gpt-4o", fingerprint("instructions", []))
+
+async def test_concurrent_requests_create_one_agent():
+    """Test that a cold burst shares a single creation."""
+    registry = AgentRegistry()
+    create, calls = counting_create()
+    agents = await asyncio.gather(*(registry.get_or_create(KEY, create) for _ in range(10)))
+    assert len(calls) == 1
+    assert {agent.id for agent in agents} == {"agent-1"}
+    assert (await registry.get_or_create(KEY, create)).id == "agent-1"
+    assert len(calls) == 1
+
+async def test_failed_creation_is_retried_by_next_caller():
+    """Test that waiters share a failure and a later call creates the agent."""
+    registry = AgentRegistry()
+    create, calls = counting_create(error=RuntimeError("boom"))
+    results = await asyncio.gather(*(registry.get_or_create(KEY, create) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(calls) == 1
+    create, calls = counting_create()
+    assert (await registry.get_or_create(KEY, create)).id == "agent-1"
+
+async def test_cancelled_caller_does_not_cancel_creation():
+    """Test that one caller timing out leaves the shared creation running."""
+    registry = AgentRegistry()
+    create, calls = counting_create(delay=0.05)
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(registry.get_or_create(KEY, create), 0.01)
+    assert (await registry.get_or_create(KEY, create)).id == "agent-1"
+    assert len(calls) == 1
+
+def test_keys_include_model_and_definition():
+    """Test that the model, instructions and tools all distinguish agents."""
+    tools = [{"type": "bing_search"}]
+    base = AgentKey("literature-search", "gpt-4o", fingerprint("find papers", tools))
+    assert base == AgentKey("literature-search", "gpt-4o", fingerprint("find papers", [{"type": "bing_search"}]))
+    assert base != AgentKey("literature-search", "gpt-4o-mini", fingerprint("find papers", tools))
+    assert base != AgentKey("literature-search", "gpt-4o", fingerprint("find trials", tools))
+    assert base != AgentKey("literature-search", "gpt-4o", fingerprint("find papers", tools + [{"type": "function"}]))
+
+class NotFound(Exception):
+    status_code = 404
+
+class Project:
+    """Agents operations stub holding the agents that exist remotely."""
+    def __init__(self, agent_ids):
+        self.existing = set(agent_ids)
+        self.deleted = []
+
+    async def get_agent(self, agent_id):
+        if agent_id not in self.existing:
+            raise NotFound(agent_id)
+        return Agent(agent_id)
+
+    async def delete_agent(self, agent_id):
+        self.existing.discard(agent_id)
+        self.deleted.append(agent_id)
+
+async def test_saved_agents_are_reused_after_restart(tmp_path):
+    """Test that a new registry on the same file reuses agents that still exist."""
+    path = str(tmp_path / "agents.json")
+    create, calls = counting_create()
+    await AgentRegistry(path).get_or_create(KEY, create)
+
+    restarted = AgentRegistry(path)
+    assert await restarted.restore(Project(["agent-1"]).get_agent) == 1
+    assert (await restarted.get_or_create(KEY, create)).id == "agent-1"
+    assert len(calls) == 1
+
+async def test_restore_drops_missing_and_deletes_idle_agents(tmp_path):
+    """Test that missing agents are forgotten and idle ones are deleted remotely."""
+    path = str(tmp_path / "agents.json")
+    registry = AgentRegistry(path)
+    other = AgentKey("precision-med", "gpt-4o", fingerprint("other", []))
+
+    async def create_other():
+        return Agent("agent-other")
+
+    await registry.get_or_create(KEY, counting_create()[0])
+    await registry.get_or_create(other, create_other)
+
+    project = Project(["agent-1"])
+    assert await AgentRegistry(path).restore(project.get_agent, project.delete_agent) == 1
+    assert list(AgentRegistry(path).records) == [f"literature-search/gpt-4o/{KEY.fingerprint}"]
+
+    # Everything saved before now counts as idle
+    assert await AgentRegistry(path).restore(project.get_agent, project.delete_agent, max_idle_days=-1) == 0
+    assert project.deleted == ["agent-1"]
+    assert AgentRegistry(path).records == {}
+
+async def test_invalidate_recreates_only_the_dead_agent(tmp_path):
+    """Test that invalidating a deleted agent recreates it, and a late invalidation keeps the replacement."""
+    path = str(tmp_path / "agents.json")
+    registry = AgentRegistry(path)
+    create, calls = counting_create()
+    dead = await registry.get_or_create(KEY, create)
+    assert registry.key_of(dead.id) == KEY
+
+    await registry.invalidate(KEY, agent_id=dead.id)
+    assert AgentRegistry(path).records == {}
+    replacement = await registry.get_or_create(KEY, create)
+    assert replacement.id == "agent-2"
+
+    await registry.invalidate(KEY, agent_id=dead.id)
+    assert (await registry.get_or_create(KEY, create)).id == "agent-2"
+    assert [record["agent_id"] for record in AgentRegistry(path).records.values()] == ["agent-2"]
+    assert len(calls) == 2
+
+def test_concurrent_writers_keep_each_others_records(tmp_path):
+    """Test that workers saving to the same file at once do not overwrite each other's records."""
+    path = str(tmp_path / "agents.json")
+
+    def save(worker):
+        registry = AgentRegistry(path)
+        for i in range(20):
+            registry._update(lambda records: records.update({f"worker-{worker}/{i}": {"agent_id": f"agent-{worker}-{i}"}}))
+
+    threads = [threading.Thread(target=save, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(AgentRegistry(path).records) == 80
+
+async def test_agents_in_use_are_refreshed_and_never_collected(tmp_path, monkeypatch):
+    """Test that use refreshes last_used at most once per interval and a heartbeat keeps held agents."""
+    path = str(tmp_path / "agents.json")
+    registry = AgentRegistry(path)
+    create, _ = counting_create()
+    await registry.get_or_create(KEY, create)
+    record_id = f"literature-search/gpt-4o/{KEY.fingerprint}"
+
+    def age_record():
+        registry._update(lambda records: records[record_id].update(last_used="2000-01-01T00:00:00"))
+
+    # Within the interval, further use does not rewrite the file
+    age_record()
+    await registry.get_or_create(KEY, create)
+    assert AgentRegistry(path).records[record_id]["last_used"] == "2000-01-01T00:00:00"
+
+    monkeypatch.setattr("utils.agent_registry.AGENT_REGISTRY_TOUCH_SECONDS", 0)
+    await registry.get_or_create(KEY, create)
+    assert AgentRegistry(path).records[record_id]["last_used"] > "2000-01-01T00:00:00"
+
+    # A worker that holds the agent but has not used it lately keeps it alive through its heartbeat
+    age_record()
+    await registry.heartbeat()
+    project = Project(["agent-1"])
+    assert await AgentRegistry(path).restore(project.get_agent, project.delete_agent) == 1
+    assert project.deleted == []
+
+async def test_workers_racing_to_create_keep_one_recorded_agent(tmp_path):
+    """Test that a worker losing the creation race deletes its agent and uses the saved one."""
+    path = str(tmp_path / "agents.json")
+    project = Project([])
+    first, second = AgentRegistry(path), AgentRegistry(path)
+
+    def creating(agent_id, before_return=None):
+        async def create():
+            if before_return is not None:
+                await before_return()
+            project.existing.add(agent_id)
+            return Agent(agent_id)
+        return create
+
+    async def other_worker_wins():
+        await second.get_or_create(KEY, creating("agent-b"), project.get_agent, project.delete_agent)
+
+    agent = await first.get_or_create(KEY, creating("agent-a", other_worker_wins), project.get_agent, project.delete_agent)
+    assert agent.id == "agent-b"
+    assert project.deleted == ["agent-a"]
+    assert [record["agent_id"] for record in AgentRegistry(path).records.values()] == ["agent-b"]
+
+    # A later cold start reuses the saved agent without creating one
+    third = AgentRegistry(path)
+    assert (await third.get_or_create(KEY, creating("agent-c"), project.get_agent, project.delete_agent)).id == "agent-b"
+    assert project.existing == {"agent-b"}
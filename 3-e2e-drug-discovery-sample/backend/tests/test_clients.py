@@ -0,0 +1,54 @@
+import pytest
+import clients
+
+class CountingAgents:
+    """Agents operations stub that counts readiness probes."""
+    def __init__(self, error=None):
+        self.calls = 0
+        self.error = error
+
+    async def list_agents(self, limit=None):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return []
+
+class ProjectClient:
+    def __init__(self, agents):
+        self.agents = agents
+
+@pytest.fixture(autouse=True)
+def fresh_readiness(monkeypatch):
+    """Start every test without a cached probe result."""
+    monkeypatch.setattr(clients, "_readiness", {"ready": None, "error": None, "checked_at": None})
+
+async def test_readiness_probe_is_cached(monkeypatch):
+    """Test that the probe runs once and its result is reused."""
+    agents = CountingAgents()
+    monkeypatch.setattr(clients, "project_client", ProjectClient(agents))
+    assert (await clients.check_readiness())["ready"] is True
+    assert (await clients.check_readiness())["ready"] is True
+    assert agents.calls == 1
+    await clients.check_readiness(force=True)
+    assert agents.calls == 2
+
+async def test_readiness_probe_reports_errors(monkeypatch):
+    """Test that a failing probe is reported instead of raised."""
+    monkeypatch.setattr(clients, "project_client", ProjectClient(CountingAgents(RuntimeError("unreachable"))))
+    readiness = await clients.check_readiness()
+    assert readiness["ready"] is False
+    assert readiness["error"] == "unreachable"
+
+async def test_run_blocking_uses_bounded_executor():
+    """Test that blocking calls run on the SDK executor threads."""
+    import threading
+    name = await clients.run_blocking(lambda: threading.current_thread().name)
+    assert name.startswith("azure-sdk")
+
+async def test_transports_share_one_session():
+    """Test that every client transport wraps the same pooled session."""
+    first, second = clients.get_transport(), clients.get_transport()
+    assert first.session is second.session
+    assert first.session.connector.limit == clients.HTTP_POOL_SIZE
+    await clients.close_clients()
+    assert clients._http_session is None
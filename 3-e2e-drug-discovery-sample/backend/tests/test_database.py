@@ -0,0 +1,140 @@
+import os
+import pytest
+import database
+import database_stub
+from database import SQLiteStorage
+from database_stub import StorageException
+
+@pytest.fixture
+def engine(tmp_path):
+    """Create a SQLite engine backed by a temporary file."""
+    engine = SQLiteStorage(str(tmp_path / "test.db"), pool_size=2)
+    yield engine
+    engine.close()
+
+def test_add_get_update_delete(engine):
+    """Test the basic item lifecycle."""
+    engine.add_item("drug_candidates", {"id": "D1", "therapeutic_area": "oncology"})
+    assert engine.get_item("drug_candidates", "D1")["therapeutic_area"] == "oncology"
+    updated = engine.update_item("drug_candidates", "D1", {"therapeutic_area": "cardiology"})
+    assert updated["therapeutic_area"] == "cardiology"
+    assert engine.list_by("drug_candidates", "therapeutic_area", "cardiology")[0]["id"] == "D1"
+    assert engine.delete_item("drug_candidates", "D1") is True
+    assert engine.get_item("drug_candidates", "D1") is None
+    assert engine.update_item("drug_candidates", "D1", {"therapeutic_area": "oncology"}) is None
+
+def test_bulk_insert_and_query(engine):
+    """Test that bulk inserts are queryable through the indexed columns."""
+    engine.add_items("drug_candidates", [
+        {"id": "D1", "therapeutic_area": "oncology", "predicted_efficacy": 0.9, "predicted_safety": 0.8},
+        {"id": "D2", "therapeutic_area": "oncology", "predicted_efficacy": 0.6, "predicted_safety": 0.95},
+        {"id": "D3", "therapeutic_area": "cardiology", "predicted_efficacy": 0.85, "predicted_safety": 0.7}
+    ])
+    results = engine.query_items(
+        "drug_candidates",
+        equals={"therapeutic_area": "oncology"},
+        min_values={"predicted_efficacy": 0.75}
+    )
+    assert [c["id"] for c in results] == ["D1"]
+    assert sorted(engine.get_many("drug_candidates", ["D1", "D3", "D9"])) == ["D1", "D3"]
+    assert [c["id"] for c in engine.list_items("drug_candidates")] == ["D1", "D2", "D3"]
+
+def test_duplicate_and_unindexed(engine):
+    """Test that duplicate IDs and unindexed filters raise a StorageException."""
+    engine.add_item("clinical_trials", {"id": "T1", "status": "active"})
+    with pytest.raises(StorageException):
+        engine.add_item("clinical_trials", {"id": "T1", "status": "active"})
+    with pytest.raises(StorageException):
+        engine.query_items("clinical_trials", equals={"phase": "1"})
+
+def test_state_is_shared_between_engines(tmp_path):
+    """Test that two engines on the same file, as in two workers, see each other's writes."""
+    first = SQLiteStorage(str(tmp_path / "shared.db"), pool_size=1)
+    second = SQLiteStorage(str(tmp_path / "shared.db"), pool_size=1)
+    first.add_item("patient_cohorts", {"id": "P1"})
+    assert second.get_item("patient_cohorts", "P1")["id"] == "P1"
+    first.close()
+    second.close()
+
+def test_replace_item_drops_old_fields(engine):
+    """Test that a replaced item loses fields the new version lacks."""
+    engine.add_item("drug_candidates", {"id": "D1", "therapeutic_area": "oncology", "side_effects": ["nausea"]})
+    replaced = engine.replace_item("drug_candidates", "D1", {"therapeutic_area": "cardiology"})
+    assert engine.get_item("drug_candidates", "D1") == replaced
+    assert "side_effects" not in replaced
+    assert engine.list_by("drug_candidates", "therapeutic_area", "oncology") == []
+    assert engine.replace_item("drug_candidates", "D9", {}) is None
+
+def test_update_items_bulk(engine):
+    """Test that bulk updates are applied in one call and skip unknown IDs."""
+    engine.add_items("automated_tests", [{"id": f"T{i}", "drug_candidate_id": "D1"} for i in range(5)])
+    updated = engine.update_items("automated_tests", {
+        "T1": {"drug_candidate_id": "D2"},
+        "T3": {"drug_candidate_id": "D2"},
+        "T9": {"drug_candidate_id": "D2"}
+    })
+    assert sorted(updated) == ["T1", "T3"]
+    assert [t["id"] for t in engine.list_by("automated_tests", "drug_candidate_id", "D2")] == ["T1", "T3"]
+
+def test_rank_and_summarize(engine):
+    """Test rankings and aggregates computed by SQLite."""
+    engine.add_items("drug_candidates", [
+        {"id": "D1", "therapeutic_area": "oncology", "predicted_efficacy": 0.9},
+        {"id": "D2", "therapeutic_area": "oncology", "predicted_efficacy": 0.5},
+        {"id": "D3", "therapeutic_area": "cardiology", "predicted_efficacy": 0.7}
+    ])
+    assert [c["id"] for c in engine.rank_items("drug_candidates", "predicted_efficacy", limit=2)] == ["D1", "D3"]
+    assert engine.column_histogram("drug_candidates", "predicted_efficacy", bins=2, value_range=(0, 1))["counts"] == [0, 3]
+    summary = engine.summarize_items("drug_candidates", "therapeutic_area", ["predicted_efficacy"])
+    assert summary["oncology"]["count"] == 2
+    assert summary["oncology"]["mean_predicted_efficacy"] == pytest.approx(0.7)
+
+def test_iter_items_pages_by_cursor(engine, monkeypatch):
+    """Test that iteration walks keyset pages and resumes after a cursor."""
+    monkeypatch.setattr(database, "ITER_PAGE_SIZE", 3)
+    engine.add_items("automated_tests", [
+        {"id": f"T{i}", "drug_candidate_id": "D1" if i % 2 else "D2"} for i in range(10)
+    ])
+    pairs = list(engine.iter_items("automated_tests", equals={"drug_candidate_id": "D1"}))
+    assert [t["id"] for _, t in pairs] == ["T1", "T3", "T5", "T7", "T9"]
+    rest = engine.iter_items("automated_tests", after=pairs[2][0])
+    assert [t["id"] for _, t in rest] == ["T6", "T7", "T8", "T9"]
+
+async def test_change_feed(engine):
+    """Test that writes are recorded in the change feed and can be watched."""
+    start = engine.current_sequence()
+    engine.add_items("clinical_trials", [{"id": "T1"}, {"id": "T2"}])
+    engine.update_item("clinical_trials", "T1", {"status": "active"})
+    engine.delete_item("clinical_trials", "T2")
+    changes = engine.changes_since("clinical_trials", start)
+    assert [(c["op"], c["id"]) for c in changes] == [("add", "T1"), ("add", "T2"), ("update", "T1"), ("delete", "T2")]
+    assert changes[2]["item"]["status"] == "active"
+
+    watcher = engine.watch("clinical_trials", since=changes[1]["seq"])
+    assert (await watcher.__anext__())["op"] == "update"
+    await watcher.aclose()
+
+def test_processes_claim_distinct_worker_ids(tmp_path, monkeypatch):
+    """Test that processes sharing a file get their own worker numbers, reused once a process exits."""
+    path = str(tmp_path / "shared.db")
+    alive = {os.getpid()}
+    monkeypatch.setattr(database, "_pid_alive", lambda pid: pid in alive)
+    first = SQLiteStorage(path, pool_size=1)
+    assert SQLiteStorage(path, pool_size=1).worker_id == first.worker_id
+
+    # A second worker process
+    monkeypatch.setattr(database.os, "getpid", lambda: 4242)
+    alive.add(4242)
+    second = SQLiteStorage(path, pool_size=1)
+    assert second.worker_id != first.worker_id
+
+    # Requesting a number another live process holds fails
+    monkeypatch.setattr(database.os, "getpid", lambda: 4343)
+    monkeypatch.setattr(database_stub, "WORKER_ID", first.worker_id)
+    with pytest.raises(StorageException):
+        SQLiteStorage(path, pool_size=1)
+
+    # Once the second worker exits, its number is free again
+    monkeypatch.setattr(database_stub, "WORKER_ID", None)
+    alive.discard(4242)
+    assert SQLiteStorage(path, pool_size=1).worker_id == second.worker_id
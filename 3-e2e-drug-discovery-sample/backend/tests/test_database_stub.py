@@ -0,0 +1,471 @@
+import itertools
+import pytest
+import database_stub
+from database_stub import StorageException
+
+@pytest.fixture(autouse=True)
+def clean_storage():
+    """Start every test with empty collections."""
+    database_stub.reset_storage()
+    yield
+    database_stub.disable_persistence()
+
+def test_add_and_get_item():
+    """Test that added items can be looked up by ID."""
+    item = database_stub.add_item("drug_candidates", {"id": "DRUG-001", "therapeutic_area": "oncology"})
+    assert "created_at" in item
+    assert database_stub.get_item("drug_candidates", "DRUG-001") is item
+    assert database_stub.get_item("drug_candidates", "DRUG-404") is None
+
+def test_duplicate_id_rejected():
+    """Test that a second item with the same ID is rejected."""
+    database_stub.add_item("drug_candidates", {"id": "DRUG-001"})
+    with pytest.raises(StorageException):
+        database_stub.add_item("drug_candidates", {"id": "DRUG-001"})
+
+def test_update_item_keeps_index_in_sync():
+    """Test that updates are visible through lookups and cannot change the ID."""
+    database_stub.add_item("automated_tests", {"id": "T1", "result": "in_progress"})
+    updated = database_stub.update_item("automated_tests", "T1", {"result": "passed", "id": "T2"})
+    assert updated["result"] == "passed"
+    assert database_stub.get_item("automated_tests", "T1")["id"] == "T1"
+    assert database_stub.get_item("automated_tests", "T2") is None
+    assert database_stub.update_item("automated_tests", "missing", {"result": "failed"}) is None
+
+def test_replace_item_drops_old_fields(tmp_path):
+    """Test that a replaced item loses fields the new version lacks, in indexes and after a restart."""
+    database_stub.enable_persistence(str(tmp_path))
+    first = database_stub.add_item("drug_candidates", {"id": "D1", "therapeutic_area": "oncology", "side_effects": ["nausea"]})
+    replaced = database_stub.replace_item("drug_candidates", "D1", {"therapeutic_area": "cardiology"})
+    assert "side_effects" not in replaced
+    assert replaced["created_at"] == first["created_at"]
+    assert database_stub.list_by("drug_candidates", "therapeutic_area", "oncology") == []
+    assert database_stub.replace_item("drug_candidates", "D9", {}) is None
+
+    database_stub._log.close()
+    database_stub._log = None
+    database_stub.enable_persistence(str(tmp_path))
+    assert "side_effects" not in database_stub.get_item("drug_candidates", "D1")
+    assert database_stub.list_by("drug_candidates", "therapeutic_area", "cardiology")[0]["id"] == "D1"
+
+def test_delete_item():
+    """Test that deleted items disappear from lookups and listings."""
+    for item_id in ("A", "B", "C"):
+        database_stub.add_item("clinical_trials", {"id": item_id})
+    assert database_stub.delete_item("clinical_trials", "B") is True
+    assert database_stub.delete_item("clinical_trials", "B") is False
+    assert database_stub.get_item("clinical_trials", "B") is None
+    assert [t["id"] for t in database_stub.list_items("clinical_trials")] == ["A", "C"]
+
+def test_unknown_collection():
+    """Test that unknown collections raise a StorageException."""
+    with pytest.raises(StorageException):
+        database_stub.get_item("unknown", "1")
+
+def _add_candidates():
+    candidates = [
+        ("D1", "oncology", "preclinical", 0.9, 0.8),
+        ("D2", "oncology", "phase_1", 0.6, 0.95),
+        ("D3", "cardiology", "preclinical", 0.85, 0.7),
+        ("D4", "oncology", "preclinical", 0.75, 0.9),
+    ]
+    for item_id, area, stage, efficacy, safety in candidates:
+        database_stub.add_item("drug_candidates", {
+            "id": item_id,
+            "therapeutic_area": area,
+            "development_stage": stage,
+            "predicted_efficacy": efficacy,
+            "predicted_safety": safety
+        })
+
+def test_query_items_uses_secondary_indexes():
+    """Test that hash and range filters are intersected in insertion order."""
+    _add_candidates()
+    results = database_stub.query_items(
+        "drug_candidates",
+        equals={"therapeutic_area": "oncology", "development_stage": "preclinical"},
+        min_values={"predicted_efficacy": 0.75}
+    )
+    assert [c["id"] for c in results] == ["D1", "D4"]
+    results = database_stub.query_items("drug_candidates", min_values={"predicted_safety": 0.9})
+    assert [c["id"] for c in results] == ["D2", "D4"]
+    assert len(database_stub.query_items("drug_candidates")) == 4
+
+def test_query_items_follows_updates_and_deletes():
+    """Test that secondary indexes stay in sync with writes."""
+    _add_candidates()
+    database_stub.update_item("drug_candidates", "D3", {"therapeutic_area": "oncology"})
+    database_stub.delete_item("drug_candidates", "D1")
+    results = database_stub.query_items("drug_candidates", equals={"therapeutic_area": "oncology"})
+    assert [c["id"] for c in results] == ["D2", "D3", "D4"]
+    assert database_stub.query_items("drug_candidates", equals={"therapeutic_area": "cardiology"}) == []
+
+def test_query_items_requires_index():
+    """Test that filtering on an unindexed field raises a StorageException."""
+    with pytest.raises(StorageException):
+        database_stub.query_items("drug_candidates", equals={"molecule_type": "antibody"})
+
+def test_list_by_foreign_key():
+    """Test that test records can be listed per drug candidate."""
+    database_stub.add_item("automated_tests", {"id": "T1", "drug_candidate_id": "D1"})
+    database_stub.add_item("automated_tests", {"id": "T2", "drug_candidate_id": "D2"})
+    database_stub.add_item("automated_tests", {"id": "T3", "drug_candidate_id": "D1"})
+    assert [t["id"] for t in database_stub.list_by("automated_tests", "drug_candidate_id", "D1")] == ["T1", "T3"]
+    database_stub.delete_item("automated_tests", "T1")
+    assert [t["id"] for t in database_stub.list_by("automated_tests", "drug_candidate_id", "D1")] == ["T3"]
+    assert database_stub.list_by("automated_tests", "drug_candidate_id", "D9") == []
+
+def test_get_many():
+    """Test that several items can be fetched in one call."""
+    _add_candidates()
+    found = database_stub.get_many("drug_candidates", ["D1", "D3", "D9"])
+    assert sorted(found) == ["D1", "D3"]
+    assert found["D3"]["therapeutic_area"] == "cardiology"
+
+def test_persistence_replays_log(tmp_path):
+    """Test that writes survive a restart through the storage log."""
+    database_stub.enable_persistence(str(tmp_path))
+    database_stub.add_item("drug_candidates", {"id": "D1", "therapeutic_area": "oncology"})
+    database_stub.add_item("drug_candidates", {"id": "D2", "therapeutic_area": "oncology"})
+    database_stub.update_item("drug_candidates", "D1", {"therapeutic_area": "cardiology"})
+    database_stub.delete_item("drug_candidates", "D2")
+
+    # Simulate a crash: no final snapshot is written
+    database_stub._log.close()
+    database_stub._log = None
+    database_stub.enable_persistence(str(tmp_path))
+
+    assert [c["id"] for c in database_stub.list_items("drug_candidates")] == ["D1"]
+    assert database_stub.list_by("drug_candidates", "therapeutic_area", "cardiology")[0]["id"] == "D1"
+
+def test_persistence_compacts_into_snapshot(tmp_path):
+    """Test that the log is compacted into a snapshot and both are replayed."""
+    database_stub.enable_persistence(str(tmp_path), snapshot_every=2)
+    for item_id in ("T1", "T2", "T3"):
+        database_stub.add_item("automated_tests", {"id": item_id, "drug_candidate_id": "D1"})
+    # Snapshots are pickled in the background
+    database_stub._wait_for_snapshot()
+    assert (tmp_path / database_stub.SNAPSHOT_FILE).exists()
+    assert not (tmp_path / database_stub.SEGMENT_FILE).exists()
+    assert len((tmp_path / database_stub.LOG_FILE).read_text().splitlines()) == 1
+
+    database_stub.disable_persistence()
+    database_stub.reset_storage()
+    database_stub.enable_persistence(str(tmp_path))
+    tests = database_stub.list_by("automated_tests", "drug_candidate_id", "D1")
+    assert [t["id"] for t in tests] == ["T1", "T2", "T3"]
+
+def test_persistence_replays_unfinished_compaction(tmp_path):
+    """Test that writes in a log segment whose snapshot was never written survive a restart."""
+    database_stub.enable_persistence(str(tmp_path))
+    database_stub.add_item("automated_tests", {"id": "T1"})
+    # Simulate a crash after the log was moved aside but before the snapshot was pickled
+    with database_stub._all_locks():
+        database_stub._begin_snapshot()
+    database_stub.add_item("automated_tests", {"id": "T2"})
+    database_stub._log.close()
+    database_stub._log = None
+
+    database_stub.enable_persistence(str(tmp_path))
+    assert [t["id"] for t in database_stub.list_items("automated_tests")] == ["T1", "T2"]
+    assert not (tmp_path / database_stub.SEGMENT_FILE).exists()
+
+def test_generated_ids_are_unique_after_deletes():
+    """Test that generated IDs never repeat, even after deletes."""
+    first = database_stub.add_item("automated_tests", {"test_type": "binding"})
+    second = database_stub.add_item("automated_tests", {"test_type": "binding"})
+    database_stub.delete_item("automated_tests", first["id"])
+    third = database_stub.add_item("automated_tests", {"test_type": "binding"})
+    assert len({first["id"], second["id"], third["id"]}) == 3
+    assert int(first["id"]) < int(second["id"]) < int(third["id"])
+
+def test_allocate_id_block_across_threads():
+    """Test that concurrent block allocations never overlap."""
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        blocks = list(executor.map(
+            lambda _: database_stub.allocate_ids("automated_tests", 5000), range(8)
+        ))
+    all_ids = [item_id for block in blocks for item_id in block]
+    assert len(set(all_ids)) == 8 * 5000
+    for block in blocks:
+        assert [int(i) for i in block] == sorted(int(i) for i in block)
+
+def test_add_items_bulk():
+    """Test that a bulk insert shares one timestamp and is fully indexed."""
+    plate = [
+        {"drug_candidate_id": f"D{i % 10}", "predicted_efficacy": i / 1000}
+        for i in range(1000)
+    ]
+    tests = database_stub.add_items("automated_tests", plate)
+    assert len({t["id"] for t in tests}) == 1000
+    assert len({t["created_at"] for t in tests}) == 1
+    assert len(database_stub.list_by("automated_tests", "drug_candidate_id", "D3")) == 100
+
+    candidates = database_stub.add_items("drug_candidates", [
+        {"id": f"C{i}", "therapeutic_area": "oncology", "predicted_efficacy": i / 100}
+        for i in range(100)
+    ])
+    assert len(candidates) == 100
+    results = database_stub.query_items("drug_candidates", min_values={"predicted_efficacy": 0.9})
+    assert [c["id"] for c in results] == [f"C{i}" for i in range(90, 100)]
+
+def test_add_items_is_all_or_nothing():
+    """Test that a batch with a duplicate ID writes nothing."""
+    database_stub.add_item("drug_candidates", {"id": "D1"})
+    with pytest.raises(StorageException):
+        database_stub.add_items("drug_candidates", [{"id": "D2"}, {"id": "D1"}])
+    assert database_stub.get_item("drug_candidates", "D2") is None
+
+def test_add_items_rejects_mixed_types_before_writing():
+    """Test that a batch with a value an index cannot hold leaves storage, indexes and the feed untouched."""
+    sequence = database_stub.current_sequence()
+    with pytest.raises(StorageException):
+        database_stub.add_items("drug_candidates", [
+            {"id": "D1", "predicted_efficacy": 0.9, "molecular_weight": 320.5},
+            {"id": "D2", "predicted_efficacy": 0.8, "molecular_weight": "heavy"}
+        ])
+    assert database_stub.list_items("drug_candidates") == []
+    assert database_stub.query_items("drug_candidates", min_values={"predicted_efficacy": 0.0}) == []
+    assert database_stub.rank_items("drug_candidates", "predicted_efficacy") == []
+    assert database_stub.current_sequence() == sequence
+
+    database_stub.add_item("drug_candidates", {"id": "D1", "predicted_efficacy": 0.9})
+    with pytest.raises(StorageException):
+        database_stub.update_item("drug_candidates", "D1", {"predicted_efficacy": "high"})
+    assert database_stub.get_item("drug_candidates", "D1")["predicted_efficacy"] == 0.9
+    assert [c["id"] for c in database_stub.query_items("drug_candidates", min_values={"predicted_efficacy": 0.5})] == ["D1"]
+
+def test_update_items_bulk():
+    """Test that bulk updates keep sorted and hash indexes in sync."""
+    database_stub.add_items("drug_candidates", [
+        {"id": f"C{i}", "therapeutic_area": "oncology", "predicted_efficacy": 0.1}
+        for i in range(50)
+    ])
+    updated = database_stub.update_items("drug_candidates", {
+        **{f"C{i}": {"predicted_efficacy": 0.9} for i in range(0, 50, 2)},
+        "missing": {"predicted_efficacy": 0.9}
+    })
+    assert len(updated) == 25
+    results = database_stub.query_items("drug_candidates", min_values={"predicted_efficacy": 0.5})
+    assert [c["id"] for c in results] == [f"C{i}" for i in range(0, 50, 2)]
+
+def test_column_store_rank_histogram_and_summary():
+    """Test vectorized rankings and aggregates over the columnar copy."""
+    _add_candidates()
+    database_stub.add_item("drug_candidates", {"id": "D5", "therapeutic_area": "cardiology"})
+    assert [c["id"] for c in database_stub.rank_items("drug_candidates", "predicted_efficacy", limit=2)] == ["D1", "D3"]
+    assert [c["id"] for c in database_stub.rank_items("drug_candidates", "predicted_efficacy", limit=10, descending=False)] == ["D2", "D4", "D3", "D1"]
+
+    histogram = database_stub.column_histogram("drug_candidates", "predicted_efficacy", bins=2, value_range=(0, 1))
+    assert histogram["counts"] == [0, 4]
+
+    database_stub.update_item("drug_candidates", "D2", {"predicted_efficacy": 0.3})
+    database_stub.delete_item("drug_candidates", "D4")
+    summary = database_stub.summarize_items("drug_candidates", "therapeutic_area", ["predicted_efficacy"])
+    assert summary["oncology"]["count"] == 2
+    assert summary["oncology"]["mean_predicted_efficacy"] == pytest.approx(0.6)
+    assert summary["cardiology"] == {"count": 2, "mean_predicted_efficacy": pytest.approx(0.85)}
+
+def test_column_store_grows():
+    """Test that the columnar copy grows past its initial capacity."""
+    database_stub.add_items("drug_candidates", [
+        {"therapeutic_area": "oncology", "predicted_efficacy": i / 5000} for i in range(5000)
+    ])
+    top = database_stub.rank_items("drug_candidates", "predicted_efficacy", limit=1)
+    assert top[0]["predicted_efficacy"] == pytest.approx(4999 / 5000)
+    assert database_stub.summarize_items("drug_candidates", "therapeutic_area", [])["oncology"]["count"] == 5000
+
+def test_iter_items_resumes_after_cursor():
+    """Test keyset pagination over filtered and unfiltered iteration."""
+    _add_candidates()
+    first_page = list(database_stub.iter_items("drug_candidates", equals={"therapeutic_area": "oncology"}))[:2]
+    assert [c["id"] for _, c in first_page] == ["D1", "D2"]
+    cursor = first_page[-1][0]
+    rest = database_stub.iter_items("drug_candidates", equals={"therapeutic_area": "oncology"}, after=cursor)
+    assert [c["id"] for _, c in rest] == ["D4"]
+
+    # Deleting the cursor item does not lose the position
+    database_stub.delete_item("drug_candidates", "D2")
+    assert [c["id"] for _, c in database_stub.iter_items("drug_candidates", after=cursor)] == ["D3", "D4"]
+
+def test_iter_items_pages_across_chunks(monkeypatch):
+    """Test that pages read in small chunks stay in order through deletes, re-adds and wide ranges."""
+    monkeypatch.setattr(database_stub, "ITER_CHUNK_SIZE", 3)
+    monkeypatch.setattr(database_stub, "RANGE_SORT_LIMIT", 2)
+    database_stub.add_items("drug_candidates", [
+        {"id": f"D{i}", "therapeutic_area": "oncology" if i % 2 else "cardiology", "predicted_efficacy": i / 20}
+        for i in range(20)
+    ])
+    for i in range(0, 20, 4):
+        database_stub.delete_item("drug_candidates", f"D{i + 1}")
+    database_stub.add_item("drug_candidates", {"id": "D1", "therapeutic_area": "oncology", "predicted_efficacy": 0.9})
+
+    def pages(**filters):
+        ids, cursor = [], None
+        while True:
+            page = list(itertools.islice(database_stub.iter_items("drug_candidates", after=cursor, **filters), 2))
+            if not page:
+                return ids
+            ids += [c["id"] for _, c in page]
+            cursor = page[-1][0]
+
+    assert pages(equals={"therapeutic_area": "oncology"}) == ["D3", "D7", "D11", "D15", "D19", "D1"]
+    assert pages(min_values={"predicted_efficacy": 0.7}) == ["D14", "D15", "D16", "D18", "D19", "D1"]
+    assert pages() == [f"D{i}" for i in range(20) if i % 4 != 1] + ["D1"]
+
+def test_iter_items_tolerates_writes_while_iterating():
+    """Test that a live iterator skips deleted items and does not fail on inserts."""
+    _add_candidates()
+    items = database_stub.iter_items("drug_candidates")
+    assert next(items)[1]["id"] == "D1"
+    database_stub.delete_item("drug_candidates", "D2")
+    database_stub.add_item("drug_candidates", {"id": "D5"})
+    assert [c["id"] for _, c in items] == ["D3", "D4"]
+    with pytest.raises(StorageException):
+        database_stub.iter_items("drug_candidates", equals={"molecule_type": "antibody"})
+
+def test_concurrent_writers_keep_indexes_consistent():
+    """Test that threads adding, updating and deleting leave indexes in sync."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def worker(n):
+        for i in range(200):
+            item_id = f"W{n}-{i}"
+            database_stub.add_item("drug_candidates", {
+                "id": item_id, "therapeutic_area": "oncology", "predicted_efficacy": 0.1
+            })
+            database_stub.update_item("drug_candidates", item_id, {"predicted_efficacy": 0.9})
+            if i % 2:
+                database_stub.delete_item("drug_candidates", item_id)
+            database_stub.query_items("drug_candidates", equals={"therapeutic_area": "oncology"})
+            database_stub.list_items("drug_candidates")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(worker, range(8)))
+
+    assert len(database_stub.list_items("drug_candidates")) == 8 * 100
+    assert len(database_stub.query_items("drug_candidates", min_values={"predicted_efficacy": 0.5})) == 8 * 100
+    assert database_stub.summarize_items("drug_candidates", "therapeutic_area", [])["oncology"]["count"] == 8 * 100
+
+def test_update_does_not_change_items_already_read():
+    """Test that updates replace items instead of modifying them in place."""
+    database_stub.add_item("clinical_trials", {"id": "T1", "status": "recruiting"})
+    before = database_stub.get_item("clinical_trials", "T1")
+    database_stub.update_item("clinical_trials", "T1", {"status": "active"})
+    assert before["status"] == "recruiting"
+    assert database_stub.get_item("clinical_trials", "T1")["status"] == "active"
+
+def test_concurrent_writes_survive_compaction(tmp_path):
+    """Test that log compaction under concurrent writers loses and repeats nothing."""
+    from concurrent.futures import ThreadPoolExecutor
+    database_stub.enable_persistence(str(tmp_path), snapshot_every=50)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(
+            lambda n: [database_stub.add_item("automated_tests", {"drug_candidate_id": f"D{n}"}) for _ in range(300)],
+            range(4)
+        ))
+
+    database_stub._log.close()
+    database_stub._log = None
+    database_stub.enable_persistence(str(tmp_path))
+    assert len(database_stub.list_items("automated_tests")) == 4 * 300
+
+def test_changes_since_lists_deltas():
+    """Test that every mutation is recorded with an increasing sequence number."""
+    start = database_stub.current_sequence()
+    database_stub.add_items("clinical_trials", [{"id": "T1"}, {"id": "T2"}])
+    database_stub.update_item("clinical_trials", "T1", {"status": "active"})
+    database_stub.delete_item("clinical_trials", "T2")
+    database_stub.add_item("automated_tests", {"id": "X1"})
+
+    changes = database_stub.changes_since("clinical_trials", start)
+    assert [(c["op"], c["id"]) for c in changes] == [("add", "T1"), ("add", "T2"), ("update", "T1"), ("delete", "T2")]
+    assert changes[2]["item"]["status"] == "active"
+    assert [c["seq"] for c in changes] == sorted(c["seq"] for c in changes)
+    assert database_stub.changes_since("clinical_trials", changes[-1]["seq"]) == []
+
+def test_concurrent_writes_to_different_collections_get_distinct_sequences():
+    """Test that writers holding different collection locks never share a change sequence number."""
+    from concurrent.futures import ThreadPoolExecutor
+    start = database_stub.current_sequence()
+    collections = ["clinical_trials", "automated_tests", "drug_candidates", "patient_cohorts"]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(
+            lambda collection: [database_stub.add_item(collection, {}) for _ in range(500)],
+            collections
+        ))
+    seqs = [c["seq"] for collection in collections for c in database_stub.changes_since(collection, start)]
+    assert len(set(seqs)) == len(seqs) == 2000
+    assert database_stub.current_sequence() == start + 2000
+
+def test_changes_since_rejects_trimmed_history(monkeypatch):
+    """Test that asking for changes older than the feed keeps raises."""
+    monkeypatch.setitem(database_stub._changes, "clinical_trials", database_stub.deque(maxlen=2))
+    start = database_stub.current_sequence()
+    for item_id in ("T1", "T2", "T3"):
+        database_stub.add_item("clinical_trials", {"id": item_id})
+    with pytest.raises(StorageException):
+        database_stub.changes_since("clinical_trials", start)
+    assert [c["id"] for c in database_stub.changes_since("clinical_trials", start + 1)] == ["T2", "T3"]
+
+async def test_watch_yields_new_changes():
+    """Test that watchers are woken by writes, including writes from other threads."""
+    import asyncio
+    watcher = database_stub.watch("clinical_trials")
+    next_change = asyncio.ensure_future(watcher.__anext__())
+    await asyncio.sleep(0)
+    await asyncio.to_thread(database_stub.add_item, "clinical_trials", {"id": "T1"})
+    change = await asyncio.wait_for(next_change, 1)
+    assert (change["op"], change["id"]) == ("add", "T1")
+
+    database_stub.update_item("clinical_trials", "T1", {"status": "active"})
+    change = await asyncio.wait_for(watcher.__anext__(), 1)
+    assert change["item"]["status"] == "active"
+    await watcher.aclose()
+    assert not database_stub._watchers["clinical_trials"]
+
+@pytest.fixture
+def retention(monkeypatch):
+    """Let a test set retention policies without leaking them into other tests."""
+    monkeypatch.setattr(database_stub, "RETENTION", dict(database_stub.RETENTION))
+    return database_stub.set_retention
+
+def test_retention_max_rows_evicts_oldest(retention):
+    """Test that a row limit evicts the oldest items and keeps indexes in sync."""
+    retention("automated_tests", max_rows=3)
+    for i in range(5):
+        database_stub.add_item("automated_tests", {"id": f"T{i}", "drug_candidate_id": "D1"})
+    assert [t["id"] for t in database_stub.list_items("automated_tests")] == ["T2", "T3", "T4"]
+    assert len(database_stub.list_by("automated_tests", "drug_candidate_id", "D1")) == 3
+
+    # Deleted items no longer count against the limit
+    database_stub.delete_item("automated_tests", "T3")
+    database_stub.add_item("automated_tests", {"id": "T5"})
+    assert [t["id"] for t in database_stub.list_items("automated_tests")] == ["T2", "T4", "T5"]
+
+def test_retention_max_bytes_counts_updates(retention):
+    """Test that a byte limit follows item growth from updates."""
+    database_stub.add_items("automated_tests", [{"id": f"T{i}", "notes": ""} for i in range(3)])
+    size = database_stub.RetentionPolicy(max_bytes=0)._size(database_stub.get_item("automated_tests", "T0"))
+    retention("automated_tests", max_bytes=3 * size + 10)
+    assert len(database_stub.list_items("automated_tests")) == 3
+    database_stub.update_item("automated_tests", "T2", {"notes": "x" * (2 * size)})
+    assert [t["id"] for t in database_stub.list_items("automated_tests")] == ["T2"]
+
+def test_retention_ttl_and_spill(retention, tmp_path):
+    """Test that expired items are evicted, spilled to disk and stay evicted after a restart."""
+    database_stub.enable_persistence(str(tmp_path))
+    retention("automated_tests", ttl_seconds=3600, spill=True)
+    database_stub.add_item("automated_tests", {"id": "OLD", "created_at": "2020-01-01T00:00:00"})
+    database_stub.add_item("automated_tests", {"id": "NEW"})
+    database_stub.enforce_retention()
+    assert [t["id"] for t in database_stub.list_items("automated_tests")] == ["NEW"]
+    spilled = (tmp_path / database_stub.EVICTED_FILE).read_text().splitlines()
+    assert len(spilled) == 1 and '"OLD"' in spilled[0]
+
+    database_stub._log.close()
+    database_stub._log = None
+    retention("automated_tests")
+    database_stub.enable_persistence(str(tmp_path))
+    assert [t["id"] for t in database_stub.list_items("automated_tests")] == ["NEW"]
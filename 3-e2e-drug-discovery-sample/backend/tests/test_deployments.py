@@ -0,0 +1,49 @@
+import asyncio
+import pytest
+import utils.resilience as resilience
+from utils.deployments import DeploymentPool
+
+@pytest.fixture(autouse=True)
+def fresh_breakers(monkeypatch):
+    """Start every test with all deployments healthy."""
+    monkeypatch.setattr(resilience, "_breakers", {})
+
+async def test_least_outstanding_spreads_load():
+    """Test that concurrent calls are spread across the pool."""
+    pool = DeploymentPool(["a", "b", "c"])
+    chosen = []
+
+    async def call():
+        deployment = pool.select("step")
+        chosen.append(deployment)
+        async with pool.track(deployment):
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*(call() for _ in range(3)))
+    assert sorted(chosen) == ["a", "b", "c"]
+    assert all(stats.outstanding == 0 for stats in pool.stats.values())
+
+async def test_latency_strategy_prefers_fast_deployments():
+    """Test that latency-weighted selection favours the faster deployment."""
+    pool = DeploymentPool(["fast", "slow"], strategy="latency")
+    pool._stats("fast").record(0.1)
+    pool._stats("slow").record(10.0)
+    picks = [pool.select("step") for _ in range(200)]
+    assert picks.count("fast") > 150
+
+def test_pins_and_unhealthy_deployments():
+    """Test per-operation pins and that deployments with an open circuit are skipped."""
+    pool = DeploymentPool(["large", "small"], pins={"literature-search": ["small"]})
+    assert pool.select("literature-search") == "small"
+    breaker = resilience.get_breaker("large")
+    breaker.threshold = 1
+    breaker.record_failure()
+    assert {pool.select("precision-med") for _ in range(10)} == {"small"}
+
+def test_pool_from_env(monkeypatch):
+    """Test parsing the pool and pins from the environment."""
+    monkeypatch.setenv("MODEL_DEPLOYMENTS", "gpt-4o, gpt-4o-mini")
+    monkeypatch.setenv("MODEL_DEPLOYMENT_PINS", "literature-search=gpt-4o-mini,precision-med=gpt-4o|gpt-4")
+    pool = DeploymentPool.from_env()
+    assert pool.deployments == ["gpt-4o", "gpt-4o-mini"]
+    assert pool.pins == {"literature-search": ["gpt-4o-mini"], "precision-med": ["gpt-4o", "gpt-4"]}
@@ -7,6 +7,7 @@ from main import app
 import json
 from unittest.mock import patch, AsyncMock, MagicMock
 from azure.ai.projects.models import ToolSet
+from utils.agent_registry import AgentRegistry
 from .mocks import (
     MockProjectClient,
     MockChatClient,
@@ -41,9 +42,7 @@ async def mock_clients():
     with patch('clients.init_clients', AsyncMock(return_value=(mock_project_client, mock_chat_client, None))), \
          patch('clients.project_client', mock_project_client), \
          patch('clients.chat_client', mock_chat_client), \
-         patch('routers.agents.project_client', mock_project_client), \
-         patch('routers.agents.chat_client', mock_chat_client), \
-         patch('routers.agents.agent_cache', {}), \
+         patch('routers.agents.agent_registry', AgentRegistry()), \
          patch.dict(os.environ, {
              'MODEL_DEPLOYMENT_NAME': 'gpt-4',
              'spn_4o_BING_API_KEY': 'mock-bing-key',
@@ -161,6 +160,38 @@ async def test_digital_twin_simulation(client):
     assert isinstance(data["average_survival_gain"], str)
     assert "months" in data["average_survival_gain"]
 
+@pytest.mark.asyncio
+async def test_manufacturing_optimization_stream(client, monkeypatch):
+    """Test that the streaming endpoint relays tokens and completed JSON fields as Server-Sent Events."""
+    request_data = {
+        "drug_candidate": "DRUG123",
+        "batch_size_range": [1000, 2000, 5000],
+        "raw_materials": {"API": 1000, "Excipient": 5000},
+        "production_constraints": {"max_daily_batches": 3}
+    }
+
+    # Off by default until the agents SDK streams replies
+    response = client.post("/agents/manufacturing-opt/stream", json=request_data)
+    assert response.status_code == 501
+
+    monkeypatch.setattr("routers.agents.AGENT_STREAMING", True)
+    response = client.post("/agents/manufacturing-opt/stream", json=request_data)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    names = [event for event, _ in events]
+    assert names[0] == "start"
+    assert names[-1] == "done"
+    assert "token" in names
+
+    fields = {data["name"]: data["value"] for event, data in events if event == "field"}
+    assert fields["optimized_schedule"]["batch_size"] == 1000
+    assert json.loads(events[-1][1]["content"])["optimized_schedule"] == fields["optimized_schedule"]
+
 @pytest.mark.asyncio
 async def test_invalid_requests(client):
     """Test error handling for invalid requests."""
@@ -0,0 +1,95 @@
+import asyncio
+import pytest
+from utils.rate_limit import DeploymentLimiter, RateLimitExceeded, retry_after_seconds
+
+class Throttled(Exception):
+    """Stand-in for an HttpResponseError carrying a 429."""
+    def __init__(self, headers):
+        super().__init__("Too Many Requests")
+        self.status_code = 429
+        self.response = type("Response", (), {"headers": headers})()
+
+def make_limiter(rpm=0, tpm=0, concurrency=4):
+    return DeploymentLimiter("test-deployment", rpm=rpm, tpm=tpm, max_concurrency=concurrency, min_concurrency=1)
+
+async def test_requests_per_minute_budget():
+    """Test that calls beyond the RPM budget are rejected once the queue timeout passes."""
+    limiter = make_limiter(rpm=2)
+    for _ in range(2):
+        async with limiter.reserve(1, timeout=0.1):
+            pass
+    with pytest.raises(RateLimitExceeded) as error:
+        async with limiter.reserve(1, timeout=0.1):
+            pass
+    assert error.value.retry_after > 0
+
+async def test_tokens_per_minute_settles_actual_usage():
+    """Test that unused reserved tokens are returned to the bucket."""
+    limiter = make_limiter(tpm=1000)
+    async with limiter.reserve(800, timeout=0.1) as reservation:
+        reservation.settle(100)
+    # 900 tokens left, so a second large call fits without waiting
+    async with limiter.reserve(800, timeout=0.1):
+        pass
+    with pytest.raises(RateLimitExceeded):
+        async with limiter.reserve(800, timeout=0.1):
+            pass
+
+async def test_timeout_waiting_for_a_slot_refunds_budget():
+    """Test that a call giving up on concurrency returns the requests and tokens it took."""
+    limiter = make_limiter(rpm=10, tpm=1000, concurrency=1)
+    async with limiter.reserve(100, timeout=0.1):
+        with pytest.raises(RateLimitExceeded):
+            async with limiter.reserve(500, timeout=0.05):
+                pass
+        assert limiter.rpm.tokens == pytest.approx(9, abs=0.1)
+        assert limiter.tpm.tokens == pytest.approx(900, abs=1)
+
+async def test_throttling_halves_concurrency_and_pauses():
+    """Test that a 429 halves the concurrency limit and holds new calls for Retry-After."""
+    limiter = make_limiter(concurrency=8)
+    with pytest.raises(RateLimitExceeded) as error:
+        async with limiter.reserve(1):
+            raise Throttled({"retry-after-ms": "200"})
+    assert error.value.retry_after == pytest.approx(0.2)
+    assert limiter.concurrency.limit == 4
+    with pytest.raises(RateLimitExceeded):
+        async with limiter.reserve(1, timeout=0.05):
+            pass
+    async with limiter.reserve(1, timeout=1):
+        pass
+
+async def test_concurrency_grows_after_successes():
+    """Test additive increase and that at most `limit` calls run at once."""
+    limiter = make_limiter(concurrency=4)
+    limiter.concurrency.limit = 2.0
+    running, peak = 0, 0
+
+    async def call():
+        nonlocal running, peak
+        async with limiter.reserve(1):
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    await asyncio.gather(*(call() for _ in range(6)))
+    assert peak <= 3
+    assert limiter.concurrency.limit > 2
+    assert limiter.concurrency.in_flight == 0
+
+async def test_other_errors_pass_through():
+    """Test that non-throttling errors are re-raised and leave the limit unchanged."""
+    limiter = make_limiter(concurrency=4)
+    with pytest.raises(ValueError):
+        async with limiter.reserve(1):
+            raise ValueError("bad request")
+    assert limiter.concurrency.limit == 4
+    assert limiter.concurrency.in_flight == 0
+
+def test_retry_after_parsing():
+    """Test Retry-After in seconds, the millisecond headers, and non-429 errors."""
+    assert retry_after_seconds(Throttled({"Retry-After": "7"})) == 7
+    assert retry_after_seconds(Throttled({"x-ms-retry-after-ms": "1500"})) == 1.5
+    assert retry_after_seconds(Throttled({})) > 0
+    assert retry_after_seconds(ValueError("nope")) is None
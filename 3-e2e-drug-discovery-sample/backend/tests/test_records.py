@@ -0,0 +1,36 @@
+import json
+import pickle
+import pytest
+from records import DrugCandidateRecord, json_default, to_record
+
+def test_record_reads_like_a_dict():
+    """Test that records support the dict operations router code relies on."""
+    record = to_record("drug_candidates", {"id": "D1", "therapeutic_area": "oncology", "notes": "extra"})
+    assert isinstance(record, DrugCandidateRecord)
+    assert record["id"] == "D1"
+    assert record["notes"] == "extra"
+    assert record.get("predicted_efficacy") is None
+    assert "predicted_efficacy" not in record
+    assert dict(record) == {"id": "D1", "therapeutic_area": "oncology", "notes": "extra"}
+    assert {**record, "therapeutic_area": "cardiology"}["therapeutic_area"] == "cardiology"
+    with pytest.raises(KeyError):
+        record["predicted_safety"]
+
+def test_record_is_read_only_and_compact():
+    """Test that records cannot be modified and carry no per-instance dict."""
+    record = to_record("drug_candidates", {"id": "D1"})
+    with pytest.raises(TypeError):
+        record.id = "D2"
+    assert not hasattr(record, "__dict__")
+
+def test_categorical_strings_are_interned():
+    """Test that equal categorical values share one string object."""
+    first = to_record("drug_candidates", {"therapeutic_area": "".join(["onco", "logy"])})
+    second = to_record("drug_candidates", {"therapeutic_area": "".join(["oncol", "ogy"])})
+    assert first["therapeutic_area"] is second["therapeutic_area"]
+
+def test_record_serialization():
+    """Test that records round-trip through pickle snapshots and the JSON log."""
+    record = to_record("clinical_trials", {"id": "T1", "status": "active", "sites": ["A"]})
+    assert pickle.loads(pickle.dumps(record)) == record
+    assert json.loads(json.dumps(record, default=json_default)) == {"id": "T1", "status": "active", "sites": ["A"]}
@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+from azure.core.exceptions import HttpResponseError, ServiceRequestError
+import utils.resilience as resilience
+from utils.resilience import AgentUnavailable, CircuitOpenError, call_with_resilience
+
+class Flaky:
+    """Coroutine function that fails a set number of times before succeeding."""
+    def __init__(self, failures, error=None):
+        self.failures = failures
+        self.error = error or ServiceRequestError("connection refused")
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return "ok"
+
+def server_error(status):
+    error = HttpResponseError(message="server error")
+    error.status_code = status
+    return error
+
+@pytest.fixture(autouse=True)
+def fast_resilience(monkeypatch):
+    """Use fresh breakers and latency history, and do not sleep between retries."""
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(resilience, "_latencies", {})
+    monkeypatch.setattr(resilience, "backoff_seconds", lambda attempt: 0)
+
+async def test_transient_errors_are_retried():
+    """Test that a step succeeds after transient failures within the retry budget."""
+    call = Flaky(2)
+    assert await call_with_resilience("gpt", call, operation="step") == "ok"
+    assert call.calls == 3
+
+async def test_non_idempotent_steps_retry_only_unsent_requests():
+    """Test that an ambiguous failure is not repeated for a non-idempotent step."""
+    call = Flaky(1, server_error(500))
+    with pytest.raises(AgentUnavailable):
+        await call_with_resilience("gpt", call, operation="create", idempotent=False)
+    assert call.calls == 1
+    call = Flaky(1)
+    assert await call_with_resilience("gpt", call, operation="create", idempotent=False) == "ok"
+
+async def test_client_errors_are_not_retried():
+    """Test that a 400 is raised as is, without retrying."""
+    call = Flaky(1, server_error(400))
+    with pytest.raises(HttpResponseError):
+        await call_with_resilience("gpt", call, operation="step")
+    assert call.calls == 1
+
+async def test_circuit_opens_and_recovers():
+    """Test fail-fast after repeated failures and recovery through a half-open probe."""
+    breaker = resilience.get_breaker("gpt")
+    breaker.threshold = 2
+    for _ in range(2):
+        with pytest.raises(AgentUnavailable):
+            await call_with_resilience("gpt", Flaky(10), operation="step")
+    call = Flaky(0)
+    with pytest.raises(CircuitOpenError):
+        await call_with_resilience("gpt", call, operation="step")
+    assert call.calls == 0
+    breaker.opened_at -= breaker.reset_seconds
+    assert breaker.state == "half-open"
+    assert await call_with_resilience("gpt", call, operation="step") == "ok"
+    assert breaker.state == "closed"
+
+async def test_slow_calls_are_hedged(monkeypatch):
+    """Test that a call slower than the recorded p95 is raced by a duplicate."""
+    monkeypatch.setattr(resilience, "AGENT_HEDGE_MIN_SAMPLES", 1)
+    resilience.get_latency_tracker("gpt", "ask").record(0.01)
+    delays = [1.0, 0.0]
+    started = []
+
+    async def call():
+        delay = delays[len(started)]
+        started.append(delay)
+        await asyncio.sleep(delay)
+        return delay
+
+    assert await call_with_resilience("gpt", call, operation="ask", hedge=True) == 0.0
+    assert len(started) == 2
@@ -0,0 +1,42 @@
+import json
+from utils.streaming import JsonFieldStream, sse_event
+
+ANSWER = '```json\n{"query": "EGFR, \\"T790M\\" {", "summary": {"trials": [1, {"phase": 3}]}, "references": ["doi:1", "doi:2"], "count": 2}\n```'
+
+def feed_in_chunks(text, size):
+    stream = JsonFieldStream()
+    fields = []
+    for i in range(0, len(text), size):
+        fields.extend(stream.feed(text[i:i + size]))
+    return stream, fields
+
+def test_fields_are_returned_once_complete():
+    """Test that each top-level field is returned as soon as its value ends, whatever the chunking."""
+    expected = [
+        ("query", 'EGFR, "T790M" {'),
+        ("summary", {"trials": [1, {"phase": 3}]}),
+        ("references", ["doi:1", "doi:2"]),
+        ("count", 2)
+    ]
+    for size in (1, 5, len(ANSWER)):
+        stream, fields = feed_in_chunks(ANSWER, size)
+        assert fields == expected
+        assert stream.done
+
+def test_incomplete_field_is_held_back():
+    """Test that a field whose value is still arriving is not returned."""
+    stream = JsonFieldStream()
+    assert stream.feed('{"query": "EGFR", "summary": "first half') == [("query", "EGFR")]
+    assert stream.feed(' and second half"}') == [("summary", "first half and second half")]
+
+def test_text_without_json_yields_nothing():
+    """Test that plain text answers produce no fields."""
+    stream, fields = feed_in_chunks("No JSON here, just prose.", 4)
+    assert fields == []
+    assert not stream.done
+
+def test_sse_event_format():
+    """Test the event and data lines of a Server-Sent Event."""
+    assert sse_event("field", {"name": "count", "value": 2}) == 'event: field\ndata: {"name": "count", "value": 2}\n\n'
+    line = sse_event("token", {"text": "line one\nline two"}).split("\n")[1]
+    assert json.loads(line[len("data: "):]) == {"text": "line one\nline two"}
@@ -0,0 +1,345 @@
+"""
+Registry of remote agents, created at most once per key.
+
+An agent is identified by its type, the model deployment it runs on and a
+fingerprint of its instructions and tool definitions, so changing any of
+them yields a new agent rather than reusing a stale one. Creation is
+single-flight: while an agent is being created, concurrent requests for
+the same key await the same task instead of creating duplicates.
+
+With a path, agent ids are also kept in a small JSON file, so restarts and
+other workers reuse agents instead of creating them again. Workers update
+the file under a lock file, in a thread so the event loop never blocks.
+A worker saves an agent it created only if no other live agent holds the
+record by then, and otherwise deletes its own, so racing cold starts leave
+no unrecorded agents behind. restore()
+checks each saved agent still exists. It deletes agents no process has
+used for AGENT_REGISTRY_MAX_IDLE_DAYS, which covers agents left behind
+when their instructions or tools changed. A process refreshes last_used of
+the agents it uses at most every AGENT_REGISTRY_TOUCH_SECONDS, and
+heartbeat() does the same for every agent it holds, so agents a live
+worker still references never look idle.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, NamedTuple, Optional
+import asyncio
+import hashlib
+import math
+import json
+import logging
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, run a single worker there
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+AGENT_REGISTRY_MAX_IDLE_DAYS = float(os.getenv("AGENT_REGISTRY_MAX_IDLE_DAYS", "7"))
+# Seconds between refreshes of a saved agent's last_used by one process
+AGENT_REGISTRY_TOUCH_SECONDS = float(os.getenv("AGENT_REGISTRY_TOUCH_SECONDS", "3600"))
+
+class AgentKey(NamedTuple):
+    agent_type: str
+    model: str
+    fingerprint: str
+
+def fingerprint(*parts: Any) -> str:
+    """Stable short hash of JSON-compatible parts, such as instructions and tool definitions."""
+    encoded = json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+def _record_id(key: AgentKey) -> str:
+    return f"{key.agent_type}/{key.model}/{key.fingerprint}"
+
+class AgentRegistry:
+    """Agents by key, with one in-flight creation per key, optionally persisted to a JSON file."""
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.agents: Dict[AgentKey, Any] = {}
+        self._pending: Dict[AgentKey, asyncio.Task] = {}
+        # When this process last refreshed each record's last_used (monotonic)
+        self._touched: Dict[str, float] = {}
+        self.records: Dict[str, dict] = self._load()
+
+    def _load(self) -> Dict[str, dict]:
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Ignoring unreadable agent registry {self.path}: {str(e)}")
+            return {}
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Hold an exclusive lock on the registry file across processes."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(f"{self.path}.lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _update(self, apply: Callable[[Dict[str, dict]], None]) -> None:
+        """
+        Re-read the file, change its records in place with apply(), and write it back.
+
+        The read-modify-write runs under the file lock, so records other
+        workers save at the same time are kept. Blocking; call it through
+        asyncio.to_thread.
+        """
+        try:
+            with self._locked():
+                records = self._load()
+                apply(records)
+                temp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(temp_path, "w") as f:
+                    json.dump(records, f, indent=2)
+                os.replace(temp_path, self.path)
+                self.records = records
+        except OSError as e:
+            logger.warning(f"⚠️ Could not save agent registry {self.path}: {str(e)}")
+
+    async def _save(self, record_id: str, record: Optional[dict]) -> None:
+        """Set or remove one record, off the event loop."""
+        def apply(records: Dict[str, dict]) -> None:
+            if record is None:
+                records.pop(record_id, None)
+            else:
+                records[record_id] = record
+        if self.path:
+            await asyncio.to_thread(self._update, apply)
+
+    async def _refresh(self, keys: Iterable[AgentKey]) -> None:
+        """Set last_used to now on the saved records of agents this process holds."""
+        held = {_record_id(key): self.agents[key].id for key in keys if key in self.agents}
+        now = datetime.now().isoformat()
+
+        def apply(records: Dict[str, dict]) -> None:
+            for record_id, agent_id in held.items():
+                record = records.get(record_id)
+                # Another worker may have replaced the agent; leave its record alone
+                if record is not None and record["agent_id"] == agent_id:
+                    record["last_used"] = now
+        if self.path and held:
+            await asyncio.to_thread(self._update, apply)
+
+    async def _touch(self, key: AgentKey) -> None:
+        """Mark a saved agent as used, at most every AGENT_REGISTRY_TOUCH_SECONDS."""
+        record_id = _record_id(key)
+        now = time.monotonic()
+        if record_id not in self.records or now - self._touched.get(record_id, -math.inf) < AGENT_REGISTRY_TOUCH_SECONDS:
+            return
+        self._touched[record_id] = now
+        await self._refresh([key])
+
+    async def heartbeat(self) -> None:
+        """Mark every agent this process holds as used, so other workers' restore() keeps them."""
+        now = time.monotonic()
+        for key in self.agents:
+            self._touched[_record_id(key)] = now
+        await self._refresh(list(self.agents))
+
+    async def restore(self, fetch: Callable[[str], Awaitable[Any]],
+                      delete: Optional[Callable[[str], Awaitable[Any]]] = None,
+                      max_idle_days: float = AGENT_REGISTRY_MAX_IDLE_DAYS) -> int:
+        """
+        Load saved agents that still exist, so first requests skip creating them.
+
+        Args:
+            fetch: Looks up an agent by id; raises an error with status 404 if it is gone
+            delete: Deletes an agent by id; agents idle longer than max_idle_days are deleted
+            max_idle_days (float): Idle time after which a saved agent is considered stale
+
+        Returns:
+            int: Number of agents reused
+        """
+        saved = self.records = await asyncio.to_thread(self._load)
+        if not saved:
+            return 0
+        cutoff = datetime.now() - timedelta(days=max_idle_days)
+        stale = {
+            record_id for record_id, record in saved.items()
+            if datetime.fromisoformat(record["last_used"]) < cutoff
+        }
+        live = [(record_id, record) for record_id, record in saved.items() if record_id not in stale]
+        results = await asyncio.gather(*(fetch(record["agent_id"]) for _, record in live), return_exceptions=True)
+
+        restored = 0
+        for (record_id, record), result in zip(live, results):
+            if isinstance(result, BaseException):
+                if getattr(result, "status_code", None) == 404:
+                    logger.info(f"🧹 Dropping {record['agent_type']} agent {record['agent_id']}: no longer exists")
+                    await self._save(record_id, None)
+                else:
+                    # Leave the record for the next start; this process creates on demand
+                    logger.warning(f"⚠️ Could not validate agent {record['agent_id']}: {str(result)}")
+                continue
+            key = AgentKey(record["agent_type"], record["model"], record["fingerprint"])
+            self.agents[key] = result
+            restored += 1
+
+        for record_id in stale:
+            record = saved[record_id]
+            # A live worker may have refreshed the record since it was read
+            current = (await asyncio.to_thread(self._load)).get(record_id)
+            if current is None or current != record:
+                continue
+            if delete is not None:
+                try:
+                    await delete(record["agent_id"])
+                except Exception as e:
+                    if getattr(e, "status_code", None) != 404:
+                        logger.warning(f"⚠️ Could not delete stale agent {record['agent_id']}: {str(e)}")
+                        continue
+            logger.info(f"🧹 Removed stale {record['agent_type']} agent {record['agent_id']}")
+            await self._save(record_id, None)
+        return restored
+
+    async def get_or_create(self, key: AgentKey, create: Callable[[], Awaitable[Any]],
+                            fetch: Optional[Callable[[str], Awaitable[Any]]] = None,
+                            delete: Optional[Callable[[str], Awaitable[Any]]] = None) -> Any:
+        """
+        Return the agent for `key`, calling `create` only if no agent exists or is being created.
+
+        With a path and fetch, an agent another worker has saved under the
+        same key is reused rather than creating one. If another worker saves
+        its agent while this one is creating, the agent created here is
+        deleted and the saved one used, so no created agent goes unrecorded.
+
+        If creation fails, every waiting caller gets the error and the next
+        call tries again.
+        """
+        agent = self.agents.get(key)
+        if agent is not None:
+            await self._touch(key)
+            return agent
+        task = self._pending.get(key)
+        if task is None:
+            task = self._pending[key] = asyncio.ensure_future(self._create(key, create, fetch, delete))
+        # A caller that gives up must not cancel the creation the others await
+        return await asyncio.shield(task)
+
+    async def _create(self, key: AgentKey, create: Callable[[], Awaitable[Any]],
+                      fetch: Optional[Callable[[str], Awaitable[Any]]],
+                      delete: Optional[Callable[[str], Awaitable[Any]]]) -> Any:
+        try:
+            record_id = _record_id(key)
+            shared = self.path is not None and fetch is not None
+            # Agent id of a saved record whose agent no longer exists; ours may replace it
+            replaces = None
+            if shared:
+                saved = (await asyncio.to_thread(self._load)).get(record_id)
+                if saved is not None:
+                    agent = await self._fetch_live(fetch, saved["agent_id"])
+                    if agent is not None:
+                        return await self._adopt(key, agent)
+                    replaces = saved["agent_id"]
+
+            agent = await create()
+            logger.info(f"🤖 Created {key.agent_type} agent {agent.id} on {key.model}")
+            holder = await self._claim(key, agent, replaces)
+            if holder is not None and shared:
+                existing = await self._fetch_live(fetch, holder)
+                if existing is not None:
+                    # Another worker won the race; drop ours rather than orphan one of the two
+                    await self._discard(agent, delete)
+                    return await self._adopt(key, existing)
+                holder = await self._claim(key, agent, holder)
+            if holder is not None:
+                logger.warning(f"⚠️ {key.agent_type} agent {agent.id} is not saved: {holder} holds its record")
+            self.agents[key] = agent
+            return agent
+        finally:
+            del self._pending[key]
+
+    async def _claim(self, key: AgentKey, agent: Any, replaces: Optional[str]) -> Optional[str]:
+        """
+        Save agent under key unless another agent already holds the record.
+
+        The check and the write happen under the file lock. Returns the id
+        of the agent holding the record instead, or None once agent is saved.
+        """
+        record_id = _record_id(key)
+        now = datetime.now().isoformat()
+        holder = None
+
+        def apply(records: Dict[str, dict]) -> None:
+            nonlocal holder
+            current = records.get(record_id)
+            if current is not None and current["agent_id"] not in (agent.id, replaces):
+                holder = current["agent_id"]
+                return
+            records[record_id] = {
+                "agent_id": agent.id,
+                "agent_type": key.agent_type,
+                "model": key.model,
+                "fingerprint": key.fingerprint,
+                "created_at": now,
+                "last_used": now
+            }
+        if self.path:
+            self._touched[record_id] = time.monotonic()
+            await asyncio.to_thread(self._update, apply)
+        return holder
+
+    async def _adopt(self, key: AgentKey, agent: Any) -> Any:
+        """Use an agent another worker created and saved."""
+        self.agents[key] = agent
+        logger.info(f"🤖 Reusing {key.agent_type} agent {agent.id} saved by another worker")
+        self._touched[_record_id(key)] = time.monotonic()
+        await self._refresh([key])
+        return agent
+
+    @staticmethod
+    async def _fetch_live(fetch: Callable[[str], Awaitable[Any]], agent_id: str) -> Optional[Any]:
+        """Return the agent, or None if the service no longer has it."""
+        try:
+            return await fetch(agent_id)
+        except Exception as e:
+            if getattr(e, "status_code", None) == 404:
+                return None
+            raise
+
+    @staticmethod
+    async def _discard(agent: Any, delete: Optional[Callable[[str], Awaitable[Any]]]) -> None:
+        if delete is None:
+            return
+        try:
+            await delete(agent.id)
+            logger.info(f"🧹 Deleted duplicate agent {agent.id}")
+        except Exception as e:
+            logger.warning(f"⚠️ Could not delete duplicate agent {agent.id}: {str(e)}")
+
+    def key_of(self, agent_id: str) -> Optional[AgentKey]:
+        """Return the key an agent is registered under, if any."""
+        for key, agent in self.agents.items():
+            if agent.id == agent_id:
+                return key
+        return None
+
+    async def invalidate(self, key: AgentKey, agent_id: Optional[str] = None) -> None:
+        """
+        Forget an agent, e.g. after the service reports it no longer exists.
+
+        With agent_id, the key is only forgotten while it still maps to that
+        agent, so a late caller cannot drop the replacement another request
+        has just created.
+        """
+        agent = self.agents.get(key)
+        if agent_id is not None and agent is not None and agent.id != agent_id:
+            return
+        self.agents.pop(key, None)
+        record = self.records.get(_record_id(key))
+        if record is not None and (agent_id is None or record["agent_id"] == agent_id):
+            await self._save(_record_id(key), None)
@@ -0,0 +1,121 @@
+"""
+Routing of model calls across a pool of deployments.
+
+MODEL_DEPLOYMENTS lists the deployments calls may use, so throughput is not
+capped by a single deployment's quota. Each call picks one with
+select_deployment(operation):
+- "least-outstanding" (default) picks the deployment with the fewest calls
+  in flight, breaking ties by lower latency.
+- "latency" picks at random, weighted towards deployments that are both
+  fast and idle.
+
+Deployments whose circuit breaker is open are skipped while any other
+candidate is healthy. MODEL_DEPLOYMENT_PINS restricts an operation to
+its own deployments, e.g. "literature-search=gpt-4o-mini,precision-med=gpt-4o".
+Separate several deployments for one operation with "|".
+"""
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+import logging
+import os
+import random
+import time
+
+from utils.resilience import get_breaker
+
+logger = logging.getLogger(__name__)
+
+def default_deployment() -> str:
+    """The single deployment used when no pool is configured."""
+    return os.getenv("MODEL_DEPLOYMENT_NAME", os.getenv("spn_4o_model", "gpt-4"))
+
+DEPLOYMENT_STRATEGY = os.getenv("DEPLOYMENT_STRATEGY", "least-outstanding")
+# Weight of the newest sample in each deployment's moving-average latency
+DEPLOYMENT_LATENCY_ALPHA = float(os.getenv("DEPLOYMENT_LATENCY_ALPHA", "0.2"))
+
+class DeploymentStats:
+    """Calls in flight and moving-average latency of one deployment."""
+    __slots__ = ("outstanding", "latency")
+
+    def __init__(self):
+        self.outstanding = 0
+        self.latency: Optional[float] = None
+
+    def record(self, seconds: float) -> None:
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += DEPLOYMENT_LATENCY_ALPHA * (seconds - self.latency)
+
+class DeploymentPool:
+    """Pool of deployments with per-operation pins and load-aware selection."""
+    def __init__(self, deployments: List[str], pins: Optional[Dict[str, List[str]]] = None,
+                 strategy: str = DEPLOYMENT_STRATEGY):
+        if strategy not in ("least-outstanding", "latency"):
+            raise ValueError(f"Unknown deployment strategy: {strategy}")
+        self.deployments = deployments
+        self.pins = pins or {}
+        self.strategy = strategy
+        self.stats: Dict[str, DeploymentStats] = {}
+
+    @classmethod
+    def from_env(cls) -> "DeploymentPool":
+        names = [name.strip() for name in os.getenv("MODEL_DEPLOYMENTS", "").split(",") if name.strip()]
+        pins: Dict[str, List[str]] = {}
+        for pin in os.getenv("MODEL_DEPLOYMENT_PINS", "").split(","):
+            operation, _, targets = pin.partition("=")
+            targets = [target.strip() for target in targets.split("|") if target.strip()]
+            if operation.strip() and targets:
+                pins[operation.strip()] = targets
+        pool = cls(names or [default_deployment()], pins)
+        if len(pool.deployments) > 1 or pins:
+            logger.info(f"🔀 Model deployments: {', '.join(pool.deployments)} ({pool.strategy}), pins: {pins}")
+        return pool
+
+    def _stats(self, deployment: str) -> DeploymentStats:
+        stats = self.stats.get(deployment)
+        if stats is None:
+            stats = self.stats[deployment] = DeploymentStats()
+        return stats
+
+    def candidates(self, operation: str) -> List[str]:
+        """Deployments an operation may use, healthy ones only unless none are."""
+        pool = self.pins.get(operation, self.deployments)
+        healthy = [deployment for deployment in pool if get_breaker(deployment).state != "open"]
+        return healthy or pool
+
+    def select(self, operation: str) -> str:
+        """Pick the deployment for one call of an operation."""
+        candidates = self.candidates(operation)
+        if len(candidates) == 1:
+            return candidates[0]
+        stats = [self._stats(deployment) for deployment in candidates]
+        known = [s.latency for s in stats if s.latency is not None]
+        # Deployments without samples are assumed average so they still get traffic
+        typical = sum(known) / len(known) if known else 1.0
+
+        if self.strategy == "latency":
+            weights = [1 / (max(s.latency or typical, 1e-3) * (s.outstanding + 1)) for s in stats]
+            return random.choices(candidates, weights)[0]
+        order = list(range(len(candidates)))
+        random.shuffle(order)
+        best = min(order, key=lambda i: (stats[i].outstanding, stats[i].latency or typical))
+        return candidates[best]
+
+    @asynccontextmanager
+    async def track(self, deployment: str) -> AsyncIterator[None]:
+        """Count a call as in flight on a deployment and record its latency if it succeeds."""
+        stats = self._stats(deployment)
+        stats.outstanding += 1
+        started = time.monotonic()
+        try:
+            yield
+            stats.record(time.monotonic() - started)
+        finally:
+            stats.outstanding -= 1
+
+deployment_pool = DeploymentPool.from_env()
+
+def select_deployment(operation: str) -> str:
+    """Pick a deployment from the process-wide pool for one call of an operation."""
+    return deployment_pool.select(operation)
@@ -0,0 +1,233 @@
+"""
+Client-side rate limiting for model deployments.
+
+Each deployment gets one DeploymentLimiter shared by every router in the
+process. A request takes one unit from a requests-per-minute bucket, its
+estimated token count from a tokens-per-minute bucket, and a slot from an
+AIMD concurrency controller: the limit grows by one per window of successful
+calls and halves when the service answers 429, and new calls wait out the
+Retry-After it sends. Calls that cannot get capacity within
+MODEL_QUEUE_TIMEOUT_SECONDS fail with RateLimitExceeded, which routers
+report as 429 rather than 500.
+"""
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Dict, Optional
+from datetime import datetime, timezone
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Budgets apply to each deployment; set MODEL_RPM_LIMIT_<DEPLOYMENT> (name upper-cased,
+# dashes and dots as underscores) to override them for one deployment. 0 means no limit.
+MODEL_RPM_LIMIT = int(os.getenv("MODEL_RPM_LIMIT", "300"))
+MODEL_TPM_LIMIT = int(os.getenv("MODEL_TPM_LIMIT", "50000"))
+MODEL_MAX_CONCURRENCY = int(os.getenv("MODEL_MAX_CONCURRENCY", "32"))
+MODEL_MIN_CONCURRENCY = int(os.getenv("MODEL_MIN_CONCURRENCY", "1"))
+# Completion tokens reserved per call until the response reports actual usage
+MODEL_RESPONSE_TOKENS = int(os.getenv("MODEL_RESPONSE_TOKENS", "800"))
+MODEL_QUEUE_TIMEOUT_SECONDS = float(os.getenv("MODEL_QUEUE_TIMEOUT_SECONDS", "30"))
+# Pause after a 429 that carries no Retry-After header
+MODEL_THROTTLE_BACKOFF_SECONDS = float(os.getenv("MODEL_THROTTLE_BACKOFF_SECONDS", "1"))
+
+class RateLimitExceeded(Exception):
+    """Raised when a deployment has no capacity for a call, locally or per the service."""
+    def __init__(self, deployment: str, retry_after: float):
+        self.deployment = deployment
+        self.retry_after = retry_after
+        super().__init__(f"Rate limit exceeded for deployment {deployment}, retry after {retry_after:.1f}s")
+
+def _deployment_setting(name: str, deployment: str, default: int) -> int:
+    suffix = deployment.upper().replace("-", "_").replace(".", "_")
+    return int(os.getenv(f"{name}_{suffix}", default))
+
+def estimate_tokens(text: str, response_tokens: int = MODEL_RESPONSE_TOKENS) -> int:
+    """Estimate the tokens a call will use: about four characters per prompt token plus the response."""
+    return len(text) // 4 + response_tokens
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """
+    Return how long the service asked us to back off, or None if the error is not a 429.
+
+    Reads retry-after-ms / x-ms-retry-after-ms and Retry-After (seconds or an
+    HTTP date) from the response, falling back to MODEL_THROTTLE_BACKOFF_SECONDS.
+    """
+    if getattr(error, "status_code", None) != 429:
+        return None
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for header in ("retry-after-ms", "x-ms-retry-after-ms"):
+        value = headers.get(header)
+        if value:
+            try:
+                return float(value) / 1000
+            except ValueError:
+                pass
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    if value:
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            try:
+                return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+            except (TypeError, ValueError):
+                pass
+    return MODEL_THROTTLE_BACKOFF_SECONDS
+
+class TokenBucket:
+    """Bucket holding up to `per_minute` units, refilled continuously at per_minute / 60 per second."""
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        # Waiters queue on the lock, so they are served in arrival order
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available (0 if they are now)."""
+        self._refill()
+        return max(min(amount, self.capacity) - self.tokens, 0.0) / self.rate
+
+    async def take(self, amount: float, deadline: float) -> None:
+        """Wait for and remove `amount` units, raising TimeoutError if that would pass `deadline`."""
+        # A call larger than the whole bucket waits for a full bucket instead of forever
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                wait = self.wait_time(amount)
+                if wait <= 0:
+                    self.tokens -= amount
+                    return
+                if time.monotonic() + wait > deadline:
+                    raise TimeoutError(wait)
+                await asyncio.sleep(wait)
+
+    def adjust(self, amount: float) -> None:
+        """Return unused units (positive) or charge for extra use (negative, may go into debt)."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+class AdaptiveConcurrency:
+    """Concurrency limit with additive increase on success and multiplicative decrease on 429."""
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._changed = asyncio.Condition()
+
+    async def acquire(self, deadline: float) -> None:
+        """Wait for a free slot, raising TimeoutError if none frees up before `deadline`."""
+        async with self._changed:
+            while True:
+                now = time.monotonic()
+                if now >= self.paused_until and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                if now >= deadline or self.paused_until > deadline:
+                    raise TimeoutError(max(self.paused_until - now, 0.0))
+                timeout = deadline - now
+                if self.paused_until > now:
+                    timeout = self.paused_until - now
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, succeeded: bool, retry_after: Optional[float] = None) -> None:
+        """Free a slot, growing the limit after a success or backing off after a 429."""
+        async with self._changed:
+            self.in_flight -= 1
+            if succeeded:
+                # About +1 per window of `limit` successful calls
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            elif retry_after is not None:
+                self.limit = max(self.minimum, self.limit / 2)
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            self._changed.notify_all()
+
+class Reservation:
+    """Capacity held for one call; settle() corrects the token estimate with actual usage."""
+    def __init__(self, limiter: "DeploymentLimiter", tokens: int):
+        self.limiter = limiter
+        self.tokens = tokens
+
+    def settle(self, used_tokens: Optional[int]) -> None:
+        if used_tokens is None or self.limiter.tpm is None:
+            return
+        self.limiter.tpm.adjust(self.tokens - used_tokens)
+        self.tokens = used_tokens
+
+class DeploymentLimiter:
+    """Requests-per-minute, tokens-per-minute and adaptive concurrency limits for one deployment."""
+    def __init__(self, deployment: str, rpm: int, tpm: int, max_concurrency: int, min_concurrency: int):
+        self.deployment = deployment
+        self.rpm = TokenBucket(rpm) if rpm > 0 else None
+        self.tpm = TokenBucket(tpm) if tpm > 0 else None
+        self.concurrency = AdaptiveConcurrency(max_concurrency, min_concurrency, max_concurrency)
+
+    @asynccontextmanager
+    async def reserve(self, tokens: int, timeout: float = MODEL_QUEUE_TIMEOUT_SECONDS) -> AsyncIterator[Reservation]:
+        """
+        Hold capacity for one call to the deployment.
+
+        Raises RateLimitExceeded if capacity is not available within `timeout`,
+        or if the call inside the block fails with a 429.
+        """
+        deadline = time.monotonic() + timeout
+        # Units already taken from each bucket, returned if a later stage gives up
+        taken = []
+        try:
+            if self.rpm is not None:
+                await self.rpm.take(1, deadline)
+                taken.append((self.rpm, 1))
+            if self.tpm is not None:
+                await self.tpm.take(tokens, deadline)
+                taken.append((self.tpm, min(tokens, self.tpm.capacity)))
+            await self.concurrency.acquire(deadline)
+        except BaseException as e:
+            # Also on cancellation: the call never runs, so it must not use up the budget
+            for bucket, amount in taken:
+                bucket.adjust(amount)
+            if not isinstance(e, TimeoutError):
+                raise
+            wait = e.args[0] if e.args else timeout
+            logger.warning(f"⚠️ No capacity on {self.deployment} within {timeout:.0f}s")
+            raise RateLimitExceeded(self.deployment, wait) from None
+
+        succeeded, retry_after = False, None
+        try:
+            yield Reservation(self, tokens)
+            succeeded = True
+        except Exception as e:
+            retry_after = retry_after_seconds(e)
+            if retry_after is None:
+                raise
+            logger.warning(f"⚠️ {self.deployment} throttled, backing off {retry_after:.1f}s")
+            raise RateLimitExceeded(self.deployment, retry_after) from e
+        finally:
+            await self.concurrency.release(succeeded, retry_after)
+
+_limiters: Dict[str, DeploymentLimiter] = {}
+
+def get_limiter(deployment: str) -> DeploymentLimiter:
+    """Return the process-wide limiter for a deployment, creating it on first use."""
+    limiter = _limiters.get(deployment)
+    if limiter is None:
+        limiter = _limiters[deployment] = DeploymentLimiter(
+            deployment,
+            rpm=_deployment_setting("MODEL_RPM_LIMIT", deployment, MODEL_RPM_LIMIT),
+            tpm=_deployment_setting("MODEL_TPM_LIMIT", deployment, MODEL_TPM_LIMIT),
+            max_concurrency=_deployment_setting("MODEL_MAX_CONCURRENCY", deployment, MODEL_MAX_CONCURRENCY),
+            min_concurrency=MODEL_MIN_CONCURRENCY
+        )
+    return limiter
@@ -0,0 +1,230 @@
+"""
+Retries, hedging and circuit breaking for calls to model deployments.
+
+call_with_resilience() runs one agent step with:
+- retries with exponential backoff and full jitter for transient errors.
+  Steps that are not idempotent are only resent when the request never
+  reached the service.
+- an optional hedged duplicate, started when the first attempt is slower
+  than the step's recent p95 latency. The first success wins and the other
+  attempt is cancelled.
+- a circuit breaker per deployment. After AGENT_BREAKER_FAILURES
+  consecutive failed steps it rejects calls for AGENT_BREAKER_RESET_SECONDS,
+  then lets one probe call through.
+
+Failures the caller cannot fix by waiting less surface as AgentUnavailable,
+so routers can fall back to local tool functions or answer 503.
+"""
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+import asyncio
+import logging
+import os
+import random
+import time
+
+from azure.core.exceptions import ServiceRequestError, ServiceResponseError
+
+from utils.rate_limit import RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+AGENT_RETRY_ATTEMPTS = int(os.getenv("AGENT_RETRY_ATTEMPTS", "3"))
+AGENT_RETRY_BASE_SECONDS = float(os.getenv("AGENT_RETRY_BASE_SECONDS", "0.5"))
+AGENT_RETRY_MAX_SECONDS = float(os.getenv("AGENT_RETRY_MAX_SECONDS", "8"))
+# Hedging sends a second copy of slow calls, which costs tokens, so it is opt-in
+AGENT_HEDGING = os.getenv("AGENT_HEDGING", "false").lower() == "true"
+AGENT_HEDGE_PERCENTILE = float(os.getenv("AGENT_HEDGE_PERCENTILE", "95"))
+AGENT_HEDGE_MIN_SAMPLES = int(os.getenv("AGENT_HEDGE_MIN_SAMPLES", "20"))
+AGENT_BREAKER_FAILURES = int(os.getenv("AGENT_BREAKER_FAILURES", "5"))
+AGENT_BREAKER_RESET_SECONDS = float(os.getenv("AGENT_BREAKER_RESET_SECONDS", "30"))
+
+TRANSIENT_STATUS_CODES = {408, 500, 502, 503, 504}
+
+class AgentUnavailable(Exception):
+    """Raised when a deployment keeps failing with transient errors."""
+    def __init__(self, deployment: str, retry_after: float, reason: str):
+        self.deployment = deployment
+        self.retry_after = retry_after
+        super().__init__(f"Deployment {deployment} unavailable: {reason}")
+
+class CircuitOpenError(AgentUnavailable):
+    """Raised without calling the service while a deployment's circuit is open."""
+
+def is_transient(error: BaseException) -> bool:
+    """Check whether an error is worth retrying. Throttling is left to the rate limiter."""
+    if isinstance(error, (RateLimitExceeded, AgentUnavailable)):
+        return False
+    if isinstance(error, (ServiceRequestError, ServiceResponseError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    return getattr(error, "status_code", None) in TRANSIENT_STATUS_CODES
+
+def is_safe_to_resend(error: BaseException) -> bool:
+    """Check whether a non-idempotent request certainly had no effect: it was never sent or was refused."""
+    return isinstance(error, ServiceRequestError) or getattr(error, "status_code", None) == 503
+
+def backoff_seconds(attempt: int) -> float:
+    """Full-jitter exponential backoff for the given retry (0 for the first)."""
+    return random.uniform(0, min(AGENT_RETRY_MAX_SECONDS, AGENT_RETRY_BASE_SECONDS * 2 ** attempt))
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker: closed, open, then half-open with a single probe."""
+    def __init__(self, deployment: str, failures: int = AGENT_BREAKER_FAILURES,
+                 reset_seconds: float = AGENT_BREAKER_RESET_SECONDS):
+        self.deployment = deployment
+        self.threshold = failures
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_seconds:
+            return "open"
+        return "half-open"
+
+    def before_call(self) -> None:
+        """Admit a call or raise CircuitOpenError. In half-open state only one probe is admitted."""
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half-open" and not self.probing:
+            self.probing = True
+            return
+        retry_after = max(self.opened_at + self.reset_seconds - time.monotonic(), 1.0)
+        raise CircuitOpenError(self.deployment, retry_after, "circuit open after repeated failures")
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info(f"✅ Circuit for {self.deployment} closed")
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.probing or self.failures >= self.threshold:
+            if self.opened_at is None or self.probing:
+                logger.warning(f"⚠️ Circuit for {self.deployment} opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def release(self) -> None:
+        """End a call that says nothing about the deployment's health (throttled or cancelled)."""
+        self.probing = False
+
+class LatencyTracker:
+    """Recent successful call latencies for one step on one deployment."""
+    def __init__(self, size: int = 200):
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """Latency at the given percentile, or None until AGENT_HEDGE_MIN_SAMPLES calls are recorded."""
+        if len(self.samples) < AGENT_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * percentile / 100), len(ordered) - 1)]
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_latencies: Dict[Tuple[str, str], LatencyTracker] = {}
+
+def get_breaker(deployment: str) -> CircuitBreaker:
+    """Return the process-wide circuit breaker for a deployment."""
+    breaker = _breakers.get(deployment)
+    if breaker is None:
+        breaker = _breakers[deployment] = CircuitBreaker(deployment)
+    return breaker
+
+def get_latency_tracker(deployment: str, operation: str) -> LatencyTracker:
+    """Return the latency history of one step on one deployment."""
+    key = (deployment, operation)
+    tracker = _latencies.get(key)
+    if tracker is None:
+        tracker = _latencies[key] = LatencyTracker()
+    return tracker
+
+async def _hedged(call: Callable[[], Awaitable[T]], delay: float) -> T:
+    """Run call(); if it has not finished after `delay` seconds, race a second copy against it."""
+    tasks = {asyncio.ensure_future(call())}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            logger.info(f"🔀 Hedging call still running after {delay:.2f}s")
+            tasks.add(asyncio.ensure_future(call()))
+        error: Optional[BaseException] = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def call_with_resilience(
+    deployment: str,
+    call: Callable[[], Awaitable[T]],
+    operation: str,
+    idempotent: bool = True,
+    hedge: bool = AGENT_HEDGING
+) -> T:
+    """
+    Run one step against a deployment with retries, optional hedging and the circuit breaker.
+
+    Args:
+        deployment (str): Model deployment the step uses
+        call: Zero-argument coroutine function performing the step; called once per attempt
+        operation (str): Step name used for latency tracking, e.g. "literature-search"
+        idempotent (bool): Whether the step may be repeated after an ambiguous failure
+        hedge (bool): Whether a slow attempt may be raced by a duplicate (idempotent steps only)
+
+    Raises:
+        AgentUnavailable: The circuit is open or transient errors outlasted the retries
+        RateLimitExceeded: The deployment's rate limiter rejected the call
+    """
+    breaker = get_breaker(deployment)
+    breaker.before_call()
+    tracker = get_latency_tracker(deployment, operation)
+    delay = tracker.percentile(AGENT_HEDGE_PERCENTILE) if hedge and idempotent else None
+
+    outcome = None
+    try:
+        for attempt in range(AGENT_RETRY_ATTEMPTS):
+            started = time.monotonic()
+            try:
+                result = await (_hedged(call, delay) if delay is not None else call())
+            except Exception as e:
+                retryable = is_transient(e) if idempotent else is_safe_to_resend(e)
+                if not retryable or attempt + 1 >= AGENT_RETRY_ATTEMPTS:
+                    raise
+                wait = backoff_seconds(attempt)
+                logger.warning(f"⚠️ {operation} on {deployment} failed ({str(e)}), retrying in {wait:.2f}s")
+                await asyncio.sleep(wait)
+                continue
+            tracker.record(time.monotonic() - started)
+            outcome = "success"
+            return result
+    except Exception as e:
+        if not is_transient(e):
+            # Throttling says nothing about health; other errors show the service answered
+            outcome = None if isinstance(e, RateLimitExceeded) else "success"
+            raise
+        outcome = "failure"
+        raise AgentUnavailable(deployment, breaker.reset_seconds, str(e)) from e
+    finally:
+        if outcome == "success":
+            breaker.record_success()
+        elif outcome == "failure":
+            breaker.record_failure()
+        else:
+            breaker.release()
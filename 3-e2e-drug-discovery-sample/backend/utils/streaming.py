@@ -0,0 +1,136 @@
+"""
+Helpers for paginated and streamed list endpoints, and for streaming agent answers as Server-Sent Events.
+"""
+from typing import AsyncIterable, Iterable, Iterator, List, Optional, Tuple, Union
+from itertools import islice
+import json
+
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from records import json_default
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def wants_ndjson(request: Request) -> bool:
+    """Check whether the client asked for newline-delimited JSON."""
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+def _ndjson_line(record) -> str:
+    return json.dumps(record, default=json_default) + "\n"
+
+def ndjson_response(records: Union[Iterable, AsyncIterable]) -> StreamingResponse:
+    """Stream records as newline-delimited JSON, one line per record as it is produced."""
+    if isinstance(records, AsyncIterable):
+        async def lines():
+            async for record in records:
+                yield _ndjson_line(record)
+        return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
+    return StreamingResponse((_ndjson_line(record) for record in records), media_type=NDJSON_MEDIA_TYPE)
+
+def paginate(pairs: Iterator[Tuple[int, dict]], limit: Optional[int], response: Response) -> List[dict]:
+    """
+    Take one page from a storage iterator of (cursor, item) pairs.
+
+    When more items follow the page, the cursor of its last item is sent in
+    the X-Next-Cursor header; pass it back as `after` to fetch the next page.
+    """
+    page = list(islice(pairs, limit + 1 if limit else None))
+    if limit and len(page) > limit:
+        page = page[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = str(page[-1][0])
+    return [item for _, item in page]
+
+SSE_MEDIA_TYPE = "text/event-stream"
+
+def sse_event(event: str, data) -> str:
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, default=json_default)}\n\n"
+
+def sse_response(events: AsyncIterable[Tuple[str, dict]],
+                 background: Optional[BackgroundTask] = None) -> StreamingResponse:
+    """
+    Stream (event, data) pairs as Server-Sent Events, flushing each as it is produced.
+
+    background runs once the response ends, even if the client disconnected
+    before events was iterated.
+    """
+    async def lines():
+        async for event, data in events:
+            yield sse_event(event, data)
+    return StreamingResponse(
+        lines(),
+        background=background,
+        media_type=SSE_MEDIA_TYPE,
+        # Keep proxies from buffering the stream, which would delay every event
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+class JsonFieldStream:
+    """
+    Incremental reader for a JSON object that arrives in chunks, such as model output.
+
+    feed() returns each top-level field as soon as its value is complete, so
+    clients can render fields while later ones are still being generated.
+    Text before the opening brace (e.g. a ```json fence) is skipped.
+    """
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.key_start: Optional[int] = None
+        self.key: Optional[str] = None
+        self.value_start: Optional[int] = None
+        self.done = False
+
+    def feed(self, text: str) -> List[Tuple[str, object]]:
+        """Add a chunk and return the (name, value) fields it completed."""
+        self.buffer += text
+        fields = []
+        while self.position < len(self.buffer) and not self.done:
+            char = self.buffer[self.position]
+            index = self.position
+            self.position += 1
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1 and self.value_start is None and self.key_start is not None:
+                        self.key = json.loads(self.buffer[self.key_start:index + 1])
+                        self.key_start = None
+                continue
+            if char == '"':
+                self.in_string = True
+                if self.depth == 1 and self.value_start is None:
+                    self.key_start = index
+            elif char in "{[":
+                self.depth += 1
+            elif char == ":" and self.depth == 1 and self.value_start is None:
+                self.value_start = index + 1
+            elif char in ",}]" and self.depth == 1:
+                field = self._complete_field(index)
+                if field is not None:
+                    fields.append(field)
+                if char != ",":
+                    self.depth = 0
+                    self.done = True
+            elif char in "}]":
+                self.depth -= 1
+        return fields
+
+    def _complete_field(self, end: int) -> Optional[Tuple[str, object]]:
+        start, key = self.value_start, self.key
+        self.value_start = self.key = None
+        if start is None or key is None:
+            return None
+        try:
+            return key, json.loads(self.buffer[start:end])
+        except ValueError:
+            return None